@@ -16,11 +16,31 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 from datetime import datetime
 import io
+import re
+import hashlib
+import os
+import sys
+import threading
+import time
+import logging
+import weakref
+from collections import OrderedDict
+from contextlib import nullcontext
+from functools import wraps
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill
 import warnings
+import engine_log
+import memory_profile
+import metrics
+import rule_engine
+import run_cost
+from dataset_store import DatasetStore
+from job_runner import JobRunner, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_STATUS_LABELS
 warnings.filterwarnings('ignore')
 
+logger = engine_log.get_logger()
+
 # 設置頁面配置
 st.set_page_config(
     page_title="調貨建議生成系統",
@@ -59,15 +79,746 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# 預處理引擎版本：載入、清理或特徵欄位的邏輯改變時須更新，舊版本的磁碟快取項目不再使用
+DATASET_ENGINE_VERSION = "1.73-6"
+
+# 預處理數據集磁碟快取目錄（環境變數 TRANSFER_CACHE_DIR 設為空字串時停用）
+DATASET_STORE_DIR = os.environ.get(
+    "TRANSFER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "winmax_reallocation"))
+DATASET_STORE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+
+# 背景任務存儲保留的已完成任務結果總大小上限（按 _estimate_result_bytes 估算，超出時淘汰最早結束的任務）
+JOB_RESULTS_MAX_BYTES = 512 * 1024 * 1024
+
+@st.cache_resource
+def _get_process_state():
+    """
+    進程級共用狀態
+    streamlit run 每次重新執行都會重新定義本腳本的全域變數，
+    跨會話/跨重新執行的快取和任務執行器需經 cache_resource 保留
+    """
+    store = DatasetStore(DATASET_STORE_DIR, DATASET_ENGINE_VERSION, DATASET_STORE_MAX_BYTES)
+    if DATASET_STORE_DIR and not store.enabled:
+        logger.warning("未安裝 pyarrow，數據集磁碟快取已停用（重新啟動後需重新解析文件）")
+    return {
+        'chart_cache': OrderedDict(),
+        'chart_lock': threading.Lock(),
+        'dataset_cache': OrderedDict(),
+        'dataset_lock': threading.Lock(),
+        'dataset_store': store,
+        'active_systems': weakref.WeakSet(),
+        'job_runner': JobRunner(max_workers=2, max_result_bytes=JOB_RESULTS_MAX_BYTES,
+                                result_bytes=lambda result: result['nbytes'])
+    }
+
+_PROCESS_STATE = _get_process_state()
+
+# 圖表渲染快取（跨會話共用）：(建議指紋, 模式) -> PNG bytes
+_CHART_CACHE = _PROCESS_STATE['chart_cache']
+_CHART_CACHE_MAX_ENTRIES = 32
+_CHART_CACHE_LOCK = _PROCESS_STATE['chart_lock']
+
+# 圖表欄位英文名稱對照
+CHART_COLUMN_MAPPING = {
+    'ND轉出': 'ND Transfer',
+    'RF過剩轉出': 'RF Excess Transfer', 
+    'RF加強轉出': 'RF Enhanced Transfer',
+    '緊急缺貨補貨': 'Emergency Restock',
+    'SasaNet調撥接收': 'SasaNet Transfer Receive',
+    '潛在缺貨補貨': 'Potential Restock',
+    '重點補0': 'Critical Zero Restock'
+}
+
+CHART_TITLES = {
+    'A': 'OM Transfer vs Receive Analysis (Conservative Mode)',
+    'B': 'OM Transfer vs Receive Analysis (Enhanced Mode)',
+    'C': 'OM Transfer vs Receive Analysis (Critical Zero Restock Mode)'
+}
+
+def _chart_cache_get(key):
+    """讀取圖表快取並更新使用順序"""
+    with _CHART_CACHE_LOCK:
+        if key not in _CHART_CACHE:
+            return None
+        _CHART_CACHE.move_to_end(key)
+        return _CHART_CACHE[key]
+
+def _chart_cache_put(key, png_bytes):
+    """寫入圖表快取，超出上限時淘汰最久未使用的項目"""
+    with _CHART_CACHE_LOCK:
+        _CHART_CACHE[key] = png_bytes
+        _CHART_CACHE.move_to_end(key)
+        while len(_CHART_CACHE) > _CHART_CACHE_MAX_ENTRIES:
+            _CHART_CACHE.popitem(last=False)
+
+# 預處理數據集快取（跨會話共用，按文件內容雜湊定址）：
+# 內容雜湊 -> {'df', 'nbytes', 'preliminary_stats', 'features'}（後兩者在首次計算後填入）
+# 快取中的數據框為唯讀共用，引擎各階段不可原地修改 self.df
+_DATASET_CACHE = _PROCESS_STATE['dataset_cache']
+_DATASET_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+_DATASET_CACHE_LOCK = _PROCESS_STATE['dataset_lock']
+
+# 預處理數據集磁碟快取（跨進程重啟），記憶體快取未命中時使用
+_DATASET_STORE = _PROCESS_STATE['dataset_store']
+
+# 所有存活的系統實例，用於統計各會話記憶體
+_ACTIVE_SYSTEMS = _PROCESS_STATE['active_systems']
+
+# 背景任務執行器（跨會話共用，瀏覽器重新連線後仍可取回結果）
+_JOB_RUNNER = _PROCESS_STATE['job_runner']
+
+MODE_LABELS = {"A": "A: 保守轉貨", "B": "B: 加強轉貨", "C": "C: 重點補0"}
+
+# 全部模式比較任務的模式標籤
+COMPARISON_MODE = "ALL"
+
+# 調貨建議生成的階段（按執行順序）
+RECOMMENDATION_STAGES = ["識別轉出候選", "識別接收候選", "解決同店衝突", "匹配ND轉出", "匹配RF轉出", "計算統計"]
+COMPARISON_STAGES = ["識別轉出候選", "識別接收候選", "模式比較"]
+
+# 轉貨模式規則設定，由 rule_engine 編譯為特徵數據框上的向量化運算（層級設定格式見 rule_engine）
+# 新增模式只需在此加入設定及 MODE_LABELS 標籤
+ND_TRANSFER_TIER = {
+    'type': 'ND轉出', 'priority': 1,
+    'when': "Is_ND and Stock > 0",
+    'qty': "Stock"  # ND類型完全轉出，剩餘庫存為0
+}
+
+RECEIVE_TIERS = [
+    {'type': '緊急缺貨補貨', 'priority': 1,
+     'when': "Is_RF and Stock == 0 and Effective_Sales > 0",
+     'qty': "Safety", 'require_positive': False},
+    # v1.71 新增：SasaNet 調撥接收條件
+    {'type': 'SasaNet調撥接收', 'priority': 2,
+     'when': "Is_RF and Total_Available < Safety and Stock > 0",
+     'qty': "Safety - Total_Available"},
+    {'type': '潛在缺貨補貨', 'priority': 3,
+     'when': "Is_RF and Total_Available < Safety and Effective_Sales == Max_Sales",
+     'qty': "Safety - Total_Available"}
+]
+
+MODE_RULES = {
+    "A": {  # 保守轉貨：RF非最高銷量店鋪轉出高於安全庫存的部分
+        'transfer': [
+            ND_TRANSFER_TIER,
+            {'type': 'RF過剩轉出', 'priority': 2,
+             'when': "Is_RF and Effective_Sales < Max_Sales and Total_Available > Safety",
+             'qty': "Total_Available - Safety",
+             'cap': {'pct': 0.2, 'min': 2},
+             'limit': "Stock"}
+        ],
+        'receive': RECEIVE_TIERS,
+        'receive_sort': [('Priority', True), ('Effective_Sales', False)]
+    },
+    "B": {  # 加強轉貨：門檻降至 MOQ + 1，剩餘庫存低於安全庫存時為加強轉出
+        'transfer': [
+            ND_TRANSFER_TIER,
+            {'type': 'RF過剩轉出', 'priority': 2,
+             'when': "Is_RF and Effective_Sales < Max_Sales and Total_Available > MOQ + @moq_margin",
+             'qty': "Total_Available - MOQ - @moq_margin",
+             'cap': {'pct': 0.5, 'min': 2},
+             'limit': "Stock",
+             'retype': [("Stock - Qty < Safety", 'RF加強轉出')],
+             'params': {'moq_margin': 1}}
+        ],
+        'receive': RECEIVE_TIERS,
+        'receive_sort': [('Priority', True), ('Effective_Sales', False)]
+    },
+    "C": {  # 重點補0 - v1.73：只有ND轉出，RF總可用量 ≤ 1 補充至 min(Safety Stock, MOQ + 1)
+        'transfer': [ND_TRANSFER_TIER],
+        'receive': [
+            {'type': '重點補0', 'priority': 1,
+             'derive': {'Target_Stock': ('min', "Safety", "MOQ + 1")},
+             'when': "Is_RF and Total_Available <= 1",
+             'qty': "Target_Stock - Total_Available"}
+        ],
+        'receive_sort': [('Effective_Sales', False)],
+        'receive_fields': {'MOQ': 'MOQ', 'Target_Stock': 'Target_Stock'}
+    }
+}
+
+# 候選記錄欄位 {輸出欄位: 特徵欄位或表達式}
+TRANSFER_FIELDS = {
+    'Article': 'Article',
+    'Site': 'Site',
+    'OM': 'OM',
+    'Transfer_Qty': 'Qty',
+    'Type': 'Type',
+    'Priority': 'Priority',
+    'Original_Stock': 'Stock',
+    'Safety_Stock': 'Safety',
+    'MOQ': 'MOQ',
+    'Effective_Sales': 'Effective_Sales',
+    'Total_Available': 'Total_Available',
+    'Remaining_Stock': "Stock - Qty"
+}
+TRANSFER_SORT = [('Priority', True), ('Effective_Sales', True)]  # 低銷量優先轉出
+
+RECEIVE_FIELDS = {
+    'Article': 'Article',
+    'Site': 'Site',
+    'OM': 'OM',
+    'Need_Qty': 'Qty',
+    'Type': 'Type',
+    'Priority': 'Priority',
+    'Current_Stock': 'Stock',
+    'Safety_Stock': 'Safety',
+    'Effective_Sales': 'Effective_Sales',
+    'Pending_Received': 'Pending',
+    'Total_Available': 'Total_Available'
+}
+
+def sweep_tier(mode):
+    """返回模式中可作參數掃描的轉出層級（設有轉出上限者）；沒有時返回None"""
+    rules = MODE_RULES.get(mode, {})
+    return next((tier for tier in rules.get('transfer', ()) if tier.get('cap')), None)
+
+# 預先統計各模式的鍵名
+PRELIMINARY_STATS_KEYS = {"A": 'conservative', "B": 'enhanced', "C": 'critical_restock'}
+
+# 預先統計抽樣估算：樣本約 PREVIEW_SAMPLE_ROWS 行，信賴區間為 ±z×標準誤（1.96 即95%）
+PREVIEW_SAMPLE_ROWS = 20000
+PREVIEW_CONFIDENCE_Z = 1.96
+
+class ProgressThrottle:
+    """
+    節流的階段進度回報
+    每約1%的進度才檢查一次時間，且兩次回報間隔不少於 min_interval 秒，
+    熱循環內每次 update 只是一次整數比較
+    """
+    
+    def __init__(self, callback, stage, total, min_interval=0.2):
+        self.callback = callback
+        self.stage = stage
+        self.total = total
+        self.min_interval = min_interval
+        self._stride = max(total // 100, 1)
+        self._next_check = self._stride
+        self._last_report = time.monotonic()
+        callback(stage, 0, total)
+    
+    def update(self, done):
+        if done < self._next_check:
+            return
+        self._next_check = done + self._stride
+        now = time.monotonic()
+        if now - self._last_report >= self.min_interval:
+            self._last_report = now
+            self.callback(self.stage, done, self.total)
+    
+    def finish(self):
+        self.callback(self.stage, self.total, self.total)
+
+class _NullProgress:
+    """未設置進度回報函數時使用的空實現"""
+    
+    def update(self, done):
+        pass
+    
+    def finish(self):
+        pass
+
+_NULL_PROGRESS = _NullProgress()
+
+def logging_progress_callback(logger=None, level=logging.INFO):
+    """返回將進度寫入日誌的回報函數（命令行使用）"""
+    logger = logger or engine_log.get_logger()
+    
+    def report(stage, done, total):
+        if total:
+            logger.log(level, "%s: %d/%d (%.0f%%)", stage, done, total, done * 100.0 / total)
+        else:
+            logger.log(level, "%s", stage)
+    
+    return report
+
+def _dataset_cache_get(content_hash):
+    """讀取預處理數據集快取"""
+    with _DATASET_CACHE_LOCK:
+        entry = _DATASET_CACHE.get(content_hash)
+        if entry is not None:
+            _DATASET_CACHE.move_to_end(content_hash)
+        return entry
+
+def _dataset_cache_put(content_hash, entry):
+    """寫入預處理數據集快取，超出容量時淘汰最久未使用的數據集"""
+    with _DATASET_CACHE_LOCK:
+        _DATASET_CACHE[content_hash] = entry
+        _DATASET_CACHE.move_to_end(content_hash)
+        total = sum(item['nbytes'] for item in _DATASET_CACHE.values())
+        while total > _DATASET_CACHE_MAX_BYTES and len(_DATASET_CACHE) > 1:
+            _, evicted = _DATASET_CACHE.popitem(last=False)
+            total -= evicted['nbytes']
+
+def _dataset_cache_update(content_hash, **fields):
+    """更新已快取數據集的延遲計算結果，並寫入磁碟快取"""
+    with _DATASET_CACHE_LOCK:
+        entry = _DATASET_CACHE.get(content_hash)
+        if entry is not None:
+            entry.update(fields)
+    _DATASET_STORE.update(content_hash, **fields)
+
+def _dataset_cache_entry(df, preliminary_stats=None, features=None, reports=None):
+    """建立記憶體數據集快取項目"""
+    return {
+        'df': df,
+        'preliminary_stats': preliminary_stats,
+        'features': features,
+        'reports': reports or {},
+        'nbytes': int(df.memory_usage(deep=True).sum())
+    }
+
+def dataset_cache_usage():
+    """返回共用數據集快取的 (數據集數, 總bytes)"""
+    with _DATASET_CACHE_LOCK:
+        return len(_DATASET_CACHE), sum(item['nbytes'] for item in _DATASET_CACHE.values())
+
+def active_sessions_memory():
+    """返回所有存活會話的記憶體使用列表"""
+    return [system.memory_usage() for system in list(_ACTIVE_SYSTEMS)]
+
+def _record_load_metrics(source, rows, started):
+    """記錄數據載入指標（source: parse, memory, disk）"""
+    metrics.ROWS_LOADED.inc(rows, source=source)
+    metrics.LOAD_SECONDS.observe(time.perf_counter() - started, source=source)
+    metrics.flush()
+
+def _record_run_metrics(mode, transfer_count, receive_count, conflict_count, suggestion_count, match_seconds):
+    """記錄單一模式生成建議的指標"""
+    metrics.CANDIDATES.inc(transfer_count, mode=mode, kind="transfer")
+    metrics.CANDIDATES.inc(receive_count, mode=mode, kind="receive")
+    metrics.CONFLICTS.inc(conflict_count, mode=mode)
+    metrics.SUGGESTIONS.inc(suggestion_count, mode=mode)
+    metrics.MATCH_SECONDS.observe(match_seconds, mode=mode)
+    metrics.flush()
+
+def _read_upload_bytes(uploaded_file):
+    """讀取上傳文件內容（支援Streamlit UploadedFile、文件物件和路徑）"""
+    if isinstance(uploaded_file, bytes):
+        return uploaded_file
+    if isinstance(uploaded_file, str):
+        with open(uploaded_file, 'rb') as f:
+            return f.read()
+    if hasattr(uploaded_file, 'getvalue'):
+        return uploaded_file.getvalue()
+    return uploaded_file.read()
+
+def dataset_cache_key(content, consolidate_duplicates=True):
+    """按文件內容雜湊生成數據集鍵值；是否合併重複行的結果分開快取"""
+    key = hashlib.sha256(content).hexdigest()
+    return key + "-consolidated" if consolidate_duplicates else key
+
+# 上傳文件必需欄位
+REQUIRED_COLUMNS = [
+    'Article', 'Article Description', 'RP Type', 'Site', 'OM',
+    'MOQ', 'SaSa Net Stock', 'Pending Received', 'Safety Stock',
+    'Last Month Sold Qty', 'MTD Sold Qty'
+]
+VALID_RP_TYPES = ['ND', 'RF']
+SALES_CAP = 100000  # 銷量異常值上限
+
+# 重複 (Article, Site) 行（同一店舖產品按子位置分行）的合併規則：
+# 庫存及銷量加總，政策欄位取最大值，未列出的欄位取組內首行
+CONSOLIDATION_KEYS = ['Article', 'Site']
+CONSOLIDATION_RULES = {
+    'SaSa Net Stock': 'sum',
+    'Pending Received': 'sum',
+    'Last Month Sold Qty': 'sum',
+    'MTD Sold Qty': 'sum',
+    'Safety Stock': 'max',
+    'MOQ': 'max'
+}
+
+# 預處理後的緊湊欄位類型
+# 數量欄位在數值範圍可容納時降為 int32；上限保留一半範圍，兩個數量相加（如 Stock + Pending）不會溢出
+QUANTITY_COLUMNS = ['MOQ', 'SaSa Net Stock', 'Pending Received', 'Safety Stock',
+                    'Last Month Sold Qty', 'MTD Sold Qty']
+QUANTITY_DTYPE = np.int32
+QUANTITY_LIMIT = 2 ** 30
+# 重複度高的文字欄位轉為類別
+CATEGORICAL_COLUMNS = ['Article', 'Article Description', 'RP Type', 'Site', 'OM']
+
+def compact_dtypes(df):
+    """
+    按緊湊欄位類型轉換數據框，返回 (新數據框, 報告)
+    數量欄位只在全部為整數且絕對值不超過 QUANTITY_LIMIT 時降為 QUANTITY_DTYPE，否則保留原類型；
+    報告: {'before_bytes', 'after_bytes', 'columns': {欄位: (原類型, 新類型)}}
+    """
+    converted = {}
+    for column in QUANTITY_COLUMNS:
+        if column not in df.columns or not pd.api.types.is_integer_dtype(df[column]):
+            continue
+        values = df[column].to_numpy()
+        if len(values) == 0 or (values.min() >= -QUANTITY_LIMIT and values.max() <= QUANTITY_LIMIT):
+            converted[column] = values.astype(QUANTITY_DTYPE)
+    for column in CATEGORICAL_COLUMNS:
+        if column in df.columns and not isinstance(df[column].dtype, pd.CategoricalDtype):
+            converted[column] = pd.Categorical(df[column])
+    
+    compact = df.assign(**converted)
+    report = {
+        'before_bytes': int(df.memory_usage(deep=True).sum()),
+        'after_bytes': int(compact.memory_usage(deep=True).sum()),
+        'columns': {column: (str(df[column].dtype), str(compact[column].dtype)) for column in converted}
+    }
+    return compact, report
+
+# 數據質量標記：預處理的修正以位元遮罩記錄在 Quality_Flags 欄位（每類修正一個位元，按備註順序排列），
+# 備註文字只在顯示或匯出時按需生成
+QUALITY_FLAGS_COLUMN = 'Quality_Flags'
+QUALITY_FLAGS_DTYPE = np.uint16
+QUALITY_ISSUES = [
+    note
+    for column in QUANTITY_COLUMNS
+    for note in ([f"{column}負值修正為0", f"{column}異常值>100000修正"] if 'Sold Qty' in column
+                 else [f"{column}負值修正為0"])
+] + ["RP Type無效值"]
+QUALITY_FLAGS = {issue: QUALITY_FLAGS_DTYPE(1 << bit) for bit, issue in enumerate(QUALITY_ISSUES)}
+
+def render_quality_notes(flags):
+    """按數據質量標記生成備註文字（格式如 "MOQ負值修正為0; RP Type無效值; "），每種標記組合只生成一次"""
+    flags = np.asarray(flags)
+    combinations, inverse = np.unique(flags, return_inverse=True)
+    texts = np.array([
+        "".join(f"{issue}; " for issue, bit in QUALITY_FLAGS.items() if combination & bit)
+        for combination in combinations
+    ], dtype=object)
+    return texts[inverse.reshape(-1)]
+
+def quality_summary(flags):
+    """按修正類型統計行數，返回只包含有修正的類型的數據框（修正類型, 行數）"""
+    bits = np.array(list(QUALITY_FLAGS.values()), dtype=QUALITY_FLAGS_DTYPE)
+    counts = (np.bitwise_and.outer(np.asarray(flags, dtype=QUALITY_FLAGS_DTYPE), bits) != 0).sum(axis=0)
+    summary = pd.DataFrame({'修正類型': QUALITY_ISSUES, '行數': counts})
+    return summary[summary['行數'] > 0].reset_index(drop=True)
+
+def consolidate_duplicates_rows(df, rules=None):
+    """
+    合併重複的 (Article, Site) 行，返回 (新數據框, 報告)
+    以一次 groupby 按 rules（預設 CONSOLIDATION_RULES）彙總，數據質量標記取位元或；
+    合併後每組一行，按各組首行的順序排列；沒有重複行時返回原數據框
+    報告: {'rows_before', 'rows_after', 'collapsed_rows', 'duplicate_groups'}
+    """
+    rules = CONSOLIDATION_RULES if rules is None else rules
+    rows_before = len(df)
+    duplicated = df.duplicated(CONSOLIDATION_KEYS, keep='first').to_numpy()
+    n_collapsed = int(np.count_nonzero(duplicated))
+    if n_collapsed == 0:
+        return df, {'rows_before': rows_before, 'rows_after': rows_before, 'collapsed_rows': 0, 'duplicate_groups': 0}
+    
+    grouped = df.groupby(CONSOLIDATION_KEYS, sort=False, dropna=False)
+    aggregations = {column: rules.get(column, 'first') for column in df.columns
+                    if column not in CONSOLIDATION_KEYS and column != QUALITY_FLAGS_COLUMN}
+    merged = grouped.agg(aggregations).reset_index()
+    if QUALITY_FLAGS_COLUMN in df.columns:
+        flags = np.zeros(len(merged), dtype=df[QUALITY_FLAGS_COLUMN].dtype)
+        np.bitwise_or.at(flags, grouped.ngroup().to_numpy(), df[QUALITY_FLAGS_COLUMN].to_numpy())
+        merged[QUALITY_FLAGS_COLUMN] = flags
+    merged = merged[list(df.columns)]
+    
+    duplicate_groups = int(df.loc[duplicated, CONSOLIDATION_KEYS].drop_duplicates().shape[0])
+    return merged, {
+        'rows_before': rows_before,
+        'rows_after': len(merged),
+        'collapsed_rows': n_collapsed,
+        'duplicate_groups': duplicate_groups
+    }
+
+# 數據驗證報告：每類問題一行，範例行號為Excel行號（標題為第1行）
+VALIDATION_COLUMNS = ['問題類型', '欄位', '嚴重程度', '行數', '範例行號']
+VALIDATION_ERROR = "錯誤"
+VALIDATION_WARNING = "警告"
+VALIDATION_SAMPLE_ROWS = 5
+# 欄位中超過此比例的儲存格無法使用（非數值或RP Type無效）時視為數據抽取錯誤
+VALIDATION_MAX_INVALID_RATIO = 0.5
+
+def validate_input(df, renamed_columns=()):
+    """
+    向量化驗證原始數據（預處理前），返回驗證報告數據框（VALIDATION_COLUMNS）
+    錯誤: 缺少必需欄位、沒有數據行、超過 VALIDATION_MAX_INVALID_RATIO 的非數值或無效RP Type；
+    警告: 無法識別的欄位名稱、非數值、空白、負值、銷量超出上限、無效RP Type、
+          重複 (Article, Site) 行、同一Site對應多個OM（預處理會修正或保留，不影響載入）
+    """
+    issues = []
+    excel_rows = np.arange(len(df)) + 2
+    invalid_limit = VALIDATION_MAX_INVALID_RATIO * len(df)
+    
+    def add(issue, column, mask=None, severity=VALIDATION_WARNING):
+        if mask is None:
+            issues.append([issue, column, severity, 0, []])
+            return
+        count = int(np.count_nonzero(mask))
+        if count:
+            issues.append([issue, column, severity, count, excel_rows[mask][:VALIDATION_SAMPLE_ROWS].tolist()])
+    
+    for column in renamed_columns:
+        add('無法識別的欄位名稱', column)
+    for column in REQUIRED_COLUMNS:
+        if column not in df.columns:
+            add('缺少必需欄位', column, severity=VALIDATION_ERROR)
+    if len(df) == 0:
+        add('沒有數據行', '', severity=VALIDATION_ERROR)
+    
+    for column in QUANTITY_COLUMNS:
+        if column not in df.columns:
+            continue
+        numeric = pd.to_numeric(df[column], errors='coerce')
+        blank = df[column].isna().to_numpy()
+        non_numeric = numeric.isna().to_numpy() & ~blank
+        add('非數值', column, non_numeric,
+            VALIDATION_ERROR if non_numeric.sum() > invalid_limit else VALIDATION_WARNING)
+        add('空白', column, blank)
+        values = numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+        add('負值', column, values < 0)
+        if 'Sold Qty' in column:
+            add('超出上限', column, values > SALES_CAP)
+    
+    if 'RP Type' in df.columns:
+        invalid = ~df['RP Type'].astype(str).str.strip().isin(VALID_RP_TYPES).to_numpy()
+        add('RP Type無效值', 'RP Type', invalid,
+            VALIDATION_ERROR if invalid.sum() > invalid_limit else VALIDATION_WARNING)
+    if 'Article' in df.columns and 'Site' in df.columns:
+        add('重複 (Article, Site)', 'Article, Site', df.duplicated(['Article', 'Site'], keep=False).to_numpy())
+    if 'Site' in df.columns and 'OM' in df.columns:
+        om_count = df.groupby('Site', dropna=False)['OM'].transform('nunique')
+        add('Site對應多個OM', 'Site, OM', (om_count > 1).to_numpy())
+    
+    return pd.DataFrame(issues, columns=VALIDATION_COLUMNS)
+
+def format_validation_issues(issues):
+    """把驗證問題格式化為一行訊息"""
+    missing = issues.loc[issues['問題類型'] == '缺少必需欄位', '欄位'].tolist()
+    parts = [f"缺少必需欄位: {', '.join(missing)}"] if missing else []
+    for issue in issues[issues['問題類型'] != '缺少必需欄位'].itertuples(index=False):
+        text = f"{issue[0]} {issue[1]}".strip()
+        if issue[3]:
+            sample = ", ".join(str(row) for row in issue[4])
+            text += f": {issue[3]} 行（例如第 {sample} 行）"
+        parts.append(text)
+    return "數據驗證失敗 - " + "; ".join(parts)
+
+def effective_sales(df):
+    """有效銷量：上月銷量大於0時使用上月銷量，否則使用本月至今銷量"""
+    last_month = df['Last Month Sold Qty'].to_numpy()
+    return np.where(last_month > 0, last_month, df['MTD Sold Qty'].to_numpy())
+
+def build_feature_frame(df, max_sales=None):
+    """
+    建立候選識別規則使用的特徵數據框
+    max_sales: 與 df 行對齊的產品最高銷量；未提供時按 df 內同一 Article 的有效銷量計算
+    （只傳入部分行時須提供按全部行計算的值）
+    """
+    sales = effective_sales(df)
+    features = pd.DataFrame({
+        'Stock': df['SaSa Net Stock'].to_numpy(),
+        'Pending': df['Pending Received'].to_numpy(),
+        'Safety': df['Safety Stock'].to_numpy(),
+        'MOQ': df['MOQ'].to_numpy(),
+        'Effective_Sales': sales,
+        'Is_ND': (df['RP Type'] == 'ND').to_numpy(),
+        'Is_RF': (df['RP Type'] == 'RF').to_numpy()
+    }, index=df.index)
+    features['Total_Available'] = features['Stock'] + features['Pending']
+    if max_sales is None:
+        max_sales = features['Effective_Sales'].groupby(
+            df['Article'].to_numpy(), dropna=False).transform('max').to_numpy()
+    features['Max_Sales'] = max_sales
+    return features
+
+def stratified_ratio_total(y, rows, stratum, population_clusters, population_rows):
+    """
+    分層整群抽樣的比率估計：各層以樣本群組的 總量/行數 比率乘以該層總行數
+    y, rows, stratum: 各樣本群組的總量、行數及所屬層
+    population_clusters, population_rows: 各層的群組總數及總行數
+    返回 (總量估計, 估計方差)；整層抽取時該層方差為0
+    """
+    n_strata = len(population_clusters)
+    n = np.bincount(stratum, minlength=n_strata).astype(np.float64)
+    y_sum = np.bincount(stratum, weights=y, minlength=n_strata)
+    row_sum = np.bincount(stratum, weights=rows, minlength=n_strata)
+    ratio = np.divide(y_sum, row_sum, out=np.zeros(n_strata), where=row_sum > 0)
+    
+    # 線性化方差：殘差 y - 比率 × 行數 的樣本方差，乘以有限總體校正
+    residual = y - ratio[stratum] * rows
+    s2 = np.divide(np.bincount(stratum, weights=residual ** 2, minlength=n_strata), n - 1,
+                   out=np.zeros(n_strata), where=n > 1)
+    fpc = 1 - np.divide(n, population_clusters, out=np.ones(n_strata), where=population_clusters > 0)
+    variance = np.divide(population_clusters.astype(np.float64) ** 2 * fpc * s2, n,
+                         out=np.zeros(n_strata), where=n > 0)
+    return float((ratio * population_rows).sum()), float(variance.sum())
+
+def allocate_cumulative(donor_group, donor_qty, receiver_group, receiver_need):
+    """
+    累計區間分配核心 - 一次批量計算所有組的貪婪填充
+    組內按順序的轉出方依次填滿按順序的接收方，直到任一方用完，
+    等價於兩組累計和區間的重疊：轉出方 j 佔 [D_j-1, D_j)，接收方 i 佔 [R_i-1, R_i)，
+    分配量為兩區間重疊長度。各組在全局座標上依次排開，互不重疊，
+    因此全部組可用一次 np.searchsorted 求出所有重疊對。
+    
+    參數須按組編號排序，組內按匹配優先順序排列；數量不大於0的項目視為空區間。
+    返回 (轉出方位置, 接收方位置, 分配量)，按接收方、再按轉出方順序排列。
+    """
+    donor_group = np.asarray(donor_group, dtype=np.int64)
+    receiver_group = np.asarray(receiver_group, dtype=np.int64)
+    donor_qty = np.maximum(np.asarray(donor_qty, dtype=np.int64), 0)
+    receiver_need = np.maximum(np.asarray(receiver_need, dtype=np.int64), 0)
+    
+    empty = np.array([], dtype=np.int64)
+    if len(donor_qty) == 0 or len(receiver_need) == 0:
+        return empty, empty, empty
+    
+    n_groups = int(max(donor_group.max(), receiver_group.max())) + 1
+    donor_total = np.bincount(donor_group, weights=donor_qty, minlength=n_groups).astype(np.int64)
+    receiver_total = np.bincount(receiver_group, weights=receiver_need, minlength=n_groups).astype(np.int64)
+    
+    # 每組在全局座標上的起點
+    span = np.maximum(donor_total, receiver_total)
+    base = np.cumsum(span) - span
+    donor_offset = np.cumsum(donor_total) - donor_total
+    receiver_offset = np.cumsum(receiver_total) - receiver_total
+    
+    donor_end = np.cumsum(donor_qty) - donor_offset[donor_group] + base[donor_group]
+    donor_start = donor_end - donor_qty
+    receiver_end = np.cumsum(receiver_need) - receiver_offset[receiver_group] + base[receiver_group]
+    receiver_start = receiver_end - receiver_need
+    
+    # 與接收方 i 重疊的轉出方為 [lo_i, hi_i)
+    lo = np.searchsorted(donor_end, receiver_start, side='right')
+    hi = np.searchsorted(donor_start, receiver_end, side='left')
+    counts = np.maximum(hi - lo, 0)
+    
+    receiver_pos = np.repeat(np.arange(len(receiver_need)), counts)
+    pair_offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    donor_pos = np.repeat(lo, counts) + pair_offset
+    
+    qty = (np.minimum(receiver_end[receiver_pos], donor_end[donor_pos]) -
+           np.maximum(receiver_start[receiver_pos], donor_start[donor_pos]))
+    keep = qty > 0
+    return donor_pos[keep], receiver_pos[keep], qty[keep]
+
+# 同店舖同SKU衝突表欄位
+CONFLICT_COLUMNS = ['Site', 'Article', 'OM', 'Transfer_Qty', 'Transfer_Type', 'Receive_Qty', 'Receive_Type']
+
+# 衝突表匯出/顯示用欄位名稱
+CONFLICT_COLUMN_LABELS = {
+    'Site': '店舖',
+    'Article': '產品編號',
+    'OM': 'OM',
+    'Transfer_Qty': '移除轉出數量',
+    'Transfer_Type': '轉出類型',
+    'Receive_Qty': '保持接收數量',
+    'Receive_Type': '接收類型'
+}
+
+def candidate_key_codes(left, right, columns=('Site', 'Article', 'OM')):
+    """
+    將兩組候選記錄的複合鍵編碼為 int64
+    每個欄位以兩組共用的類別編碼，再按混合進位合併，相同鍵值得到相同編碼
+    """
+    n_left = len(left)
+    left_codes = np.zeros(n_left, dtype=np.int64)
+    right_codes = np.zeros(len(right), dtype=np.int64)
+    for column in columns:
+        categorical = pd.Categorical([item[column] for item in left] + [item[column] for item in right])
+        codes = categorical.codes.astype(np.int64) + 1  # 缺失值編碼為0
+        radix = len(categorical.categories) + 1
+        left_codes = left_codes * radix + codes[:n_left]
+        right_codes = right_codes * radix + codes[n_left:]
+    return left_codes, right_codes
+
+def _memory_profiled(stage, reset=False):
+    """
+    方法裝飾器：啟用記憶體分析時把整個方法記錄為一個頂層階段
+    reset: 開始前清除先前的階段（新的 載入 → 生成建議 → 匯出 流程）
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.memory_profiler is None:
+                return method(self, *args, **kwargs)
+            if reset:
+                self.memory_profiler.reset()
+            with self.memory_profiler.stage(stage):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
 class TransferRecommendationSystem:
     """調貨建議系統核心類"""
     
-    def __init__(self):
+    # 每個會話保留的結果集記憶體上限（超出時按LRU淘汰非當前模式的結果集）
+    session_memory_budget = 256 * 1024 * 1024
+    
+    def __init__(self, register_session=True):
+        """register_session: 登記為活躍會話（記憶體使用統計）；背景任務的工作實例不登記"""
         self.df = None
+        self.dataset_key = None  # 上傳文件內容雜湊
+        self.dtype_report = None  # 緊湊欄位類型轉換報告（compact_dtypes）
+        self.validation_report = None  # 最近一次載入的數據驗證報告（validate_input）
+        self.consolidation_report = None  # 重複 (Article, Site) 行合併報告（consolidate_duplicates_rows）
         self.transfer_suggestions = None
         self.statistics = None
         self.mode = "A"  # A: 保守轉貨, B: 加強轉貨, C: 重點補0
+        self.result_sets = OrderedDict()  # 模式 -> {'suggestions', 'statistics', 'nbytes'}
+        self.comparison = None  # 全部模式比較摘要 {'modes', 'summary'}
+        self.progress_callback = None  # 生成建議時的進度回報函數
+        self.run_counters = None  # 生成建議時的引擎計數（engine_log.EngineCounters）
+        # 記憶體分析器（memory_profile.MemoryProfiler），環境變數 TRANSFER_MEMORY_PROFILE=1 時啟用
+        self.memory_profiler = memory_profile.MemoryProfiler() if memory_profile.enabled() else None
+        self._preliminary_stats = None
+        self._preliminary_lock = threading.Lock()
+        self._preliminary_thread = None
+        self._preliminary_estimate = None  # 預先統計抽樣估算快取
+        self._preliminary_estimate_source = None  # 抽樣估算對應的 self.df
+        self._feature_frame = None  # 特徵數據框快取
+        self._feature_frame_source = None  # 特徵數據框對應的 self.df
+        self._suggestions_key = None  # (建議列表, 模式, 指紋)；保存列表本身，id 在列表回收後可能被重用
+        self._suggestion_view = None  # 分頁表格的數據框、預計算索引及佔用bytes
+        self._export = None  # 已生成的Excel報告 (建議指紋, bytes, 文件名)，只在使用者要求匯出時生成
+        self._dataset_bytes = 0  # self.df 佔用bytes（記憶體使用報告用）
+        self._dataset_bytes_source = None  # 佔用bytes對應的 self.df
+        if register_session:
+            _ACTIVE_SYSTEMS.add(self)
         
+    @property
+    def preliminary_stats(self):
+        """預先統計（延遲計算）：首次讀取時計算，已在背景計算時等待其完成"""
+        if self._preliminary_stats is None and self.df is not None:
+            self._compute_preliminary_statistics()
+        return self._preliminary_stats
+    
+    @preliminary_stats.setter
+    def preliminary_stats(self, value):
+        self._preliminary_stats = value
+    
+    def preliminary_stats_ready(self):
+        """預先統計是否已計算完成"""
+        return self._preliminary_stats is not None
+    
+    def start_preliminary_statistics(self):
+        """在背景執行緒計算預先統計，頁面可先顯示數據預覽"""
+        if self.df is None or self.preliminary_stats_ready():
+            return
+        if self._preliminary_thread is not None and self._preliminary_thread.is_alive():
+            return
+        self._preliminary_thread = threading.Thread(target=self._compute_preliminary_statistics,
+                                                    name="preliminary-stats", daemon=True)
+        self._preliminary_thread.start()
+    
+    def _compute_preliminary_statistics(self):
+        """計算預先統計並寫入共用數據集快取，供其他會話及生成建議時重用"""
+        with self._preliminary_lock:
+            if self._preliminary_stats is not None:
+                return
+            df, dataset_key = self.df, self.dataset_key
+            stats = self.calculate_preliminary_statistics()
+            
+            # 計算期間已切換數據集時丟棄結果
+            if self.df is df:
+                self._preliminary_stats = stats
+                if dataset_key is not None:
+                    _dataset_cache_update(dataset_key, preliminary_stats=stats, features=self.get_feature_frame())
+    
     def calculate_preliminary_statistics(self):
         """計算預先統計數據（預計需求、轉出、接收數量）"""
         if self.df is None:
@@ -84,37 +835,279 @@ class TransferRecommendationSystem:
             'critical_restock': stats_c
         }
     
-    def _calculate_mode_statistics(self, mode):
-        """計算指定模式的統計數據"""
-        transfer_candidates = self.identify_transfer_candidates(mode)
+    def estimate_preliminary_statistics(self, sample_rows=PREVIEW_SAMPLE_ROWS, z=PREVIEW_CONFIDENCE_Z, seed=0):
+        """
+        抽樣快速估算預先統計，供完整計算完成前顯示（按 self.df 快取）
+        按OM分層，每層按比例隨機抽取 (Article, OM) 組並保留組內全部行（整群抽樣，每層至少2組），
+        在樣本行上評估模式規則後以比率估計推算總量及信賴區間。產品最高銷量按全部行計算，
+        樣本行的規則結果與完整計算相同；數據不多於 sample_rows 行時全部抽取，結果為精確值
+        返回與 preliminary_stats 相同格式，各模式另含 *_margin（信賴區間半寬），'sample' 為抽樣資訊
+        """
+        df = self.df
+        if df is None:
+            return {}
+        if self._preliminary_estimate is not None and self._preliminary_estimate_source is df:
+            return self._preliminary_estimate
         
-        # C模式使用專門的接收候選識別函數
-        if mode == "C":
-            receive_candidates = self.identify_receive_candidates_mode_c()
+        n_rows = len(df)
+        om_codes, oms = pd.factorize(df['OM'])
+        article_codes, articles = pd.factorize(df['Article'])
+        stratum = om_codes.astype(np.int64) + 1  # 第0層為空白OM
+        n_strata = len(oms) + 1
+        cluster, _ = pd.factorize(stratum * (len(articles) + 1) + article_codes + 1)
+        n_clusters = int(cluster.max()) + 1 if n_rows else 0
+        cluster_stratum = np.zeros(n_clusters, dtype=np.int64)
+        cluster_stratum[cluster] = stratum
+        cluster_rows = np.bincount(cluster, minlength=n_clusters)
+        population_clusters = np.bincount(cluster_stratum, minlength=n_strata)
+        population_rows = np.bincount(stratum, minlength=n_strata)
+        
+        # 各層以隨機鍵排序群組後取前 n_h 組
+        fraction = min(1.0, sample_rows / n_rows) if n_rows else 1.0
+        take = np.minimum(population_clusters, np.maximum(2, np.ceil(population_clusters * fraction)))
+        order = np.lexsort((np.random.default_rng(seed).random(n_clusters), cluster_stratum))
+        starts = np.cumsum(population_clusters) - population_clusters
+        rank = np.empty(n_clusters, dtype=np.int64)
+        rank[order] = np.arange(n_clusters) - starts[cluster_stratum[order]]
+        chosen = np.flatnonzero(rank < take[cluster_stratum])
+        local = np.full(n_clusters, -1, dtype=np.int64)
+        local[chosen] = np.arange(len(chosen))
+        rows = np.flatnonzero(local[cluster] >= 0)
+        
+        # 樣本特徵：已有完整特徵數據框時直接取行，否則只按全部行計算產品最高銷量
+        if self._feature_frame is not None and self._feature_frame_source is df:
+            sample = self._feature_frame.iloc[rows]
         else:
-            receive_candidates = self.identify_receive_candidates()
+            sales = effective_sales(df)
+            max_by_article = np.full(len(articles) + 1, np.iinfo(sales.dtype).min, dtype=sales.dtype)
+            np.maximum.at(max_by_article, article_codes + 1, sales)
+            sample = build_feature_frame(df.iloc[rows], max_sales=max_by_article[article_codes[rows] + 1])
+        
+        sample_cluster = local[cluster[rows]]
+        estimator_args = (cluster_rows[chosen], cluster_stratum[chosen], population_clusters, population_rows)
+        estimate = {}
+        for mode, key in PRELIMINARY_STATS_KEYS.items():
+            _, transfer_qty, _ = rule_engine.evaluate_tiers(sample, MODE_RULES[mode]['transfer'])
+            totals = {}
+            for name, qty in (('transfer', transfer_qty), ('receive', self._receive_need(sample, mode))):
+                y = np.bincount(sample_cluster, weights=qty, minlength=len(chosen))
+                total, variance = stratified_ratio_total(y, *estimator_args)
+                totals[name] = (int(round(total)), int(np.ceil(z * np.sqrt(variance))))
+            estimate[key] = {
+                'estimated_transfer': totals['transfer'][0],
+                'estimated_receive': totals['receive'][0],
+                'estimated_demand': totals['receive'][0],  # 需求等於接收
+                'transfer_margin': totals['transfer'][1],
+                'receive_margin': totals['receive'][1],
+                'demand_margin': totals['receive'][1]
+            }
+        estimate['sample'] = {
+            'rows': len(rows), 'total_rows': n_rows,
+            'clusters': len(chosen), 'total_clusters': n_clusters, 'z': z
+        }
         
-        total_transfer = sum(candidate['Transfer_Qty'] for candidate in transfer_candidates)
-        total_receive = sum(candidate['Need_Qty'] for candidate in receive_candidates)
+        self._preliminary_estimate = estimate
+        self._preliminary_estimate_source = df
+        return estimate
+    
+    def get_feature_frame(self):
+        """
+        取得特徵數據框（按 self.df 快取）
+        包含候選識別規則所需的數值欄位及有效銷量、產品最高銷量、總可用量
+        """
+        df = self.df
+        if self._feature_frame is not None and self._feature_frame_source is df:
+            return self._feature_frame
+        
+        features = build_feature_frame(df)
+        self._feature_frame = features
+        self._feature_frame_source = df
+        return features
+    
+    def _calculate_mode_statistics(self, mode):
+        """
+        計算指定模式的統計數據
+        直接以特徵數據框上編譯後的模式規則求和，不建立候選記錄
+        """
+        f = self.get_feature_frame()
+        rules = MODE_RULES[mode]
+        _, transfer_qty, _ = rule_engine.evaluate_tiers(f, rules['transfer'])
+        total_receive = self._receive_need(f, mode).sum()
         
         return {
-            'estimated_transfer': total_transfer,
-            'estimated_receive': total_receive,
-            'estimated_demand': total_receive  # 需求等於接收
+            'estimated_transfer': int(transfer_qty.sum()),
+            'estimated_receive': int(total_receive),
+            'estimated_demand': int(total_receive)  # 需求等於接收
         }
     
-    def load_and_preprocess_data(self, uploaded_file):
-        """載入和預處理數據"""
+    def _receive_need(self, f, mode):
+        """按接收候選規則計算每行的需求數量（非接收候選為0）"""
+        _, need, _ = rule_engine.evaluate_tiers(f, MODE_RULES[mode]['receive'])
+        return need
+    
+    def sweep_transfer_parameters(self, mode="B", limit_pcts=(0.2, 0.3, 0.4, 0.5), min_qtys=(1, 2, 3),
+                                  moq_margins=(0, 1, 2), max_block_elements=4_000_000):
+        """
+        轉出限制參數掃描
+        以廣播一次計算參數網格（轉出比例 × 最少轉出數量 × MOQ餘量）下的預計轉出、接收及可匹配件數，
+        不需按每組參數重新執行引擎。掃描對象為模式中設有轉出上限的層級；
+        層級沒有 moq_margin 參數時（如A模式門檻為安全庫存）不使用MOQ餘量。
+        預計可匹配件數為各 (Article, OM) 組 min(轉出, 接收) 之和；RF匹配把1件進位為2件，
+        實際匹配件數可能略高於此估算。
+        返回每個參數組合一行的數據框
+        """
+        tier = sweep_tier(mode)
+        if tier is None:
+            raise ValueError(f"模式{mode}沒有可調整的RF轉出參數")
+        
+        f = self.get_feature_frame()
+        transfer_tiers = MODE_RULES[mode]['transfer']
+        tier_position = next(index for index, item in enumerate(transfer_tiers) if item is tier)
+        uncapped_tiers = [dict(item, cap=None) if item is tier else item for item in transfer_tiers]
+        cap_source = rule_engine.evaluate(f, tier['cap'].get('of', 'Total_Available'))
+        truncate = tier['cap'].get('truncate', True)
+        
+        group = self.df.groupby(['Article', 'OM'], sort=False, dropna=False).ngroup().to_numpy()
+        n_groups = int(group.max()) + 1 if len(group) else 0
+        need = self._receive_need(f, mode)
+        need_by_group = np.bincount(group, weights=need, minlength=n_groups)
+        
+        uses_margin = 'moq_margin' in (tier.get('params') or {})
+        if not uses_margin:
+            moq_margins = (0,)
+        grid_pct, grid_min, grid_margin = (axis.ravel() for axis in np.meshgrid(
+            np.asarray(limit_pcts, dtype=np.float64), np.asarray(min_qtys, dtype=np.int64),
+            np.asarray(moq_margins, dtype=np.int64), indexing='ij'))
+        n_combos = len(grid_pct)
+        transfer_totals = np.zeros(n_combos, dtype=np.int64)
+        matched_totals = np.zeros(n_combos, dtype=np.int64)
+        
+        for margin in np.unique(grid_margin):
+            # 門檻隨MOQ餘量改變；上限以外的部分（其他層級及未設上限的數量）按餘量計算一次
+            overrides = {'moq_margin': int(margin)} if uses_margin else None
+            tier_index, qty, selected = rule_engine.evaluate_tiers(f, uncapped_tiers, overrides)
+            swept = selected & (tier_index == tier_position)
+            fixed_by_group = np.bincount(group, weights=np.where(swept, 0, qty), minlength=n_groups)
+            donor_qty, donor_cap_source, donor_group = qty[swept], cap_source[swept], group[swept]
+            
+            combos = np.flatnonzero(grid_margin == margin)
+            block = max(1, max_block_elements // max(len(donor_qty), n_groups, 1))
+            for start in range(0, len(combos), block):
+                rows = combos[start:start + block]
+                cap_base = donor_cap_source[None, :] * grid_pct[rows, None]
+                if truncate:
+                    cap_base = cap_base.astype(np.int64)
+                actual = np.minimum(donor_qty[None, :], np.maximum(cap_base, grid_min[rows, None]))
+                actual = np.maximum(actual, 0)
+                
+                # 各參數組合按 (Article, OM) 組彙總，一次 bincount 完成
+                n_block = len(rows)
+                flat_group = (np.arange(n_block)[:, None] * n_groups + donor_group[None, :]).ravel()
+                by_group = np.bincount(flat_group, weights=actual.ravel(),
+                                       minlength=n_block * n_groups).reshape(n_block, n_groups)
+                by_group += fixed_by_group[None, :]
+                
+                transfer_totals[rows] = by_group.sum(axis=1)
+                matched_totals[rows] = np.minimum(by_group, need_by_group[None, :]).sum(axis=1)
+        
+        result = pd.DataFrame({
+            'Limit_Pct': grid_pct,
+            'Min_Qty': grid_min,
+            'MOQ_Margin': pd.array(grid_margin, dtype='Int64'),
+            'Estimated_Transfer': transfer_totals,
+            'Estimated_Receive': np.full(n_combos, int(need.sum()), dtype=np.int64),
+            'Matched_Estimate': matched_totals
+        })
+        if not uses_margin:
+            result['MOQ_Margin'] = pd.NA
+        return result
+    
+    def run_shape(self, mode):
+        """
+        生成建議的工作量指標（執行成本估算用，見 run_cost），只在特徵數據框上評估模式規則，不建立候選記錄
+        candidates: 轉出及接收候選數；pairs: 各 (Article, OM) 組 轉出數 + 接收數 - 1 之和（建議數上限）；
+        nd_scan: Σ組 ND轉出數 × 接收數；rf_scan: Σ店舖 RF轉出項目數 × 該店舖各組接收數之和（逐筆RF匹配的掃描量）；
+        rf_unmet_scan: 同 rf_scan，接收數按組內需求未能滿足的比例加權（未滿足的接收每個店舖都須完整掃描）
+        """
+        f = self.get_feature_frame()
+        rules = MODE_RULES[mode]
+        tier_index, transfer_qty, transfer = rule_engine.evaluate_tiers(f, rules['transfer'])
+        _, need, receive = rule_engine.evaluate_tiers(f, rules['receive'])
+        is_nd = np.array([tier['type'] == 'ND轉出' for tier in rules['transfer']] + [False])[tier_index]
+        nd, rf = transfer & is_nd, transfer & ~is_nd
+        
+        article, articles = pd.factorize(self.df['Article'], use_na_sentinel=False)
+        om = pd.factorize(self.df['OM'], use_na_sentinel=False)[0]
+        group, _ = pd.factorize(om.astype(np.int64) * len(articles) + article)
+        site, sites = pd.factorize(self.df['Site'], use_na_sentinel=False)
+        n_groups = max(int(group.max()) + 1 if len(group) else 0, 1)
+        transfer_by_group = np.bincount(group[transfer], minlength=n_groups)
+        receive_by_group = np.bincount(group[receive], minlength=n_groups)
+        both = (transfer_by_group > 0) & (receive_by_group > 0)
+        supply = np.bincount(group, weights=transfer_qty, minlength=n_groups)
+        demand = np.bincount(group, weights=need, minlength=n_groups)
+        unmet = np.clip(1 - np.divide(supply, demand, out=np.ones(n_groups), where=demand > 0), 0, 1)
+        
+        # 每個RF轉出店舖掃描其轉出項目所屬各組的全部接收候選
+        site_groups = np.unique(site[rf].astype(np.int64) * n_groups + group[rf])
+        rf_by_site = np.bincount(site[rf], minlength=len(sites))
+        
+        def site_scan(receive_weight):
+            site_receives = np.bincount(site_groups // n_groups, weights=receive_weight[site_groups % n_groups],
+                                        minlength=len(sites))
+            return int((rf_by_site * site_receives).sum())
+        
+        return {
+            'rows': len(f),
+            'candidates': int(transfer.sum() + receive.sum()),
+            'pairs': int((transfer_by_group + receive_by_group - 1)[both].sum()),
+            'nd_scan': int((np.bincount(group[nd], minlength=n_groups) * receive_by_group).sum()),
+            'rf_scan': site_scan(receive_by_group),
+            'rf_unmet_scan': site_scan(receive_by_group * unmet)
+        }
+    
+    def estimate_run_cost(self, mode, costs=None):
+        """預測生成建議的執行時間及峰值記憶體（見 run_cost.predict_run_cost）"""
+        shapes = {item: self.run_shape(item) for item in MODE_RULES}
+        return run_cost.predict_run_cost(shapes, mode, costs)
+    
+    @_memory_profiled('load', reset=True)
+    def load_and_preprocess_data(self, uploaded_file, consolidate_duplicates=True):
+        """
+        載入和預處理數據
+        consolidate_duplicates: 預處理後合併重複的 (Article, Site) 行（consolidate_duplicates_rows 函數）
+        """
+        started = time.perf_counter()
         try:
+            # 按文件內容雜湊查找共用快取，相同文件跨會話只預處理一次；是否合併重複行的結果分開快取
+            content = _read_upload_bytes(uploaded_file)
+            dataset_key = dataset_cache_key(content, consolidate_duplicates)
+            cached = _dataset_cache_get(dataset_key)
+            if cached is not None:
+                self._set_dataset(dataset_key, cached['df'], cached.get('preliminary_stats'), cached.get('features'),
+                                  cached.get('reports'))
+                _record_load_metrics("memory", len(self.df), started)
+                return True, f"成功載入 {len(self.df)} 筆記錄"
+            
+            # 伺服器重新啟動後從磁碟快取讀取（記憶體映射），並放回記憶體快取
+            stored = _DATASET_STORE.load(dataset_key)
+            if stored is not None:
+                self._set_dataset(dataset_key, stored['df'], stored['preliminary_stats'], stored['features'],
+                                  stored['metadata'])
+                _dataset_cache_put(dataset_key, _dataset_cache_entry(
+                    stored['df'], stored['preliminary_stats'], stored['features'], stored['metadata']))
+                _record_load_metrics("disk", len(self.df), started)
+                return True, f"成功載入 {len(self.df)} 筆記錄"
+            
             # 讀取Excel文件 - 添加編碼處理
-            df = pd.read_excel(uploaded_file)
+            with self._memory_stage('load.read_excel'):
+                df = pd.read_excel(io.BytesIO(content))
             
             # 清理列名中的異常字符
             df.columns = df.columns.astype(str)
             cleaned_columns = []
             for col in df.columns:
                 # 更严格的字符清理：只保留字母、数字、中文、常用符号
-                import re
                 # 首先移除明显的异常字符模式
                 cleaned_col = str(col)
                 
@@ -133,74 +1126,298 @@ class TransferRecommendationSystem:
             
             df.columns = cleaned_columns
             
-            # 驗證必需欄位
-            required_columns = [
-                'Article', 'Article Description', 'RP Type', 'Site', 'OM', 
-                'MOQ', 'SaSa Net Stock', 'Pending Received', 'Safety Stock', 
-                'Last Month Sold Qty', 'MTD Sold Qty'
-            ]
-            
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            if missing_columns:
-                raise ValueError(f"缺少必需欄位: {', '.join(missing_columns)}")
+            # 預處理前驗證原始數據，數據抽取有嚴重問題時立即失敗
+            renamed_columns = [col for col in cleaned_columns if re.fullmatch(r'(Unknown_)?Column_\d+', col)]
+            with self._memory_stage('load.validate'):
+                validation = validate_input(df, renamed_columns)
+            self.validation_report = validation
+            errors = validation[validation['嚴重程度'] == VALIDATION_ERROR]
+            if not errors.empty:
+                raise ValueError(format_validation_issues(errors))
             
             # 數據預處理
             df['Article'] = df['Article'].astype(str)
             
             # 處理數值欄位
-            numeric_columns = ['MOQ', 'SaSa Net Stock', 'Pending Received', 'Safety Stock', 
-                             'Last Month Sold Qty', 'MTD Sold Qty']
+            numeric_columns = QUANTITY_COLUMNS
             
-            df['Notes'] = ""  # 添加備註欄位
+            flags = np.zeros(len(df), dtype=QUALITY_FLAGS_DTYPE)  # 數據質量標記
             
-            for col in numeric_columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+            with self._memory_stage('load.numeric'):
+                for col in numeric_columns:
+                    df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
                 
-                # 負值修正
-                mask_negative = df[col] < 0
-                if mask_negative.any():
-                    df.loc[mask_negative, 'Notes'] += f"{col}負值修正為0; "
-                    df.loc[mask_negative, col] = 0
+                    # 負值修正
+                    mask_negative = (df[col] < 0).to_numpy()
+                    if mask_negative.any():
+                        flags[mask_negative] |= QUALITY_FLAGS[f"{col}負值修正為0"]
+                        df.loc[mask_negative, col] = 0
                 
-                # 銷量異常值處理
-                if 'Sold Qty' in col:
-                    mask_extreme = df[col] > 100000
-                    if mask_extreme.any():
-                        df.loc[mask_extreme, 'Notes'] += f"{col}異常值>100000修正; "
-                        df.loc[mask_extreme, col] = 100000
+                    # 銷量異常值處理
+                    if 'Sold Qty' in col:
+                        mask_extreme = (df[col] > SALES_CAP).to_numpy()
+                        if mask_extreme.any():
+                            flags[mask_extreme] |= QUALITY_FLAGS[f"{col}異常值>100000修正"]
+                            df.loc[mask_extreme, col] = SALES_CAP
             
             # 字串欄位處理 - 添加異常字符清理
-            string_columns = ['Article Description', 'RP Type', 'Site', 'OM']
-            for col in string_columns:
-                if col in df.columns:  # 確保列存在
-                    df[col] = df[col].fillna('').astype(str)
-                    # 更严格的數據內容清理
-                    import re
-                    df[col] = df[col].apply(lambda x: 
-                        re.sub(r'[^\w\s\u4e00-\u9fff\-_()./]', '', str(x)).strip() 
-                        if not re.search(r'key.*v_right|[\u0000-\u001f\u007f-\u009f]', str(x)) 
-                        else 'CLEANED_DATA'
-                    )
-                else:
-                    df[col] = ''  # 如果列不存在，創建空列
+            with self._memory_stage('load.strings'):
+                string_columns = ['Article Description', 'RP Type', 'Site', 'OM']
+                for col in string_columns:
+                    if col in df.columns:  # 確保列存在
+                        df[col] = df[col].fillna('').astype(str)
+                        # 更严格的數據內容清理
+                        df[col] = df[col].apply(lambda x: 
+                            re.sub(r'[^\w\s\u4e00-\u9fff\-_()./]', '', str(x)).strip() 
+                            if not re.search(r'key.*v_right|[\u0000-\u001f\u007f-\u009f]', str(x)) 
+                            else 'CLEANED_DATA'
+                        )
+                    else:
+                        df[col] = ''  # 如果列不存在，創建空列
             
             # 驗證RP Type值
-            valid_rp_types = ['ND', 'RF']
-            invalid_rp_mask = ~df['RP Type'].isin(valid_rp_types)
+            invalid_rp_mask = ~df['RP Type'].isin(VALID_RP_TYPES)
             if invalid_rp_mask.any():
-                df.loc[invalid_rp_mask, 'Notes'] += "RP Type無效值; "
+                flags[invalid_rp_mask.to_numpy()] |= QUALITY_FLAGS["RP Type無效值"]
                 df.loc[invalid_rp_mask, 'RP Type'] = 'RF'  # 預設為RF
             
-            self.df = df
+            df = df.drop(columns='Notes', errors='ignore')
+            df[QUALITY_FLAGS_COLUMN] = flags
             
-            # 計算預先統計
-            self.preliminary_stats = self.calculate_preliminary_statistics()
+            # 合併重複的 (Article, Site) 行，候選識別及後續各階段使用合併後的數據框
+            consolidation_report = None
+            if consolidate_duplicates:
+                with self._memory_stage('load.consolidate'):
+                    df, consolidation_report = consolidate_duplicates_rows(df)
+            
+            # 緊湊欄位類型，後續各階段及共用快取都使用轉換後的數據框
+            with self._memory_stage('load.compact_dtypes'):
+                df, dtype_report = compact_dtypes(df)
+            reports = {
+                'dtype_report': dtype_report,
+                'validation_report': validation.to_dict('records'),
+                'consolidation_report': consolidation_report
+            }
+            
+            # 預先統計延遲計算（首次讀取 preliminary_stats 或 start_preliminary_statistics 時）
+            self._set_dataset(dataset_key, df, reports=reports)
+            _dataset_cache_put(dataset_key, _dataset_cache_entry(df, reports=reports))
+            with self._memory_stage('load.store'):
+                _DATASET_STORE.save(dataset_key, df, metadata=reports)
+            _record_load_metrics("parse", len(df), started)
             
             return True, f"成功載入 {len(df)} 筆記錄"
             
         except Exception as e:
+            metrics.LOAD_FAILURES.inc()
+            metrics.flush()
             return False, f"數據載入失敗: {str(e)}"
     
+    def _set_dataset(self, content_hash, df, preliminary_stats=None, features=None, reports=None):
+        """
+        切換當前數據集並清除舊數據集的結果
+        reports: 載入時生成的報告 {'dtype_report', 'validation_report'（記錄列表）, 'consolidation_report'}
+        """
+        reports = reports or {}
+        self.df = df
+        self.dataset_key = content_hash
+        self.dtype_report = reports.get('dtype_report')
+        self.consolidation_report = reports.get('consolidation_report')
+        self.validation_report = pd.DataFrame(reports.get('validation_report', []), columns=VALIDATION_COLUMNS)
+        self.preliminary_stats = preliminary_stats
+        self._preliminary_estimate = None
+        self._preliminary_estimate_source = None
+        self._feature_frame = features
+        self._feature_frame_source = df if features is not None else None
+        self.transfer_suggestions = None
+        self.statistics = None
+        self.result_sets.clear()
+        self.comparison = None
+        self._suggestion_view = None
+        self._export = None
+    
+    def _store_result_set(self, mode, suggestions, statistics, pinned=()):
+        """
+        保存模式結果集，並在超出會話記憶體預算時按LRU淘汰
+        pinned: 本次不淘汰的模式（如同一次比較的各模式結果集）
+        """
+        self.result_sets[mode] = {
+            'suggestions': suggestions,
+            'statistics': statistics,
+            'nbytes': self._estimate_result_bytes(suggestions, statistics)
+        }
+        self.result_sets.move_to_end(mode)
+        
+        # 當前模式及固定模式的結果集不淘汰
+        total = sum(item['nbytes'] for item in self.result_sets.values())
+        for evicted in [other for other in self.result_sets if other != mode and other not in pinned]:
+            if total <= self.session_memory_budget:
+                break
+            total -= self.result_sets.pop(evicted)['nbytes']
+    
+    def activate_result_set(self, mode):
+        """切換到已生成的模式結果集；沒有該模式結果時返回False"""
+        result = self.result_sets.get(mode)
+        if result is None:
+            return False
+        self.result_sets.move_to_end(mode)
+        if self.mode != mode or self.transfer_suggestions is not result['suggestions']:
+            self.mode = mode
+            self.transfer_suggestions = result['suggestions']
+            self.statistics = result['statistics']
+            self._suggestion_view = None
+        return True
+    
+    def submit_recommendation_job(self, mode, label=None):
+        """以背景任務生成指定模式的調貨建議，返回任務編號"""
+        if self.df is None:
+            raise ValueError("請先載入數據")
+        
+        spawn_worker = self._worker_factory()
+        session_profiler = self.memory_profiler
+        
+        def run(report_progress):
+            worker = spawn_worker(profile_label=f"模式{mode}")
+            try:
+                success, message = worker.generate_recommendations(mode, progress_callback=report_progress)
+            finally:
+                if worker.memory_profiler is not None:
+                    session_profiler.merge(worker.memory_profiler)
+            if not success:
+                raise RuntimeError(message)
+            return {
+                'suggestions': worker.transfer_suggestions,
+                'statistics': worker.statistics,
+                'nbytes': worker._estimate_result_bytes(worker.transfer_suggestions, worker.statistics),
+                'message': message
+            }
+        
+        return _JOB_RUNNER.submit(run, label or f"模式{mode}",
+                                  tags={'dataset_key': self.dataset_key, 'mode': mode})
+    
+    def submit_comparison_job(self, modes=tuple(MODE_LABELS), label="全部模式比較"):
+        """以背景任務一次生成多個模式的比較結果，返回任務編號"""
+        if self.df is None:
+            raise ValueError("請先載入數據")
+        
+        spawn_worker = self._worker_factory()
+        
+        def run(report_progress):
+            worker = spawn_worker()
+            success, message = worker.generate_comparison(modes, progress_callback=report_progress)
+            if not success:
+                raise RuntimeError(message)
+            bundle = worker.comparison_bundle()
+            nbytes = sum(worker.result_sets[mode]['nbytes'] for mode in bundle['modes'])
+            return dict(bundle, nbytes=nbytes, message=message)
+        
+        return _JOB_RUNNER.submit(run, label, tags={'dataset_key': self.dataset_key, 'mode': COMPARISON_MODE})
+    
+    def _worker_factory(self):
+        """
+        返回建立工作實例的函數；工作實例共用唯讀數據框及特徵數據框，可在其他執行緒使用，不登記為活躍會話
+        工作實例預設不作記憶體分析（並行執行時階段記錄會互相交錯）；本會話啟用分析時，
+        指定 profile_label 的工作實例使用自己的分析器，由呼叫者完成後併入本會話的報告
+        """
+        df = self.df
+        features = self._feature_frame if self._feature_frame_source is df else None
+        profiling = self.memory_profiler is not None
+        
+        def spawn_worker(profile_label=None):
+            worker = TransferRecommendationSystem(register_session=False)
+            worker.df = df
+            worker.memory_profiler = None
+            if profiling and profile_label is not None:
+                worker.memory_profiler = memory_profile.MemoryProfiler(label=profile_label)
+            if features is not None:
+                worker._feature_frame, worker._feature_frame_source = features, df
+            return worker
+        
+        return spawn_worker
+    
+    def list_recommendation_jobs(self):
+        """列出當前數據集的背景任務"""
+        return _JOB_RUNNER.list_jobs(dataset_key=self.dataset_key)
+    
+    def adopt_job_result(self, job_id):
+        """取回已完成任務的結果並設為當前結果集"""
+        job = _JOB_RUNNER.get(job_id)
+        if job is None or job['status'] != JOB_DONE:
+            return False, "任務尚未完成"
+        if job['tags'].get('dataset_key') != self.dataset_key:
+            return False, "任務結果不屬於當前數據集"
+        
+        mode = job['tags']['mode']
+        result = job['result']
+        if mode == COMPARISON_MODE:
+            self._adopt_comparison(result)
+            return True, result['message']
+        self._store_result_set(mode, result['suggestions'], result['statistics'])
+        self.activate_result_set(mode)
+        return True, result['message']
+    
+    def _estimate_result_bytes(self, suggestions, statistics):
+        """估算結果集佔用記憶體（按樣本推算建議記錄大小）"""
+        nbytes = 0
+        if suggestions:
+            sample = suggestions[:200]
+            sample_bytes = sum(sys.getsizeof(item) + sum(sys.getsizeof(value) for value in item.values())
+                               for item in sample)
+            nbytes += sample_bytes * len(suggestions) // len(sample)
+        for value in (statistics or {}).values():
+            if isinstance(value, pd.DataFrame):
+                nbytes += int(value.memory_usage(deep=True).sum())
+        return nbytes
+    
+    def get_quality_summary(self):
+        """預處理修正的分類統計（修正類型, 行數）"""
+        if self.df is None or QUALITY_FLAGS_COLUMN not in self.df.columns:
+            return quality_summary([])
+        return quality_summary(self.df[QUALITY_FLAGS_COLUMN].to_numpy())
+    
+    def with_quality_notes(self, frame):
+        """以數據質量標記為傳入的行生成備註欄位 Notes（用於顯示或匯出部分行）"""
+        if QUALITY_FLAGS_COLUMN not in frame.columns:
+            return frame
+        notes = render_quality_notes(frame[QUALITY_FLAGS_COLUMN].to_numpy())
+        return frame.drop(columns=QUALITY_FLAGS_COLUMN).assign(Notes=notes)
+    
+    def get_quality_rows(self):
+        """有預處理修正的行及其備註"""
+        if self.df is None or QUALITY_FLAGS_COLUMN not in self.df.columns:
+            return pd.DataFrame(columns=['Article', 'Site', 'OM', 'Notes'])
+        flagged = self.df[self.df[QUALITY_FLAGS_COLUMN].to_numpy() != 0]
+        return self.with_quality_notes(flagged[['Article', 'Site', 'OM', QUALITY_FLAGS_COLUMN]])
+    
+    def memory_usage(self):
+        """
+        返回本會話的記憶體使用（bytes）；數據集可能與其他會話共用
+        各部分的大小在建立時計算（數據集沿用共用快取項目的 nbytes），每次重新執行不再逐欄掃描
+        """
+        with _DATASET_CACHE_LOCK:  # 只讀取，不更新共用快取的使用順序
+            cached = _DATASET_CACHE.get(self.dataset_key) if self.dataset_key is not None else None
+        if self._dataset_bytes_source is not self.df:
+            if self.df is None:
+                self._dataset_bytes = 0
+            elif cached is not None and cached['df'] is self.df:
+                self._dataset_bytes = cached['nbytes']
+            else:
+                self._dataset_bytes = int(self.df.memory_usage(deep=True).sum())
+            self._dataset_bytes_source = self.df
+        results_bytes = sum(item['nbytes'] for item in self.result_sets.values())
+        view_bytes = self._suggestion_view['nbytes'] if self._suggestion_view is not None else 0
+        export_bytes = len(self._export[1]) if self._export is not None else 0
+        return {
+            'dataset_bytes': self._dataset_bytes,
+            'dataset_shared': cached is not None,
+            'results_bytes': results_bytes,
+            'view_bytes': view_bytes,
+            'export_bytes': export_bytes,
+            'session_bytes': results_bytes + view_bytes + export_bytes,
+            'result_modes': list(self.result_sets.keys()),
+            'budget_bytes': self.session_memory_budget
+        }
+    
     def calculate_effective_sales(self, row):
         """計算有效銷量"""
         if row['Last Month Sold Qty'] > 0:
@@ -210,180 +1427,32 @@ class TransferRecommendationSystem:
     
     def identify_transfer_candidates(self, mode="A"):
         """識別轉出候選"""
-        candidates = []
-        
-        for _, row in self.df.iterrows():
-            article = row['Article']
-            current_stock = row['SaSa Net Stock']
-            pending = row['Pending Received']
-            safety_stock = row['Safety Stock']
-            rp_type = row['RP Type']
-            effective_sales = self.calculate_effective_sales(row)
-            moq = row['MOQ']
-            
-            # 計算該產品的最高銷量
-            product_data = self.df[self.df['Article'] == article]
-            max_sales = product_data.apply(self.calculate_effective_sales, axis=1).max()
-            
-            # ND類型完全轉出 (優先順序1)
-            if rp_type == 'ND' and current_stock > 0:
-                # ND類型完全轉出，剩餘庫存為0
-                remaining_stock = 0
-                
-                candidates.append({
-                    'Article': article,
-                    'Site': row['Site'],
-                    'OM': row['OM'],
-                    'Transfer_Qty': current_stock,
-                    'Type': 'ND轉出',
-                    'Priority': 1,
-                    'Original_Stock': current_stock,
-                    'Safety_Stock': safety_stock,
-                    'MOQ': moq,
-                    'Effective_Sales': effective_sales,
-                    'Total_Available': current_stock + pending,
-                    'Remaining_Stock': remaining_stock  # 添加剩餘庫存信息
-                })
-            
-            # RF類型轉出 (優先順序2)
-            elif rp_type == 'RF' and effective_sales < max_sales:
-                total_available = current_stock + pending
-                
-                if mode == "A":  # 保守轉貨
-                    if total_available > safety_stock:
-                        base_transfer = total_available - safety_stock
-                        limit_transfer = max(int(total_available * 0.2), 2)
-                        actual_transfer = min(base_transfer, limit_transfer)
-                        actual_transfer = min(actual_transfer, current_stock)
-                        
-                        if actual_transfer > 0:
-                            # 計算轉出後剩餘庫存
-                            remaining_stock = current_stock - actual_transfer
-                            
-                            candidates.append({
-                                'Article': article,
-                                'Site': row['Site'],
-                                'OM': row['OM'],
-                                'Transfer_Qty': actual_transfer,
-                                'Type': 'RF過剩轉出',
-                                'Priority': 2,
-                                'Original_Stock': current_stock,
-                                'Safety_Stock': safety_stock,
-                                'MOQ': moq,
-                                'Effective_Sales': effective_sales,
-                                'Total_Available': total_available,
-                                'Remaining_Stock': remaining_stock  # 添加剩餘庫存信息
-                            })
-                            
-                elif mode == "B":  # 加強轉貨
-                    moq_threshold = moq + 1
-                    if total_available > moq_threshold:
-                        base_transfer = total_available - moq_threshold
-                        limit_transfer = max(int(total_available * 0.5), 2)
-                        actual_transfer = min(base_transfer, limit_transfer)
-                        actual_transfer = min(actual_transfer, current_stock)
-                        
-                        if actual_transfer > 0:
-                            # 計算轉出後剩餘庫存
-                            remaining_stock = current_stock - actual_transfer
-                            
-                            # 根據剩餘庫存與Safety stock關係確定轉出類型
-                            if remaining_stock >= safety_stock:
-                                transfer_type = 'RF過剩轉出'  # 剩餘庫存不會低於Safety stock
-                            else:
-                                transfer_type = 'RF加強轉出'  # 剩餘庫存會低於Safety stock
-                            
-                            candidates.append({
-                                'Article': article,
-                                'Site': row['Site'],
-                                'OM': row['OM'],
-                                'Transfer_Qty': actual_transfer,
-                                'Type': transfer_type,
-                                'Priority': 2,
-                                'Original_Stock': current_stock,
-                                'Safety_Stock': safety_stock,
-                                'MOQ': moq,
-                                'Effective_Sales': effective_sales,
-                                'Total_Available': total_available,
-                                'Remaining_Stock': remaining_stock  # 添加剩餘庫存信息
-                            })
-        
-        # 按有效銷量排序（低銷量優先轉出）
-        candidates.sort(key=lambda x: (x['Priority'], x['Effective_Sales']))
+        return self.identify_transfer_candidates_for_modes([mode])[mode]
+    
+    def identify_transfer_candidates_for_modes(self, modes):
+        """
+        識別多個模式的轉出候選，返回 {模式: 候選列表}
+        以編譯後的模式規則在特徵數據框上向量化計算，按優先順序及有效銷量排序（低銷量優先轉出）；
+        多個模式共用一次掃描，各模式候選行的特徵及標籤欄位只取值一次
+        """
+        progress = self._progress("識別轉出候選", len(self.df))
+        if len(modes) == 1:
+            candidates = {modes[0]: self._rule_candidates(MODE_RULES[modes[0]]['transfer'], TRANSFER_FIELDS,
+                                                          TRANSFER_SORT)}
+        else:
+            candidates = rule_engine.build_candidates_for_sets(
+                self.get_feature_frame(), self.df[['Article', 'Site', 'OM']],
+                {mode: MODE_RULES[mode]['transfer'] for mode in modes}, TRANSFER_FIELDS, TRANSFER_SORT)
+        progress.finish()
         return candidates
     
-    def identify_receive_candidates(self):
+    def identify_receive_candidates(self, mode="A"):
         """識別接收候選 - v1.71 優化：添加SasaNet調撥接收條件"""
-        candidates = []
-        
-        for _, row in self.df.iterrows():
-            article = row['Article']
-            current_stock = row['SaSa Net Stock']
-            pending = row['Pending Received']
-            safety_stock = row['Safety Stock']
-            rp_type = row['RP Type']
-            effective_sales = self.calculate_effective_sales(row)
-            site = row['Site']
-            
-            if rp_type == 'RF':
-                # 計算該產品的最高銷量
-                product_data = self.df[self.df['Article'] == article]
-                max_sales = product_data.apply(self.calculate_effective_sales, axis=1).max()
-                
-                # 緊急缺貨補貨 (優先順序1)
-                if current_stock == 0 and effective_sales > 0:
-                    candidates.append({
-                        'Article': article,
-                        'Site': site,
-                        'OM': row['OM'],
-                        'Need_Qty': safety_stock,
-                        'Type': '緊急缺貨補貨',
-                        'Priority': 1,
-                        'Current_Stock': current_stock,
-                        'Safety_Stock': safety_stock,
-                        'Effective_Sales': effective_sales,
-                        'Pending_Received': pending,
-                        'Total_Available': current_stock + pending
-                    })
-                
-                # v1.71 新增：SasaNet 調撥接收條件 (優先順序2)
-                elif (current_stock + pending) < safety_stock and current_stock > 0:
-                    need_qty = safety_stock - (current_stock + pending)
-                    if need_qty > 0:
-                        candidates.append({
-                            'Article': article,
-                            'Site': site,
-                            'OM': row['OM'],
-                            'Need_Qty': need_qty,
-                            'Type': 'SasaNet調撥接收',
-                            'Priority': 2,
-                            'Current_Stock': current_stock,
-                            'Safety_Stock': safety_stock,
-                            'Effective_Sales': effective_sales,
-                            'Pending_Received': pending,
-                            'Total_Available': current_stock + pending
-                        })
-                
-                # 潛在缺貨補貨 (優先順序3)
-                elif (current_stock + pending) < safety_stock and effective_sales == max_sales:
-                    need_qty = safety_stock - (current_stock + pending)
-                    if need_qty > 0:
-                        candidates.append({
-                            'Article': article,
-                            'Site': site,
-                            'OM': row['OM'],
-                            'Need_Qty': need_qty,
-                            'Type': '潛在缺貨補貨',
-                            'Priority': 3,
-                            'Current_Stock': current_stock,
-                            'Safety_Stock': safety_stock,
-                            'Effective_Sales': effective_sales,
-                            'Pending_Received': pending,
-                            'Total_Available': current_stock + pending
-                        })
-        
-        # 按優先順序和銷量排序
-        candidates.sort(key=lambda x: (x['Priority'], -x['Effective_Sales']))
+        rules = MODE_RULES[mode]
+        fields = dict(RECEIVE_FIELDS, **rules.get('receive_fields', {}))
+        progress = self._progress("識別接收候選", len(self.df))
+        candidates = self._rule_candidates(rules['receive'], fields, rules['receive_sort'])
+        progress.finish()
         return candidates
     
     def identify_receive_candidates_mode_c(self):
@@ -392,96 +1461,54 @@ class TransferRecommendationSystem:
         條件：(SaSa Net Stock + Pending Received) ≤ 1
         補充至：min(Safety Stock, MOQ + 1)
         """
-        candidates = []
-        
-        for _, row in self.df.iterrows():
-            article = row['Article']
-            current_stock = row['SaSa Net Stock']
-            pending = row['Pending Received']
-            safety_stock = row['Safety Stock']
-            rp_type = row['RP Type']
-            effective_sales = self.calculate_effective_sales(row)
-            site = row['Site']
-            moq = row['MOQ']
-            
-            # C模式只處理RF類型
-            if rp_type == 'RF':
-                total_available = current_stock + pending
-                
-                # C模式條件：總可用量 ≤ 1
-                if total_available <= 1:
-                    # 計算補充目標：取Safety Stock和MOQ+1的較小值
-                    target_stock = min(safety_stock, moq + 1)
-                    need_qty = target_stock - total_available
-                    
-                    if need_qty > 0:
-                        candidates.append({
-                            'Article': article,
-                            'Site': site,
-                            'OM': row['OM'],
-                            'Need_Qty': need_qty,
-                            'Type': '重點補0',
-                            'Priority': 1,  # C模式補0為最高優先級
-                            'Current_Stock': current_stock,
-                            'Safety_Stock': safety_stock,
-                            'Effective_Sales': effective_sales,
-                            'Pending_Received': pending,
-                            'Total_Available': total_available,
-                            'MOQ': moq,
-                            'Target_Stock': target_stock
-                        })
-        
-        # 按銷量排序（高銷量優先）
-        candidates.sort(key=lambda x: -x['Effective_Sales'])
-        return candidates
+        return self.identify_receive_candidates("C")
+    
+    def _rule_candidates(self, tiers, fields, sort_by):
+        """以模式規則層級在特徵數據框上生成候選記錄"""
+        return rule_engine.build_candidates(self.get_feature_frame(), self.df[['Article', 'Site', 'OM']],
+                                            tiers, fields, sort_by)
     
     def resolve_same_store_conflicts(self, transfer_candidates, receive_candidates):
         """
         解決同店舖同SKU衝突問題 - v1.72
         當同一店舖的同一SKU既被識別為轉出又被識別為接收時，
         優先保持接收需求，移除轉出候選
+        以 (Site, Article, OM) 類別編碼做鍵值反連接，
+        返回 (過濾後轉出候選, 接收候選, 衝突表)，衝突表欄位見 CONFLICT_COLUMNS
         """
-        # 創建接收候選的查找表 (Store, Article, OM) -> 接收信息
-        receive_lookup = {}
-        for receive in receive_candidates:
-            key = (receive['Site'], receive['Article'], receive['OM'])
-            receive_lookup[key] = receive
-        
-        # 檢查轉出候選中的衝突並移除
-        filtered_transfer_candidates = []
-        conflicts_resolved = []
-        
-        for transfer in transfer_candidates:
-            key = (transfer['Site'], transfer['Article'], transfer['OM'])
-            
-            if key in receive_lookup:
-                # 發現衝突：同店舖同SKU既要轉出又要接收
-                receive_info = receive_lookup[key]
-                conflicts_resolved.append({
-                    'site': transfer['Site'],
-                    'article': transfer['Article'],
-                    'om': transfer['OM'],
-                    'transfer_qty': transfer['Transfer_Qty'],
-                    'transfer_type': transfer['Type'],
-                    'receive_qty': receive_info['Need_Qty'],
-                    'receive_type': receive_info['Type']
-                })
-                # 不添加到過濾後的轉出候選中（優先保持接收）
-                continue
-            else:
-                # 無衝突，保留轉出候選
-                filtered_transfer_candidates.append(transfer)
+        if not transfer_candidates or not receive_candidates:
+            return transfer_candidates, receive_candidates, pd.DataFrame(columns=CONFLICT_COLUMNS)
+        
+        transfer_codes, receive_codes = candidate_key_codes(transfer_candidates, receive_candidates)
         
-        # 記錄衝突解決信息
-        if conflicts_resolved:
-            print(f"🔧 解決了 {len(conflicts_resolved)} 個同店舖同SKU衝突：")
-            for conflict in conflicts_resolved:
-                print(f"   {conflict['site']} - {conflict['article']}: 移除轉出{conflict['transfer_qty']}件({conflict['transfer_type']})，保持接收{conflict['receive_qty']}件({conflict['receive_type']})")
+        # 同鍵值有多條接收候選時，以最後一條作為衝突記錄的接收信息
+        receive_lookup = pd.Series(np.arange(len(receive_codes)), index=receive_codes)
+        receive_lookup = receive_lookup[~receive_lookup.index.duplicated(keep='last')]
+        matched = receive_lookup.reindex(transfer_codes).to_numpy()
+        conflict_mask = ~np.isnan(matched)
         
-        return filtered_transfer_candidates, receive_candidates
+        # 發現衝突：同店舖同SKU既要轉出又要接收，移除轉出候選（優先保持接收）
+        filtered_transfer_candidates = [transfer_candidates[i] for i in np.flatnonzero(~conflict_mask)]
+        
+        conflict_transfers = [transfer_candidates[i] for i in np.flatnonzero(conflict_mask)]
+        conflict_receives = [receive_candidates[int(i)] for i in matched[conflict_mask]]
+        conflicts = pd.DataFrame({
+            'Site': [transfer['Site'] for transfer in conflict_transfers],
+            'Article': [transfer['Article'] for transfer in conflict_transfers],
+            'OM': [transfer['OM'] for transfer in conflict_transfers],
+            'Transfer_Qty': [transfer['Transfer_Qty'] for transfer in conflict_transfers],
+            'Transfer_Type': [transfer['Type'] for transfer in conflict_transfers],
+            'Receive_Qty': [receive['Need_Qty'] for receive in conflict_receives],
+            'Receive_Type': [receive['Type'] for receive in conflict_receives]
+        }, columns=CONFLICT_COLUMNS)
+        
+        return filtered_transfer_candidates, receive_candidates, conflicts
     
-    def match_transfer_suggestions(self, transfer_candidates, receive_candidates):
-        """匹配調貨建議 - 優化同店舖RF轉出"""
+    def match_transfer_suggestions(self, transfer_candidates, receive_candidates, use_kernel=True):
+        """
+        匹配調貨建議 - 優化同店舖RF轉出
+        use_kernel=False 時全部使用逐筆貪婪匹配（參考實現），結果與累計區間核心完全一致
+        """
         suggestions = []
         
         # 創建可變的候選列表副本
@@ -489,56 +1516,154 @@ class TransferRecommendationSystem:
         available_receives = receive_candidates.copy()
         
         # 先處理ND轉出（優先級最高）
-        self._match_nd_transfers(available_transfers, available_receives, suggestions)
+        self._match_nd_transfers(available_transfers, available_receives, suggestions, use_kernel)
         
         # 再處理RF轉出，優化同店舖轉出
-        self._match_rf_transfers_optimized(available_transfers, available_receives, suggestions)
+        self._match_rf_transfers_optimized(available_transfers, available_receives, suggestions, use_kernel)
         
         return suggestions
     
-    def _match_nd_transfers(self, available_transfers, available_receives, suggestions):
+    def match_transfer_suggestions_reference(self, transfer_candidates, receive_candidates):
+        """匹配調貨建議 - 逐筆貪婪參考實現"""
+        return self.match_transfer_suggestions(transfer_candidates, receive_candidates, use_kernel=False)
+    
+    def _kernel_pairs(self, transfers, donor_order, receives):
+        """
+        以累計區間核心批量匹配各 (Article, OM) 組
+        donor_order: 轉出候選索引（按匹配優先順序）
+        返回 (配對列表 [(轉出索引, 接收索引, 數量)], 需逐筆處理的組)；
+        同組內轉出店舖與接收店舖相同的組不適用區間分配，交由逐筆匹配
+        """
+        group_codes = {}
+        donor_ids, donor_codes, donor_qty = [], [], []
+        donor_sites = set()
+        for ti in donor_order:
+            transfer = transfers[ti]
+            code = group_codes.setdefault((transfer['Article'], transfer['OM']), len(group_codes))
+            donor_ids.append(ti)
+            donor_codes.append(code)
+            donor_qty.append(transfer['Transfer_Qty'])
+            donor_sites.add((code, transfer['Site']))
+        
+        receiver_ids, receiver_codes, receiver_need = [], [], []
+        fallback_codes = set()
+        for ri, receive in enumerate(receives):
+            code = group_codes.get((receive['Article'], receive['OM']))
+            if code is None or receive['Need_Qty'] <= 0:
+                continue
+            if (code, receive['Site']) in donor_sites:
+                fallback_codes.add(code)
+            receiver_ids.append(ri)
+            receiver_codes.append(code)
+            receiver_need.append(receive['Need_Qty'])
+        
+        code_to_group = {code: key for key, code in group_codes.items()}
+        fallback_groups = {code_to_group[code] for code in fallback_codes}
+        if not receiver_ids:
+            return [], fallback_groups
+        
+        donor_ids, donor_codes, donor_qty = np.array(donor_ids), np.array(donor_codes), np.array(donor_qty)
+        receiver_ids, receiver_codes, receiver_need = np.array(receiver_ids), np.array(receiver_codes), np.array(receiver_need)
+        
+        # 排除逐筆處理的組，並按組排序（組內保持優先順序）
+        if fallback_codes:
+            fallback_array = np.array(sorted(fallback_codes))
+            donor_keep = ~np.isin(donor_codes, fallback_array)
+            receiver_keep = ~np.isin(receiver_codes, fallback_array)
+            donor_ids, donor_codes, donor_qty = donor_ids[donor_keep], donor_codes[donor_keep], donor_qty[donor_keep]
+            receiver_ids, receiver_codes, receiver_need = (receiver_ids[receiver_keep], receiver_codes[receiver_keep],
+                                                           receiver_need[receiver_keep])
+        
+        donor_sort = np.argsort(donor_codes, kind='stable')
+        receiver_sort = np.argsort(receiver_codes, kind='stable')
+        donor_pos, receiver_pos, qty = allocate_cumulative(
+            donor_codes[donor_sort], donor_qty[donor_sort],
+            receiver_codes[receiver_sort], receiver_need[receiver_sort]
+        )
+        
+        pairs = list(zip(donor_ids[donor_sort][donor_pos].tolist(),
+                         receiver_ids[receiver_sort][receiver_pos].tolist(),
+                         qty.tolist()))
+        return pairs, fallback_groups
+    
+    def _apply_pairs(self, transfers, receives, keyed_pairs, suggestions, transfer_decrement=1):
+        """按原逐筆匹配的產生順序建立建議並扣減數量"""
+        keyed_pairs.sort(key=lambda pair: pair[0])
+        for _, ti, ri, qty in keyed_pairs:
+            suggestions.append(self._create_suggestion(transfers[ti], receives[ri], qty))
+            transfers[ti]['Transfer_Qty'] -= qty * transfer_decrement
+            receives[ri]['Need_Qty'] -= qty
+    
+    def _match_nd_transfers(self, available_transfers, available_receives, suggestions, use_kernel=True):
         """處理ND轉出（最高優先級）"""
-        for receive in available_receives[:]:
-            if receive['Need_Qty'] <= 0:
+        progress = self._progress("匹配ND轉出", len(available_receives))
+        
+        donor_order = [i for i, transfer in enumerate(available_transfers)
+                       if transfer['Type'] == 'ND轉出' and transfer['Transfer_Qty'] > 0]
+        
+        keyed_pairs = []
+        fallback_groups = None  # None: 所有組逐筆匹配
+        if use_kernel:
+            pairs, fallback_groups = self._kernel_pairs(available_transfers, donor_order, available_receives)
+            # 原逐筆匹配按 (接收順序, 轉出順序) 產生建議
+            keyed_pairs = [((ri, ti), ti, ri, qty) for ti, ri, qty in pairs]
+        
+        self._count('nd_kernel_pairs', len(keyed_pairs))
+        if fallback_groups is None or fallback_groups:
+            self._count('nd_fallback_groups', len(fallback_groups or ()))
+            greedy_pairs = self._greedy_nd_pairs(available_transfers, donor_order, available_receives,
+                                                 fallback_groups, progress)
+            self._count('nd_greedy_pairs', len(greedy_pairs))
+            keyed_pairs.extend(greedy_pairs)
+        
+        self._apply_pairs(available_transfers, available_receives, keyed_pairs, suggestions)
+        progress.finish()
+    
+    def _greedy_nd_pairs(self, transfers, donor_order, receives, groups, progress=_NULL_PROGRESS):
+        """ND轉出逐筆貪婪匹配；groups 為 None 時處理所有組"""
+        donors_by_group = {}
+        remaining = {}
+        for ti in donor_order:
+            key = (transfers[ti]['Article'], transfers[ti]['OM'])
+            if groups is None or key in groups:
+                donors_by_group.setdefault(key, []).append(ti)
+                remaining[ti] = transfers[ti]['Transfer_Qty']
+        
+        keyed_pairs = []
+        for ri, receive in enumerate(receives):
+            progress.update(ri + 1)
+            need = receive['Need_Qty']
+            if need <= 0:
                 continue
-                
-            for i, transfer in enumerate(available_transfers):
-                if (transfer['Type'] == 'ND轉出' and
-                    transfer['Article'] == receive['Article'] and 
-                    transfer['OM'] == receive['OM'] and 
-                    transfer['Site'] != receive['Site'] and
-                    transfer['Transfer_Qty'] > 0):
-                    
-                    actual_qty = min(transfer['Transfer_Qty'], receive['Need_Qty'])
+            
+            for ti in donors_by_group.get((receive['Article'], receive['OM']), ()):
+                if transfers[ti]['Site'] != receive['Site'] and remaining[ti] > 0:
+                    actual_qty = min(remaining[ti], need)
+                    keyed_pairs.append(((ri, ti), ti, ri, actual_qty))
+                    remaining[ti] -= actual_qty
+                    need -= actual_qty
                     
-                    if actual_qty > 0:
-                        suggestions.append(self._create_suggestion(transfer, receive, actual_qty))
-                        available_transfers[i]['Transfer_Qty'] -= actual_qty
-                        receive['Need_Qty'] -= actual_qty
-                        
-                        if receive['Need_Qty'] <= 0:
-                            break
+                    if need <= 0:
+                        break
+        
+        return keyed_pairs
     
-    def _match_rf_transfers_optimized(self, available_transfers, available_receives, suggestions):
-        """處理RF轉出 - 優化存貨優先、同店舖轉出、避免單件"""
+    def _rf_site_order(self, available_transfers):
+        """
+        計算RF轉出店舖的處理順序及店舖內項目順序
+        返回 [(店舖, [轉出索引...])]
+        """
         # 將RF轉出按店舖分組
         rf_transfers_by_site = {}
         for i, transfer in enumerate(available_transfers):
             if transfer['Type'] in ['RF過剩轉出', 'RF加強轉出'] and transfer['Transfer_Qty'] > 0:
-                site = transfer['Site']
-                if site not in rf_transfers_by_site:
-                    rf_transfers_by_site[site] = []
-                rf_transfers_by_site[site].append((i, transfer))
+                rf_transfers_by_site.setdefault(transfer['Site'], []).append(i)
         
         # 計算每個店舖的綜合優先級
         site_priority = []
-        for site, transfers in rf_transfers_by_site.items():
-            # 統計活躍轉出項目
-            active_transfers = [t for i, t in transfers if t['Transfer_Qty'] > 0]
+        for site, transfer_ids in rf_transfers_by_site.items():
+            active_transfers = [available_transfers[i] for i in transfer_ids]
             
-            if not active_transfers:
-                continue
-                
             # 計算優先級指標
             active_items = len(active_transfers)  # 可轉出品項數
             total_stock = sum(t['Original_Stock'] for t in active_transfers)  # 總存貨
@@ -547,7 +1672,7 @@ class TransferRecommendationSystem:
             
             # 綜合優先級：(可2件品項數, 總存貨, 品項數, 總轉出數量)
             priority = (multi_piece_items, total_stock, active_items, total_qty)
-            site_priority.append((site, priority, transfers))
+            site_priority.append((site, priority, transfer_ids))
         
         # 按綜合優先級排序
         # 1. 可2件以上轉出品項數多的優先
@@ -556,67 +1681,142 @@ class TransferRecommendationSystem:
         # 4. 總轉出數量多的優先
         site_priority.sort(key=lambda x: x[1], reverse=True)
         
-        # 按優先順序處理每個店舖的轉出
-        for site, priority_metrics, transfers in site_priority:
-            # 在店舖內按存貨量排序轉出項目
-            transfers_sorted = []
-            for i, transfer in transfers:
-                if transfer['Transfer_Qty'] > 0:
-                    # 優先級：(可轉出數量>=2, 原始存貨, 轉出數量)
-                    can_multi = 1 if transfer['Transfer_Qty'] >= 2 else 0
-                    item_priority = (can_multi, transfer['Original_Stock'], transfer['Transfer_Qty'])
-                    transfers_sorted.append((item_priority, i, transfer))
+        site_order = []
+        for site, _, transfer_ids in site_priority:
+            # 在店舖內按存貨量排序轉出項目：(可轉出數量>=2, 原始存貨, 轉出數量)
+            def item_priority(i):
+                transfer = available_transfers[i]
+                can_multi = 1 if transfer['Transfer_Qty'] >= 2 else 0
+                return (can_multi, transfer['Original_Stock'], transfer['Transfer_Qty'])
             
-            # 按項目優先級排序
-            transfers_sorted.sort(key=lambda x: x[0], reverse=True)
+            site_order.append((site, sorted(transfer_ids, key=item_priority, reverse=True)))
+        return site_order
+    
+    def _match_rf_transfers_optimized(self, available_transfers, available_receives, suggestions, use_kernel=True):
+        """處理RF轉出 - 優化存貨優先、同店舖轉出、避免單件"""
+        site_order = self._rf_site_order(available_transfers)
+        progress = self._progress("匹配RF轉出", len(site_order))
+        
+        # 原逐筆匹配按 (店舖順序, 接收順序, 店舖內項目順序) 產生建議
+        emission_rank = {}
+        donor_order = []
+        for site_rank, (site, transfer_ids) in enumerate(site_order):
+            for item_rank, ti in enumerate(transfer_ids):
+                emission_rank[ti] = (site_rank, item_rank)
+                donor_order.append(ti)
+        
+        keyed_pairs = []
+        fallback_groups = None  # None: 所有組逐筆匹配
+        if use_kernel:
+            pairs, fallback_groups = self._kernel_pairs(available_transfers, donor_order, available_receives)
+            
+            # 以下組須逐筆處理：
+            # 1. 出現1件分配 - 會觸發1→2件調整或跳過單件
+            # 2. 同一轉出項目分配給多個接收方 - RF逐筆匹配每次分配扣減轉出數量兩次
+            #    （店舖內排序列表與 available_transfers 引用同一記錄），後續分配與區間重疊不同
+            donor_pair_count = {}
+            for ti, ri, qty in pairs:
+                donor_pair_count[ti] = donor_pair_count.get(ti, 0) + 1
+            for ti, ri, qty in pairs:
+                if qty == 1 or donor_pair_count[ti] > 1:
+                    fallback_groups.add((available_transfers[ti]['Article'], available_transfers[ti]['OM']))
+            
+            for ti, ri, qty in pairs:
+                transfer = available_transfers[ti]
+                if (transfer['Article'], transfer['OM']) not in fallback_groups:
+                    site_rank, item_rank = emission_rank[ti]
+                    keyed_pairs.append(((site_rank, ri, item_rank), ti, ri, qty))
+        
+        self._count('rf_kernel_pairs', len(keyed_pairs))
+        if fallback_groups is None or fallback_groups:
+            self._count('rf_fallback_groups', len(fallback_groups or ()))
+            greedy_pairs = self._greedy_rf_pairs(available_transfers, site_order, available_receives,
+                                                 fallback_groups, progress)
+            self._count('rf_greedy_pairs', len(greedy_pairs))
+            keyed_pairs.extend(greedy_pairs)
+        
+        self._apply_pairs(available_transfers, available_receives, keyed_pairs, suggestions, transfer_decrement=2)
+        progress.finish()
+    
+    def _greedy_rf_pairs(self, transfers, site_order, receives, groups, progress=_NULL_PROGRESS):
+        """RF轉出逐筆貪婪匹配（含1→2件調整及避免單件）；groups 為 None 時處理所有組"""
+        def group_of(item):
+            return (item['Article'], item['OM'])
+        
+        remaining = {}
+        donors_by_group = {}
+        for _, transfer_ids in site_order:
+            for ti in transfer_ids:
+                key = group_of(transfers[ti])
+                if groups is None or key in groups:
+                    remaining[ti] = transfers[ti]['Transfer_Qty']
+                    donors_by_group.setdefault(key, []).append(ti)
+        
+        need = {}
+        receives_by_group = {}
+        for ri, receive in enumerate(receives):
+            key = group_of(receive)
+            if key in donors_by_group:
+                need[ri] = receive['Need_Qty']
+                receives_by_group.setdefault(key, []).append(ri)
+        
+        keyed_pairs = []
+        for site_rank, (site, transfer_ids) in enumerate(site_order):
+            progress.update(site_rank + 1)
+            site_items = [(item_rank, ti) for item_rank, ti in enumerate(transfer_ids) if ti in remaining]
+            if not site_items:
+                continue
+            
+            # 只需檢查與該店舖轉出項目同組的接收候選（按接收順序）
+            site_groups = {group_of(transfers[ti]) for _, ti in site_items}
+            site_receives = sorted(ri for key in site_groups for ri in receives_by_group.get(key, ()))
             
-            # 處理該店舖的所有轉出需求
-            for receive in available_receives[:]:
-                if receive['Need_Qty'] <= 0:
+            for ri in site_receives:
+                if need[ri] <= 0:
                     continue
-                    
+                receive = receives[ri]
+                
                 # 按優先級順序查找匹配的轉出項目
-                for item_priority, i, transfer in transfers_sorted:
+                for item_rank, ti in site_items:
+                    transfer = transfers[ti]
                     if (transfer['Article'] == receive['Article'] and 
                         transfer['OM'] == receive['OM'] and 
                         transfer['Site'] != receive['Site'] and
-                        transfer['Transfer_Qty'] > 0):
+                        remaining[ti] > 0):
                         
-                        actual_qty = min(transfer['Transfer_Qty'], receive['Need_Qty'])
+                        actual_qty = min(remaining[ti], need[ri])
                         
                         # 智能數量優化
                         if actual_qty == 1:
                             # 如果只有1件且該轉出項目有足夠庫存，嘗試調高到2件
-                            if transfer['Transfer_Qty'] >= 2:
+                            if remaining[ti] >= 2:
                                 after_transfer_stock = transfer['Original_Stock'] - 2
                                 if after_transfer_stock >= transfer['Safety_Stock']:
                                     actual_qty = 2
                             else:
                                 # 如果真的只能轉1件，檢查是否有其他店舖可以轉2件以上
-                                if self._has_better_multi_piece_option(receive, rf_transfers_by_site, site):
+                                if self._has_better_multi_piece_option(receive, donors_by_group[group_of(receive)],
+                                                                       transfers, remaining, site):
                                     continue  # 跳過此次1件轉出，等待更好的選項
                         
                         if actual_qty > 0:
-                            suggestions.append(self._create_suggestion(transfer, receive, actual_qty))
-                            available_transfers[i]['Transfer_Qty'] -= actual_qty
-                            transfer['Transfer_Qty'] -= actual_qty  # 同步更新本地副本
-                            receive['Need_Qty'] -= actual_qty
+                            keyed_pairs.append(((site_rank, ri, item_rank), ti, ri, actual_qty))
+                            remaining[ti] -= 2 * actual_qty  # 沿用v1.73：每次分配扣減兩次
+                            need[ri] -= actual_qty
                             
-                            if receive['Need_Qty'] <= 0:
+                            if need[ri] <= 0:
                                 break
-                                
-    def _has_better_multi_piece_option(self, receive, rf_transfers_by_site, current_site):
+        
+        return keyed_pairs
+    
+    def _has_better_multi_piece_option(self, receive, group_donors, transfers, remaining, current_site):
         """檢查是否有其他店舖能提供2件以上的轉出選項"""
-        for site, transfers in rf_transfers_by_site.items():
-            if site == current_site:
-                continue
-                
-            for i, transfer in transfers:
-                if (transfer['Article'] == receive['Article'] and 
-                    transfer['OM'] == receive['OM'] and 
-                    transfer['Site'] != receive['Site'] and
-                    transfer['Transfer_Qty'] >= 2):
-                    return True
+        for ti in group_donors:
+            transfer = transfers[ti]
+            if (transfer['Site'] != current_site and
+                transfer['Site'] != receive['Site'] and
+                remaining[ti] >= 2):
+                return True
         return False
     
     def _create_suggestion(self, transfer, receive, actual_qty):
@@ -686,45 +1886,316 @@ class TransferRecommendationSystem:
         
         return stats
     
-    def generate_recommendations(self, mode="A"):
-        """生成調貨建議"""
+    def _report_stage(self, stage):
+        """回報進入新階段"""
+        if self.progress_callback is not None:
+            self.progress_callback(stage, 0, 0)
+    
+    def _count(self, name, value=1):
+        """累加引擎計數（只在生成建議期間記錄）"""
+        if self.run_counters is not None:
+            self.run_counters.add(name, value)
+    
+    def _memory_stage(self, stage):
+        """記憶體分析階段（未啟用記憶體分析時不做任何事）"""
+        if self.memory_profiler is None:
+            return nullcontext()
+        return self.memory_profiler.stage(stage)
+    
+    def _progress(self, stage, total):
+        """取得指定階段的節流進度回報器"""
+        if self.progress_callback is None:
+            return _NULL_PROGRESS
+        return ProgressThrottle(self.progress_callback, stage, total)
+    
+    @_memory_profiled('generate')
+    def generate_recommendations(self, mode="A", progress_callback=None):
+        """
+        生成調貨建議
+        progress_callback(stage, done, total): 可選的進度回報函數，stage 為 RECOMMENDATION_STAGES 之一
+        """
         if self.df is None:
             return False, "請先載入數據"
         
+        self.progress_callback = progress_callback
+        counters = self.run_counters = engine_log.EngineCounters()
         try:
             self.mode = mode
             
             # 識別候選
-            transfer_candidates = self.identify_transfer_candidates(mode)
-            
-            # C模式使用專門的接收候選識別
-            if mode == "C":
-                receive_candidates = self.identify_receive_candidates_mode_c()
-            else:
-                receive_candidates = self.identify_receive_candidates()
+            with counters.timed('identify'), self._memory_stage('generate.identify'):
+                transfer_candidates = self.identify_transfer_candidates(mode)
+                
+                # 接收候選按模式規則識別（C模式為重點補0）
+                receive_candidates = self.identify_receive_candidates(mode)
+            counters.add('transfer_candidates', len(transfer_candidates))
+            counters.add('receive_candidates', len(receive_candidates))
             
             # 解決同店舖同SKU衝突 - v1.72 新增
-            transfer_candidates, receive_candidates = self.resolve_same_store_conflicts(transfer_candidates, receive_candidates)
+            self._report_stage("解決同店衝突")
+            with counters.timed('conflicts'), self._memory_stage('generate.conflicts'):
+                transfer_candidates, receive_candidates, conflicts = self.resolve_same_store_conflicts(
+                    transfer_candidates, receive_candidates)
+            counters.add('conflicts', len(conflicts))
             
             # 匹配建議
-            suggestions = self.match_transfer_suggestions(transfer_candidates, receive_candidates)
+            with counters.timed('match'), self._memory_stage('generate.match'):
+                suggestions = self.match_transfer_suggestions(transfer_candidates, receive_candidates)
             
             # 計算統計
-            statistics = self.calculate_statistics(suggestions)
+            self._report_stage("計算統計")
+            with counters.timed('statistics'), self._memory_stage('generate.statistics'):
+                statistics = self.calculate_statistics(suggestions)
+            statistics['conflicts'] = conflicts
             
             self.transfer_suggestions = suggestions
             self.statistics = statistics
+            self._store_result_set(mode, suggestions, statistics)
             
+            counters.add('suggestions', len(suggestions))
+            counters.log_summary(logger, "生成建議 模式%s: %d 條建議", mode, len(suggestions))
+            _record_run_metrics(mode, len(transfer_candidates), len(receive_candidates), len(conflicts),
+                                len(suggestions), counters.timings['match'])
             return True, f"成功生成 {len(suggestions)} 條調貨建議"
             
         except Exception as e:
+            logger.exception("生成建議失敗 模式%s", mode)
             return False, f"生成建議失敗: {str(e)}"
+        finally:
+            self.progress_callback = None
+            self.run_counters = None
     
-    def create_visualization(self):
-        """創建視覺化圖表"""
+    def generate_comparison(self, modes=tuple(MODE_LABELS), progress_callback=None):
+        """
+        一次生成多個模式的調貨建議以作比較
+        特徵數據框只建立一次；轉出候選共用一次規則掃描（rule_engine.build_candidates_for_sets），
+        接收規則相同的模式共用同一批接收候選；衝突解決、匹配及統計按模式依次執行
+        （逐筆匹配受GIL限制，執行緒並行不會更快）。各模式結果保存為結果集，並排比較摘要見 self.comparison
+        progress_callback(stage, done, total): 共用階段沿用 RECOMMENDATION_STAGES，其後為「模式比較」
+        """
+        if self.df is None:
+            return False, "請先載入數據"
+        
+        modes = list(modes)
+        self.progress_callback = progress_callback
+        counters = engine_log.EngineCounters()
+        try:
+            # 共用階段
+            with counters.timed('identify'):
+                transfer_by_mode = self.identify_transfer_candidates_for_modes(modes)
+                # 接收規則相同的模式（A/B）共用同一批接收候選
+                receive_by_mode = {}
+                for mode in modes:
+                    shared = next((other for other in receive_by_mode
+                                   if MODE_RULES[other]['receive'] is MODE_RULES[mode]['receive']), None)
+                    if shared is not None:
+                        receive_by_mode[mode] = receive_by_mode[shared]
+                    else:
+                        receive_by_mode[mode] = self.identify_receive_candidates(mode)
+            
+            # 模式專屬階段 - 各模式依次使用獨立的工作實例
+            spawn_worker = self._worker_factory()
+            results = {}
+            progress = self._progress("模式比較", len(modes))
+            with counters.timed('modes'):
+                for finished, mode in enumerate(modes, 1):
+                    worker = spawn_worker()
+                    worker.run_counters = engine_log.EngineCounters()
+                    # 匹配時會回寫候選的剩餘數量，共用的候選記錄按模式複製
+                    transfer_candidates = [dict(candidate) for candidate in transfer_by_mode[mode]]
+                    receive_candidates = [dict(candidate) for candidate in receive_by_mode[mode]]
+                    transfer_candidates, receive_candidates, conflicts = worker.resolve_same_store_conflicts(
+                        transfer_candidates, receive_candidates)
+                    with worker.run_counters.timed('match'):
+                        suggestions = worker.match_transfer_suggestions(transfer_candidates, receive_candidates)
+                    statistics = worker.calculate_statistics(suggestions)
+                    statistics['conflicts'] = conflicts
+                    
+                    for name, value in worker.run_counters.counts.items():
+                        counters.add(name, value)
+                    counters.add('conflicts', len(conflicts))
+                    counters.add(f"suggestions_{mode}", len(suggestions))
+                    _record_run_metrics(mode, len(transfer_by_mode[mode]), len(receive_by_mode[mode]),
+                                        len(conflicts), len(suggestions), worker.run_counters.timings['match'])
+                    results[mode] = {
+                        'suggestions': suggestions,
+                        'statistics': statistics,
+                        'message': f"成功生成 {len(suggestions)} 條調貨建議"
+                    }
+                    progress.update(finished)
+            progress.finish()
+            
+            comparison = {
+                'modes': modes,
+                'results': results,
+                'summary': self._comparison_summary(modes, results, transfer_by_mode, receive_by_mode)
+            }
+            self._adopt_comparison(comparison)
+            
+            counters.log_summary(logger, "模式比較 %s 完成", ", ".join(modes))
+            return True, f"成功比較 {len(modes)} 個模式"
+        
+        except Exception as e:
+            logger.exception("模式比較失敗")
+            return False, f"模式比較失敗: {str(e)}"
+        finally:
+            self.progress_callback = None
+    
+    def _comparison_summary(self, modes, results, transfer_by_mode, receive_by_mode):
+        """建立各模式並排比較表"""
+        rows = {}
+        for mode in modes:
+            statistics = results[mode]['statistics']
+            rows[MODE_LABELS.get(mode, mode)] = {
+                '轉出候選件數': int(sum(candidate['Transfer_Qty'] for candidate in transfer_by_mode[mode])),
+                '接收需求件數': int(sum(candidate['Need_Qty'] for candidate in receive_by_mode[mode])),
+                '同店衝突': len(statistics['conflicts']),
+                '建議數': int(statistics.get('total_suggestions', 0)),
+                '調貨件數': int(statistics.get('total_qty', 0)),
+                '涉及產品': int(statistics.get('total_articles', 0)),
+                '涉及OM': int(statistics.get('total_oms', 0))
+            }
+        return pd.DataFrame.from_dict(rows, orient='index')
+    
+    def _adopt_comparison(self, comparison):
+        """保存比較結果：各模式結果集及並排摘要，當前結果切換到第一個模式"""
+        for mode in comparison['modes']:
+            result = comparison['results'][mode]
+            self._store_result_set(mode, result['suggestions'], result['statistics'], pinned=comparison['modes'])
+        self.comparison = {'modes': comparison['modes'], 'summary': comparison['summary']}
+        self.activate_result_set(comparison['modes'][0])
+    
+    def comparison_bundle(self):
+        """
+        返回最近一次比較的結果包 {'modes', 'results': {模式: 建議及統計}, 'summary'}
+        比較的結果集已被後續生成淘汰時拋出 RuntimeError，不返回不完整的結果包
+        """
+        if self.comparison is None:
+            return None
+        modes = self.comparison['modes']
+        missing = [mode for mode in modes if mode not in self.result_sets]
+        if missing:
+            raise RuntimeError(f"比較結果集已被淘汰: {', '.join(missing)}")
+        return {
+            'modes': modes,
+            'results': {mode: {'suggestions': self.result_sets[mode]['suggestions'],
+                               'statistics': self.result_sets[mode]['statistics']}
+                        for mode in modes},
+            'summary': self.comparison['summary']
+        }
+    
+    def get_conflicts(self):
+        """返回當前結果的同店舖同SKU衝突表（欄位名稱已轉為中文）"""
+        conflicts = (self.statistics or {}).get('conflicts')
+        if conflicts is None:
+            conflicts = pd.DataFrame(columns=CONFLICT_COLUMNS)
+        return conflicts.rename(columns=CONFLICT_COLUMN_LABELS)
+    
+    def suggestions_fingerprint(self):
+        """計算調貨建議集合與模式的指紋，用於圖表快取"""
         if not self.transfer_suggestions:
             return None
         
+        suggestions = self.transfer_suggestions
+        cached = self._suggestions_key
+        if cached and cached[0] is suggestions and cached[1] == self.mode:
+            return cached[2]
+        
+        df_suggestions = pd.DataFrame(suggestions)
+        digest = hashlib.sha1(pd.util.hash_pandas_object(df_suggestions, index=False).values.tobytes())
+        digest.update(self.mode.encode('utf-8'))
+        fingerprint = digest.hexdigest()
+        
+        self._suggestions_key = (suggestions, self.mode, fingerprint)
+        return fingerprint
+    
+    def _get_suggestion_view(self):
+        """取得調貨建議數據框及篩選索引（按建議指紋快取）"""
+        fingerprint = self.suggestions_fingerprint()
+        if fingerprint is None:
+            return None
+        
+        if self._suggestion_view is not None and self._suggestion_view['key'] == fingerprint:
+            return self._suggestion_view
+        
+        frame = pd.DataFrame(self.transfer_suggestions)
+        
+        # 預計算每個篩選值對應的行位置
+        index = {
+            'OM': frame.groupby('OM', sort=False).indices,
+            'Article': frame.groupby('Article', sort=False).indices,
+        }
+        for name, columns in (('Site', ['Transfer_Site', 'Receive_Site']),
+                              ('Type', ['Transfer_Type', 'Receive_Type'])):
+            combined = {}
+            for col in columns:
+                for value, positions in frame.groupby(col, sort=False).indices.items():
+                    combined.setdefault(value, []).append(positions)
+            index[name] = {value: np.unique(np.concatenate(parts)) for value, parts in combined.items()}
+        
+        self._suggestion_view = {'key': fingerprint, 'frame': frame, 'index': index,
+                                 'nbytes': int(frame.memory_usage(deep=True).sum())}
+        return self._suggestion_view
+    
+    def get_suggestion_filter_options(self):
+        """取得分頁表格的篩選選項"""
+        view = self._get_suggestion_view()
+        if view is None:
+            return {}
+        return {name: sorted(values.keys(), key=str) for name, values in view['index'].items()}
+    
+    def _filter_suggestion_positions(self, view, filters):
+        """用預計算索引求出符合所有篩選條件的行位置"""
+        positions = None
+        
+        for name, values in (filters or {}).items():
+            if not values:
+                continue
+            lookup = view['index'][name]
+            matched = [lookup[value] for value in values if value in lookup]
+            matched = np.unique(np.concatenate(matched)) if matched else np.array([], dtype=np.intp)
+            positions = matched if positions is None else np.intersect1d(positions, matched, assume_unique=True)
+        
+        if positions is None:
+            positions = np.arange(len(view['frame']))
+        return positions
+    
+    def count_suggestions(self, filters=None):
+        """計算符合篩選條件的調貨建議筆數"""
+        view = self._get_suggestion_view()
+        if view is None:
+            return 0
+        return len(self._filter_suggestion_positions(view, filters))
+    
+    def query_suggestions(self, filters=None, sort_by=None, ascending=True, page=1, page_size=100):
+        """
+        伺服器端篩選、排序和分頁調貨建議
+        filters: {'OM': [...], 'Article': [...], 'Site': [...], 'Type': [...]}，
+                 Site同時匹配轉出/接收店舖，Type同時匹配轉出/接收類型
+        返回 (當頁數據, 符合條件總筆數)
+        """
+        view = self._get_suggestion_view()
+        if view is None:
+            return pd.DataFrame(), 0
+        
+        frame = view['frame']
+        positions = self._filter_suggestion_positions(view, filters)
+        total = len(positions)
+        
+        # 只對篩選後的行排序
+        if sort_by and sort_by in frame.columns and total > 0:
+            sort_values = frame[sort_by].to_numpy()[positions]
+            order = np.argsort(sort_values, kind='stable')
+            if not ascending:
+                order = order[::-1]
+            positions = positions[order]
+        
+        page = max(int(page), 1)
+        start = (page - 1) * page_size
+        return frame.iloc[positions[start:start + page_size]], total
+    
+    def _calculate_chart_stats(self):
+        """按OM統計轉出/接收類型數量（圖表共用）"""
         df_suggestions = pd.DataFrame(self.transfer_suggestions)
         
         # 按OM統計數據
@@ -733,20 +2204,17 @@ class TransferRecommendationSystem:
         
         # 合併統計數據並重命名為英文
         om_stats = pd.concat([om_transfer_stats, om_receive_stats], axis=1, sort=False).fillna(0)
+        om_stats.columns = [CHART_COLUMN_MAPPING.get(col, col) for col in om_stats.columns]
         
-        # 重命名列為英文
-        column_mapping = {
-            'ND轉出': 'ND Transfer',
-            'RF過剩轉出': 'RF Excess Transfer', 
-            'RF加強轉出': 'RF Enhanced Transfer',
-            '緊急缺貨補貨': 'Emergency Restock',
-            'SasaNet調撥接收': 'SasaNet Transfer Receive',
-            '潛在缺貨補貨': 'Potential Restock',
-            '重點補0': 'Critical Zero Restock'
-        }
+        # 只顯示有數據的類型
+        return om_stats.loc[:, om_stats.sum() > 0]
+    
+    def create_visualization(self):
+        """創建視覺化圖表（呼叫方負責 plt.close(fig)）"""
+        if not self.transfer_suggestions:
+            return None
         
-        # 重命名存在的列
-        om_stats.columns = [column_mapping.get(col, col) for col in om_stats.columns]
+        om_stats = self._calculate_chart_stats()
         
         # 創建圖表
         fig, ax = plt.subplots(figsize=(14, 8))
@@ -760,28 +2228,16 @@ class TransferRecommendationSystem:
         
         # 繪製條形圖
         bars = []
-        labels = []
-        positions = []
-        
-        bar_position = 0
         for i, col in enumerate(om_stats.columns):
-            if om_stats[col].sum() > 0:  # 只顯示有數據的類型
-                bars.append(ax.bar(x + bar_position * width, om_stats[col], width, 
-                                 label=col, color=colors[i % len(colors)]))
-                labels.append(col)
-                positions.append(bar_position)
-                bar_position += 1
+            bars.append(ax.bar(x + i * width, om_stats[col], width, 
+                             label=col, color=colors[i % len(colors)]))
         
         # 設置圖表 - 全英文標籤
         ax.set_xlabel('OM Units', fontsize=12)
         ax.set_ylabel('Transfer Quantity', fontsize=12)
+        ax.set_title(CHART_TITLES.get(self.mode, CHART_TITLES['A']), fontsize=14, fontweight='bold')
         
-        if self.mode == "A":
-            ax.set_title('OM Transfer vs Receive Analysis (Conservative Mode)', fontsize=14, fontweight='bold')
-        else:
-            ax.set_title('OM Transfer vs Receive Analysis (Enhanced Mode)', fontsize=14, fontweight='bold')
-        
-        ax.set_xticks(x + width * (len(positions) - 1) / 2)
+        ax.set_xticks(x + width * (len(bars) - 1) / 2)
         ax.set_xticklabels(om_stats.index, rotation=45, ha='right')
         ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
         ax.grid(axis='y', alpha=0.3)
@@ -794,14 +2250,80 @@ class TransferRecommendationSystem:
                     ax.text(bar.get_x() + bar.get_width()/2., height + 0.1,
                            f'{int(height)}', ha='center', va='bottom', fontsize=9)
         
-        plt.tight_layout()
+        fig.tight_layout()
+        return fig
+    
+    def render_visualization_png(self):
+        """渲染圖表為PNG bytes - 按建議指紋和模式快取，渲染後立即關閉figure"""
+        fingerprint = self.suggestions_fingerprint()
+        if fingerprint is None:
+            return None
+        
+        cache_key = (fingerprint, self.mode)
+        png_bytes = _chart_cache_get(cache_key)
+        if png_bytes is not None:
+            return png_bytes
+        
+        fig = self.create_visualization()
+        try:
+            buffer = io.BytesIO()
+            fig.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
+            png_bytes = buffer.getvalue()
+        finally:
+            plt.close(fig)
+        
+        _chart_cache_put(cache_key, png_bytes)
+        return png_bytes
+    
+    def create_interactive_visualization(self):
+        """創建互動圖表（plotly，瀏覽器端渲染）；未安裝plotly時返回None"""
+        if not self.transfer_suggestions:
+            return None
+        
+        try:
+            import plotly.graph_objects as go
+        except ImportError:
+            return None
+        
+        om_stats = self._calculate_chart_stats()
+        
+        fig = go.Figure()
+        for col in om_stats.columns:
+            fig.add_trace(go.Bar(name=col, x=om_stats.index.astype(str), y=om_stats[col]))
+        
+        fig.update_layout(
+            barmode='group',
+            title=CHART_TITLES.get(self.mode, CHART_TITLES['A']),
+            xaxis_title='OM Units',
+            yaxis_title='Transfer Quantity',
+            height=500
+        )
         return fig
     
+    def prepared_export(self):
+        """返回當前建議已生成的Excel報告 (bytes, 文件名)；未生成或建議已改變時返回 (None, None)"""
+        fingerprint = self.suggestions_fingerprint()
+        if self._export is None or fingerprint is None or self._export[0] != fingerprint:
+            return None, None
+        return self._export[1], self._export[2]
+    
+    def prepare_export(self):
+        """生成當前建議的Excel報告並按建議指紋保存，頁面重新執行時沿用；失敗時返回 (None, 錯誤訊息)"""
+        excel_data, filename = self.prepared_export()
+        if excel_data is not None:
+            return excel_data, filename
+        excel_data, filename = self.export_to_excel()
+        if excel_data is not None:
+            self._export = (self.suggestions_fingerprint(), excel_data, filename)
+        return excel_data, filename
+    
+    @_memory_profiled('export')
     def export_to_excel(self):
         """匯出到Excel"""
         if not self.transfer_suggestions:
             return None, "沒有可匯出的數據"
         
+        started = time.perf_counter()
         try:
             output = io.BytesIO()
             
@@ -838,6 +2360,16 @@ class TransferRecommendationSystem:
                 
                 df_export.to_excel(writer, sheet_name='調貨建議', index=False)
                 
+                # 同店舖同SKU衝突（已移除的轉出候選）
+                conflicts = self.get_conflicts()
+                if not conflicts.empty:
+                    conflicts.to_excel(writer, sheet_name='同店衝突', index=False)
+                
+                # 預處理修正（只為有修正的行生成備註）
+                quality_rows = self.get_quality_rows()
+                if not quality_rows.empty:
+                    quality_rows.to_excel(writer, sheet_name='數據修正', index=False)
+                
                 # 工作表2: 統計摘要
                 stats_sheet = writer.book.create_sheet('統計摘要')
                 row = 1
@@ -891,13 +2423,349 @@ class TransferRecommendationSystem:
             filename = f"調貨建議_{date_str}.xlsx"
             
             output.seek(0)
-            return output.getvalue(), filename
+            content = output.getvalue()
+            metrics.EXPORT_SECONDS.observe(time.perf_counter() - started)
+            metrics.EXPORT_BYTES.observe(len(content))
+            metrics.flush()
+            return content, filename
             
         except Exception as e:
             return None, f"匯出失敗: {str(e)}"
 
+def display_suggestion_table(system):
+    """顯示分頁的調貨建議表格"""
+    options = system.get_suggestion_filter_options()
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        om_filter = st.multiselect("OM", options.get('OM', []), key="filter_om")
+    with col2:
+        type_filter = st.multiselect("類型", options.get('Type', []), key="filter_type")
+    with col3:
+        article_text = st.text_input("Article", key="filter_article", help="多個值以逗號分隔")
+    with col4:
+        site_text = st.text_input("Site", key="filter_site", help="匹配轉出或接收店舖，多個值以逗號分隔")
+    
+    filters = {
+        'OM': om_filter,
+        'Type': type_filter,
+        'Article': [value.strip() for value in article_text.split(',') if value.strip()],
+        'Site': [value.strip() for value in site_text.split(',') if value.strip()]
+    }
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        sort_by = st.selectbox("排序欄位", ['(不排序)', 'Transfer_Qty', 'Article', 'OM', 'Transfer_Site',
+                                            'Receive_Site', 'Original_Stock', 'After_Transfer_Stock'],
+                               key="table_sort_by")
+    with col2:
+        ascending = st.radio("排序方向", ["升序", "降序"], horizontal=True, key="table_sort_dir") == "升序"
+    with col3:
+        page_size = st.selectbox("每頁筆數", [50, 100, 200, 500], index=1, key="table_page_size")
+    
+    sort_column = None if sort_by == '(不排序)' else sort_by
+    total = system.count_suggestions(filters)
+    page_count = max((total + page_size - 1) // page_size, 1)
+    # 篩選條件變更後頁數減少時，將頁碼限制在有效範圍內
+    if st.session_state.get('table_page', 1) > page_count:
+        st.session_state.table_page = page_count
+    page = st.number_input("頁碼", min_value=1, max_value=page_count, value=1, step=1, key="table_page")
+    
+    page_df, total = system.query_suggestions(filters, sort_column, ascending, page, page_size)
+    st.caption(f"共 {total} 筆，第 {page}/{page_count} 頁")
+    st.dataframe(page_df, use_container_width=True, hide_index=True)
+
+def display_results(system, interactive_chart=False):
+    """顯示分析結果、統計、圖表和匯出區塊"""
+    st.markdown('<div class="section-header"><h2>📊 分析結果</h2></div>', unsafe_allow_html=True)
+    
+    # KPI指標卡
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("總建議數", system.statistics['total_suggestions'])
+    with col2:
+        st.metric("總調貨件數", system.statistics['total_qty'])
+    with col3:
+        st.metric("涉及產品", system.statistics['total_articles'])
+    with col4:
+        st.metric("涉及OM", system.statistics['total_oms'])
+    
+    # 調貨建議表格 - 伺服器端篩選/排序/分頁，只傳送當頁數據
+    st.subheader("📋 調貨建議明細")
+    display_suggestion_table(system)
+    
+    # 統計分析表格
+    st.subheader("📈 統計分析")
+    
+    tab1, tab2, tab3, tab4 = st.tabs(["按產品統計", "按OM統計", "轉出類型分佈", "接收類型分佈"])
+    
+    with tab1:
+        st.dataframe(system.statistics['article_stats'], use_container_width=True)
+    
+    with tab2:
+        st.dataframe(system.statistics['om_stats'], use_container_width=True)
+    
+    with tab3:
+        st.dataframe(system.statistics['transfer_type_stats'], use_container_width=True)
+    
+    with tab4:
+        st.dataframe(system.statistics['receive_type_stats'], use_container_width=True)
+    
+    # 同店舖同SKU衝突 - 已移除轉出、保持接收的記錄
+    conflicts = system.get_conflicts()
+    if not conflicts.empty:
+        with st.expander(f"🔧 已解決 {len(conflicts)} 個同店舖同SKU衝突"):
+            st.dataframe(conflicts, use_container_width=True, hide_index=True)
+    
+    # 視覺化圖表 - 互動模式由瀏覽器渲染，否則使用快取的PNG
+    st.subheader("📊 視覺化分析")
+    interactive_fig = system.create_interactive_visualization() if interactive_chart else None
+    if interactive_fig is not None:
+        st.plotly_chart(interactive_fig, use_container_width=True)
+    else:
+        png_bytes = system.render_visualization_png()
+        if png_bytes:
+            st.image(png_bytes, use_container_width=True)
+    
+    # 5. 匯出區塊
+    st.markdown('<div class="section-header"><h2>💾 匯出結果</h2></div>', unsafe_allow_html=True)
+    
+    # 工作簿只在使用者要求時生成，之後按建議指紋沿用（篩選、分頁等重新執行不重建）
+    excel_data, filename = system.prepared_export()
+    if excel_data is None and st.button("📄 生成Excel報告", use_container_width=True):
+        with st.spinner("正在生成Excel報告..."):
+            excel_data, filename = system.prepare_export()
+        if excel_data is None:
+            st.error(filename)
+    if excel_data:
+        st.download_button(
+            label="📥 下載Excel報告",
+            data=excel_data,
+            file_name=filename,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True
+        )
+
+def display_preliminary_statistics(system):
+    """顯示A/B/C三種模式的預計統計；完整計算完成前顯示抽樣估算及信賴區間"""
+    st.subheader("📊 預計統計資訊")
+    
+    if system.preliminary_stats_ready():
+        preliminary = system.preliminary_stats
+    else:
+        preliminary = system.estimate_preliminary_statistics()
+        sample = preliminary['sample']
+        st.info(f"⏳ 以 {sample['rows']:,}/{sample['total_rows']:,} 行抽樣估算"
+                f"（±為 {sample['z']:g} 倍標準誤的信賴區間），完整計算完成後自動更新為精確數字...")
+    
+    def format_value(stats, name):
+        margin = stats.get(name.replace('estimated_', '') + '_margin')
+        return stats[name] if margin is None else f"≈{stats[name]:,} ±{margin:,}"
+    
+    columns = st.columns(3)
+    mode_sections = [
+        ("**A模式 (保守轉貨):**", 'conservative'),
+        ("**B模式 (加強轉貨):**", 'enhanced'),
+        ("**C模式 (重點補0):**", 'critical_restock')
+    ]
+    for column, (title, key) in zip(columns, mode_sections):
+        with column:
+            st.markdown(title)
+            stats = preliminary[key]
+            subcol1, subcol2, subcol3 = st.columns(3)
+            with subcol1:
+                st.metric("預計轉出", format_value(stats, 'estimated_transfer'))
+            with subcol2:
+                st.metric("預計接收", format_value(stats, 'estimated_receive'))
+            with subcol3:
+                st.metric("預計需求", format_value(stats, 'estimated_demand'))
+
+def _poll_preliminary_statistics(system):
+    """片段輪詢：定時執行時若統計已完成，整頁重新執行以停止輪詢"""
+    inline_run = st.session_state.pop('preliminary_inline_run', False)
+    if system.preliminary_stats_ready() and not inline_run:
+        st.rerun()
+    display_preliminary_statistics(system)
+
+def _parse_number_list(text, cast):
+    """解析逗號分隔的數值列表"""
+    return [cast(value) for value in text.replace('，', ',').split(',') if value.strip()]
+
+def display_parameter_sweep(system):
+    """轉出限制參數掃描：一次計算參數網格下的預計轉出、接收及可匹配件數"""
+    with st.expander("🎛️ 轉出參數掃描", expanded=False):
+        with st.form("parameter_sweep"):
+            sweep_mode = st.radio("模式", [mode for mode in MODE_RULES if sweep_tier(mode)], horizontal=True,
+                                  format_func=lambda mode: MODE_LABELS[mode])
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                pct_text = st.text_input("轉出比例", "0.2, 0.3, 0.4, 0.5")
+            with col2:
+                min_text = st.text_input("最少轉出數量", "1, 2, 3")
+            with col3:
+                margin_text = st.text_input("MOQ餘量（B模式）", "0, 1, 2")
+            submitted = st.form_submit_button("執行掃描")
+        
+        if submitted:
+            try:
+                sweep = system.sweep_transfer_parameters(
+                    sweep_mode, _parse_number_list(pct_text, float),
+                    _parse_number_list(min_text, int), _parse_number_list(margin_text, int))
+                st.session_state.parameter_sweep_result = (system.dataset_key, sweep_mode, sweep)
+            except ValueError as e:
+                st.error(f"參數格式錯誤: {e}")
+        
+        saved = st.session_state.get('parameter_sweep_result')
+        if saved and saved[0] == system.dataset_key:
+            _, saved_mode, sweep = saved
+            tier = sweep_tier(saved_mode)
+            moq_margin = (tier.get('params') or {}).get('moq_margin')
+            st.caption(f"{MODE_LABELS[saved_mode]} 現行參數：轉出比例 {tier['cap']['pct']}、"
+                       f"最少轉出 {tier['cap']['min']}" +
+                       (f"、MOQ餘量 {moq_margin}" if moq_margin is not None else "") +
+                       "；預計可匹配件數按 (Article, OM) 的 min(轉出, 接收) 估算")
+            st.dataframe(sweep.rename(columns={
+                'Limit_Pct': '轉出比例',
+                'Min_Qty': '最少轉出數量',
+                'MOQ_Margin': 'MOQ餘量',
+                'Estimated_Transfer': '預計轉出',
+                'Estimated_Receive': '預計接收',
+                'Matched_Estimate': '預計可匹配件數'
+            }), use_container_width=True, hide_index=True)
+
+def _format_duration(seconds):
+    """以秒、分鐘或小時顯示時間"""
+    if seconds < 60:
+        return f"{seconds:.1f} 秒"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} 分鐘"
+    return f"{seconds / 3600:.1f} 小時"
+
+def display_run_cost(system, mode):
+    """生成建議前顯示各引擎的預計執行時間及峰值記憶體（按數據集及模式快取於會話）"""
+    key = (system.dataset_key, id(system.df), mode)
+    saved = st.session_state.get('run_cost_estimate')
+    if saved is None or saved[0] != key:
+        saved = (key, system.estimate_run_cost(mode))
+        st.session_state.run_cost_estimate = saved
+    cost = saved[1]
+    
+    single = cost[(cost['Scope'] == run_cost.SINGLE_MODE) & cost['Recommended']].iloc[0]
+    all_modes = cost[(cost['Scope'] == run_cost.ALL_MODES) & cost['Recommended']].iloc[0]
+    with st.expander(f"⏱️ 預計執行時間：{MODE_LABELS[mode]} 約 {_format_duration(single['Seconds'])}", expanded=False):
+        st.caption(f"按候選數及 (Article, OM) 組大小估算；全部模式建議"
+                   f"{'逐個生成' if all_modes['Engine'] == 'vectorized' else '使用「比較全部模式」'}"
+                   f"（約 {_format_duration(all_modes['Seconds'])}）")
+        table = cost.assign(
+            Engine=cost['Engine'].map(run_cost.ENGINES).where(cost['Scope'] == run_cost.SINGLE_MODE,
+                                                              cost['Engine'].map({'vectorized': "逐個生成",
+                                                                                  'comparison': "比較全部模式"})),
+            Seconds=cost['Seconds'].map(_format_duration),
+            Peak_Bytes=(cost['Peak_Bytes'] / 1024 / 1024).round(1),
+            Recommended=cost['Recommended'].map({True: "✅", False: ""}))
+        st.dataframe(table.drop(columns='Scope').rename(columns={
+            'Engine': '執行方式',
+            'Modes': '模式',
+            'Seconds': '預計時間',
+            'Peak_Bytes': '預計峰值記憶體 (MB)',
+            'Recommended': '建議'
+        }), use_container_width=True, hide_index=True)
+
+def display_job_panel(system):
+    """顯示當前數據集的背景任務進度及結果"""
+    with st.expander("🗂️ 背景任務", expanded=True):
+        jobs = system.list_recommendation_jobs()
+        
+        # 本會話的任務結束時觸發整頁重新執行以取回結果
+        pending = set(st.session_state.get('pending_jobs', []))
+        if any(job['id'] in pending and job['status'] in (JOB_DONE, JOB_FAILED) for job in jobs):
+            st.rerun()
+        
+        for job in jobs:
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                status = JOB_STATUS_LABELS[job['status']]
+                if job['status'] == JOB_RUNNING:
+                    stage = job['stage']
+                    stages = COMPARISON_STAGES if job['tags'].get('mode') == COMPARISON_MODE else RECOMMENDATION_STAGES
+                    stage_index = stages.index(stage) if stage in stages else 0
+                    stage_fraction = job['done'] / job['total'] if job['total'] else 0
+                    fraction = (stage_index + stage_fraction) / len(stages)
+                    st.progress(min(fraction, 1.0), text=f"{job['label']} - {status}: {stage}")
+                elif job['status'] == JOB_DONE:
+                    elapsed = job['finished_at'] - job['started_at']
+                    st.write(f"✅ {job['label']} - {status} ({elapsed:.1f} 秒)，{job['result']['message']}")
+                elif job['status'] == JOB_FAILED:
+                    st.write(f"❌ {job['label']} - {status}: {job['error'].splitlines()[0]}")
+                else:
+                    st.write(f"⏳ {job['label']} - {status}")
+            with col2:
+                if job['status'] == JOB_DONE:
+                    if st.button("載入結果", key=f"adopt_{job['id']}", use_container_width=True):
+                        success, _ = system.adopt_job_result(job['id'])
+                        if success:
+                            st.session_state.requested_mode = system.mode
+                        st.rerun()
+
+def display_comparison(system):
+    """顯示全部模式比較的並排摘要"""
+    st.subheader("⚖️ 模式比較")
+    st.dataframe(system.comparison['summary'], use_container_width=True)
+    st.caption("於左側選擇轉貨模式以查看該模式的建議明細")
+
+def display_validation_report(system, expanded=False):
+    """顯示最近一次載入的數據驗證報告"""
+    report = system.validation_report
+    if report is None or report.empty:
+        return
+    n_errors = int((report['嚴重程度'] == VALIDATION_ERROR).sum())
+    label = f"🔎 數據驗證報告: {n_errors} 項錯誤，{len(report) - n_errors} 項警告"
+    with st.expander(label, expanded=expanded):
+        st.dataframe(report.assign(範例行號=report['範例行號'].map(lambda rows: ", ".join(map(str, rows)))),
+                     use_container_width=True, hide_index=True)
+
+def display_memory_usage(system):
+    """顯示本會話及所有會話的記憶體使用"""
+    st.markdown("---")
+    st.subheader("🧠 記憶體使用")
+    
+    usage = system.memory_usage()
+    mb = 1024 * 1024
+    st.metric("本會話結果集", f"{usage['session_bytes'] / mb:.1f} MB",
+              help=f"預算 {usage['budget_bytes'] / mb:.0f} MB，已保存模式: {', '.join(usage['result_modes']) or '無'}")
+    shared_label = "（共用快取）" if usage['dataset_shared'] else ""
+    st.caption(f"數據集: {usage['dataset_bytes'] / mb:.1f} MB{shared_label}")
+    if system.dtype_report:
+        saved = system.dtype_report['before_bytes'] - system.dtype_report['after_bytes']
+        st.caption(f"緊湊欄位類型節省: {saved / mb:.1f} MB（原 {system.dtype_report['before_bytes'] / mb:.1f} MB）")
+    
+    dataset_count, dataset_bytes = dataset_cache_usage()
+    sessions = active_sessions_memory()
+    st.caption(f"共用數據集快取: {dataset_count} 個 / {dataset_bytes / mb:.1f} MB")
+    if _DATASET_STORE.enabled:
+        store_count, store_bytes = _DATASET_STORE.usage()
+        st.caption(f"磁碟數據集快取: {store_count} 個 / {store_bytes / mb:.1f} MB",
+                   help=f"目錄 {_DATASET_STORE.directory}，上限 {_DATASET_STORE.max_bytes / mb:.0f} MB")
+    st.caption(f"活躍會話: {len(sessions)} 個，結果集合計 {sum(item['session_bytes'] for item in sessions) / mb:.1f} MB")
+    
+    if system.memory_profiler is not None and system.memory_profiler.stages:
+        with st.expander("🔬 記憶體分析（各階段峰值）"):
+            report = system.memory_profiler.report()
+            table = pd.DataFrame({
+                '執行': report['Run'].fillna(''),
+                '階段': ["　" * depth + stage for stage, depth in zip(report['Stage'], report['Depth'])],
+                '峰值 (MB)': (report['Peak_Bytes'] / mb).round(1),
+                '淨增加 (MB)': (report['Net_Bytes'] / mb).round(1),
+                'RSS (MB)': (report['RSS_After'].astype(float) / mb).round(1),
+                '主要分配位置': [", ".join(f"{site} {size / mb:.1f}MB" for site, size, _ in sites[:3])
+                                  for sites in report['Top_Sites']]
+            })
+            st.dataframe(table, hide_index=True, use_container_width=True)
+
 def main():
     """主應用程序"""
+    engine_log.configure_logging()
+    metrics.configure()
     
     # 頁面標題
     st.markdown('<h1 class="main-title">📦 調貨建議生成系統</h1>', unsafe_allow_html=True)
@@ -928,9 +2796,14 @@ def main():
         
         # 轉貨模式選擇
         st.subheader("🎯 轉貨策略選擇")
+        # 載入其他模式的任務結果時同步切換模式選擇
+        if 'requested_mode' in st.session_state:
+            st.session_state.transfer_mode_choice = MODE_LABELS[st.session_state.pop('requested_mode')]
+        
         mode = st.radio(
             "選擇轉貨模式：",
-            ["A: 保守轉貨", "B: 加強轉貨", "C: 重點補0"],
+            list(MODE_LABELS.values()),
+            key="transfer_mode_choice",
             help="A模式：RF類型20%限制；B模式：RF類型50%限制，基於MOQ+1件；C模式：重點補充極低庫存（≤1件）至安全水位"
         )
         
@@ -940,6 +2813,22 @@ def main():
             transfer_mode = "B"
         else:
             transfer_mode = "C"
+        
+        st.markdown("---")
+        
+        # 重複行合併
+        consolidate = st.checkbox(
+            "合併重複 (Article, Site) 行",
+            value=True,
+            help="同一店舖同一產品分多行（如子位置）時合併為一行：庫存及銷量加總，安全庫存及MOQ取最大值"
+        )
+        
+        # 圖表顯示方式
+        interactive_chart = st.checkbox(
+            "互動圖表 (plotly)",
+            value=False,
+            help="由瀏覽器渲染互動圖表，避免伺服器端生成圖片"
+        )
     
     # 主內容區域
     
@@ -953,9 +2842,17 @@ def main():
     )
     
     if uploaded_file is not None:
-        with st.spinner("正在載入資料..."):
-            success, message = system.load_and_preprocess_data(uploaded_file)
-            
+        # 只在上傳文件內容變更時重新載入，避免每次重新執行腳本都重新解析（同名同大小的不同文件按內容區分）
+        content = _read_upload_bytes(uploaded_file)
+        upload_key = dataset_cache_key(content, consolidate)
+        if st.session_state.get('upload_key') != upload_key:
+            with st.spinner("正在載入資料..."):
+                success, message = system.load_and_preprocess_data(content, consolidate_duplicates=consolidate)
+            st.session_state.upload_key = upload_key if success else None
+            st.session_state.load_result = (success, message)
+        
+        success, message = st.session_state.load_result
+        
         if success:
             st.success(message)
             
@@ -972,54 +2869,37 @@ def main():
             with col4:
                 st.metric("OM數量", system.df['OM'].nunique())
             
-            # 預計統計資訊
-            if hasattr(system, 'preliminary_stats') and system.preliminary_stats:
-                st.subheader("📊 預計統計資訊")
-                
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    st.markdown("**A模式 (保守轉貨):**")
-                    conservative = system.preliminary_stats['conservative']
-                    subcol1, subcol2, subcol3 = st.columns(3)
-                    with subcol1:
-                        st.metric("預計轉出", conservative['estimated_transfer'])
-                    with subcol2:
-                        st.metric("預計接收", conservative['estimated_receive'])
-                    with subcol3:
-                        st.metric("預計需求", conservative['estimated_demand'])
-                
-                with col2:
-                    st.markdown("**B模式 (加強轉貨):**")
-                    enhanced = system.preliminary_stats['enhanced']
-                    subcol1, subcol2, subcol3 = st.columns(3)
-                    with subcol1:
-                        st.metric("預計轉出", enhanced['estimated_transfer'])
-                    with subcol2:
-                        st.metric("預計接收", enhanced['estimated_receive'])
-                    with subcol3:
-                        st.metric("預計需求", enhanced['estimated_demand'])
-                
-                with col3:
-                    st.markdown("**C模式 (重點補0):**")
-                    critical = system.preliminary_stats['critical_restock']
-                    subcol1, subcol2, subcol3 = st.columns(3)
-                    with subcol1:
-                        st.metric("預計轉出", critical['estimated_transfer'])
-                    with subcol2:
-                        st.metric("預計接收", critical['estimated_receive'])
-                    with subcol3:
-                        st.metric("預計需求", critical['estimated_demand'])
+            display_validation_report(system)
+            
+            consolidation = system.consolidation_report
+            if consolidation and consolidation['collapsed_rows']:
+                st.info(f"🔗 已合併 {consolidation['duplicate_groups']} 組重複 (Article, Site) 記錄，"
+                        f"減少 {consolidation['collapsed_rows']} 行（{consolidation['rows_before']} → "
+                        f"{consolidation['rows_after']}）")
+            
+            # 預處理修正摘要（按位元遮罩向量化統計）
+            quality = system.get_quality_summary()
+            if not quality.empty:
+                flagged_rows = int(np.count_nonzero(system.df[QUALITY_FLAGS_COLUMN].to_numpy()))
+                with st.expander(f"🧹 預處理已修正 {flagged_rows} 行數據", expanded=False):
+                    st.dataframe(quality, use_container_width=True, hide_index=True)
+            
+            # 預計統計資訊 - 背景計算，完成前先顯示數據預覽
+            system.start_preliminary_statistics()
+            if not system.preliminary_stats_ready() and hasattr(st, 'fragment'):
+                st.session_state.preliminary_inline_run = True
+                st.fragment(_poll_preliminary_statistics, run_every=1)(system)
+            else:
+                display_preliminary_statistics(system)
             
             # 顯示資料樣本
             with st.expander("查看資料樣本", expanded=False):
-                # 創建用於顯示的數據副本，確保清理所有異常字符
-                display_df = system.df.head(10).copy()
+                # 創建用於顯示的數據副本，確保清理所有異常字符（備註只為顯示的行生成）
+                display_df = system.with_quality_notes(system.df.head(10))
                 
                 # 更严格地清理所有字符串列的顯示內容
                 for col in display_df.columns:
-                    if display_df[col].dtype == 'object':
-                        import re
+                    if pd.api.types.is_object_dtype(display_df[col]) or pd.api.types.is_string_dtype(display_df[col]):
                         display_df[col] = display_df[col].astype(str).apply(
                             lambda x: 'HIDDEN_DATA' if re.search(r'key.*v_right|[\u0000-\u001f\u007f-\u009f]', str(x))
                             else re.sub(r'[^\w\s\u4e00-\u9fff\-_()./]', '', str(x)).strip()
@@ -1040,79 +2920,64 @@ def main():
                 
                 st.dataframe(display_df, use_container_width=True)
             
+            # 轉出限制參數掃描
+            display_parameter_sweep(system)
+            
             # 3. 分析按鈕區塊
             st.markdown('<div class="section-header"><h2>🔍 調貨分析</h2></div>', unsafe_allow_html=True)
             
-            if st.button("🚀 生成調貨建議", type="primary", use_container_width=True):
-                with st.spinner(f"正在分析調貨建議 ({mode})..."):
-                    success, message = system.generate_recommendations(transfer_mode)
-                
-                if success:
-                    st.success(message)
-                    
-                    # 4. 結果展示區塊
-                    if system.transfer_suggestions:
-                        st.markdown('<div class="section-header"><h2>📊 分析結果</h2></div>', unsafe_allow_html=True)
-                        
-                        # KPI指標卡
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            st.metric("總建議數", system.statistics['total_suggestions'])
-                        with col2:
-                            st.metric("總調貨件數", system.statistics['total_qty'])
-                        with col3:
-                            st.metric("涉及產品", system.statistics['total_articles'])
-                        with col4:
-                            st.metric("涉及OM", system.statistics['total_oms'])
-                        
-                        # 調貨建議表格
-                        st.subheader("📋 調貨建議明細")
-                        df_display = pd.DataFrame(system.transfer_suggestions)
-                        st.dataframe(df_display, use_container_width=True)
-                        
-                        # 統計分析表格
-                        st.subheader("📈 統計分析")
-                        
-                        tab1, tab2, tab3, tab4 = st.tabs(["按產品統計", "按OM統計", "轉出類型分佈", "接收類型分佈"])
-                        
-                        with tab1:
-                            st.dataframe(system.statistics['article_stats'], use_container_width=True)
-                        
-                        with tab2:
-                            st.dataframe(system.statistics['om_stats'], use_container_width=True)
-                        
-                        with tab3:
-                            st.dataframe(system.statistics['transfer_type_stats'], use_container_width=True)
-                        
-                        with tab4:
-                            st.dataframe(system.statistics['receive_type_stats'], use_container_width=True)
-                        
-                        # 視覺化圖表
-                        st.subheader("📊 視覺化分析")
-                        fig = system.create_visualization()
-                        if fig:
-                            st.pyplot(fig)
-                        
-                        # 5. 匯出區塊
-                        st.markdown('<div class="section-header"><h2>💾 匯出結果</h2></div>', unsafe_allow_html=True)
-                        
-                        excel_data, filename = system.export_to_excel()
-                        if excel_data:
-                            st.download_button(
-                                label="📥 下載Excel報告",
-                                data=excel_data,
-                                file_name=filename,
-                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                                use_container_width=True
-                            )
-                        else:
-                            st.error("匯出失敗")
-                
+            # 預計執行成本
+            display_run_cost(system, transfer_mode)
+            
+            # 以背景任務執行，分析期間頁面保持可操作，重新連線後仍可取回結果
+            if 'pending_jobs' not in st.session_state:
+                st.session_state.pending_jobs = []
+            
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                if st.button("🚀 生成調貨建議", type="primary", use_container_width=True):
+                    job_id = system.submit_recommendation_job(transfer_mode, label=mode)
+                    st.session_state.pending_jobs.append(job_id)
+            with col2:
+                if st.button("📚 比較全部模式", use_container_width=True,
+                             help="一次生成A/B/C三種模式的建議，共用候選識別並並排比較"):
+                    st.session_state.pending_jobs.append(system.submit_comparison_job())
+            
+            # 自動取回本會話提交且已結束的任務
+            for job_id in list(st.session_state.pending_jobs):
+                job = _JOB_RUNNER.get(job_id)
+                if job is None or job['status'] in (JOB_DONE, JOB_FAILED):
+                    st.session_state.pending_jobs.remove(job_id)
+                if job is None:
+                    st.warning("背景任務結果已過期（任務存儲已滿），請重新生成")
+                elif job['status'] == JOB_DONE:
+                    success, message = system.adopt_job_result(job_id)
+                    if success:
+                        st.success(f"{job['label']}: {message}")
+                elif job['status'] == JOB_FAILED:
+                    st.error(f"{job['label']}: {job['error'].splitlines()[0]}")
+            
+            # 任務進度面板 - 有進行中的任務時定時刷新
+            if system.list_recommendation_jobs():
+                if _JOB_RUNNER.has_active_jobs(dataset_key=system.dataset_key) and hasattr(st, 'fragment'):
+                    st.fragment(display_job_panel, run_every=2)(system)
                 else:
-                    st.error(message)
+                    display_job_panel(system)
+            
+            # 全部模式比較摘要
+            if system.comparison is not None:
+                display_comparison(system)
+            
+            # 切換模式時顯示該模式已保存的結果集
+            system.activate_result_set(transfer_mode)
+            
+            # 4. 結果展示區塊（結果保存在會話中，重新執行腳本時仍然顯示）
+            if system.transfer_suggestions:
+                display_results(system, interactive_chart)
         
         else:
             st.error(message)
+            display_validation_report(system, expanded=True)
     
     else:
         st.info("👆 請上傳Excel文件開始分析")
@@ -1135,6 +3000,10 @@ def main():
             
             **文件格式：** Excel (.xlsx, .xls)
             """)
+    
+    # 側邊欄記憶體使用（在所有階段完成後顯示最新數值）
+    with st.sidebar:
+        display_memory_usage(system)
 
 if __name__ == "__main__":
     main()
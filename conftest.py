@@ -0,0 +1,12 @@
+"""
+pytest 共用設定：測試使用臨時的數據集磁碟快取目錄
+須在匯入 app 前設定 TRANSFER_CACHE_DIR，避免測試讀寫使用者的 ~/.cache/winmax_reallocation
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+_CACHE_DIR = tempfile.mkdtemp(prefix="winmax-test-cache-")
+os.environ["TRANSFER_CACHE_DIR"] = _CACHE_DIR
+atexit.register(shutil.rmtree, _CACHE_DIR, ignore_errors=True)
@@ -0,0 +1,200 @@
+"""
+預處理數據集磁碟快取
+把預處理後的數據框、特徵數據框及預先統計以 Arrow IPC（未壓縮）文件保存在本地目錄，
+按文件內容雜湊及引擎版本定址；載入時以記憶體映射讀取，數值欄位不需複製。
+伺服器重新啟動或新會話載入相同文件時可跳過Excel解析及預處理。
+
+目錄結構:
+    <快取目錄>/<內容雜湊>-<引擎版本>/dataset.arrow   預處理數據框（存在即表示項目有效）
+                                    /features.arrow  特徵數據框（可選）
+                                    /stats.json      預先統計（可選）
+                                    /meta.json       數據集附加資料（可選，如欄位類型轉換報告）
+
+總容量超出上限時按最近使用時間淘汰；未安裝 pyarrow 時快取停用。
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # 可選依賴
+    pa = None
+    pa_ipc = None
+
+logger = logging.getLogger("transfer_recommendation")
+
+DATASET_FILE = "dataset.arrow"
+FEATURES_FILE = "features.arrow"
+STATS_FILE = "stats.json"
+METADATA_FILE = "meta.json"
+
+class DatasetStore:
+    """按內容雜湊及引擎版本定址的 Arrow 數據集磁碟快取"""
+
+    def __init__(self, directory, engine_version, max_bytes=2 * 1024 * 1024 * 1024):
+        self.directory = directory
+        self.engine_version = engine_version
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        """已設定快取目錄且已安裝 pyarrow"""
+        return bool(self.directory) and pa is not None
+
+    def _entry_path(self, content_hash):
+        return os.path.join(self.directory, f"{content_hash}-{self.engine_version}")
+
+    def load(self, content_hash):
+        """
+        讀取快取項目，返回 {'df', 'features', 'preliminary_stats', 'metadata'}；沒有或讀取失敗時返回None
+        返回的數據框以記憶體映射為底層，數值欄位唯讀
+        """
+        if not self.enabled:
+            return None
+        path = self._entry_path(content_hash)
+        dataset_path = os.path.join(path, DATASET_FILE)
+        if not os.path.exists(dataset_path):
+            return None
+
+        try:
+            entry = {
+                'df': _read_frame(dataset_path),
+                'features': None,
+                'preliminary_stats': None,
+                'metadata': {}
+            }
+            features_path = os.path.join(path, FEATURES_FILE)
+            if os.path.exists(features_path):
+                entry['features'] = _read_frame(features_path)
+            stats_path = os.path.join(path, STATS_FILE)
+            if os.path.exists(stats_path):
+                with open(stats_path, encoding="utf-8") as f:
+                    entry['preliminary_stats'] = json.load(f)
+            metadata_path = os.path.join(path, METADATA_FILE)
+            if os.path.exists(metadata_path):
+                with open(metadata_path, encoding="utf-8") as f:
+                    entry['metadata'] = json.load(f)
+            os.utime(path)  # 更新最近使用時間
+        except (OSError, ValueError, pa.ArrowException) as e:
+            logger.warning("磁碟快取項目 %s 讀取失敗，將重新預處理: %s", content_hash[:12], e)
+            self.discard(content_hash)
+            return None
+        return entry
+
+    def save(self, content_hash, df, features=None, preliminary_stats=None, metadata=None):
+        """寫入快取項目（數據框必須提供），返回是否成功"""
+        if not self.enabled:
+            return False
+        path = self._entry_path(content_hash)
+        try:
+            os.makedirs(path, exist_ok=True)
+            if metadata is not None:
+                _write_bytes(os.path.join(path, METADATA_FILE), _json_bytes(metadata))
+            _write_frame(os.path.join(path, DATASET_FILE), df)
+        except (OSError, ValueError, TypeError, pa.ArrowException) as e:
+            logger.warning("磁碟快取項目 %s 寫入失敗: %s", content_hash[:12], e)
+            return False
+        self.update(content_hash, features=features, preliminary_stats=preliminary_stats)
+        self.evict(keep=content_hash)
+        return True
+
+    def update(self, content_hash, features=None, preliminary_stats=None):
+        """為已存在的快取項目補充特徵數據框及預先統計，返回是否成功"""
+        if not self.enabled:
+            return False
+        path = self._entry_path(content_hash)
+        if not os.path.exists(os.path.join(path, DATASET_FILE)):
+            return False
+        try:
+            if features is not None and not os.path.exists(os.path.join(path, FEATURES_FILE)):
+                _write_frame(os.path.join(path, FEATURES_FILE), features)
+            if preliminary_stats is not None:
+                _write_bytes(os.path.join(path, STATS_FILE), _json_bytes(preliminary_stats))
+        except (OSError, ValueError, TypeError, pa.ArrowException) as e:
+            logger.warning("磁碟快取項目 %s 更新失敗: %s", content_hash[:12], e)
+            return False
+        return True
+
+    def discard(self, content_hash):
+        """刪除快取項目"""
+        if self.enabled:
+            shutil.rmtree(self._entry_path(content_hash), ignore_errors=True)
+
+    def entries(self):
+        """返回所有快取項目 [(路徑, bytes, 最近使用時間)]，按最近使用時間由舊至新排列"""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        result = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                nbytes = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                result.append((path, nbytes, os.stat(path).st_mtime))
+            except OSError:
+                continue
+        return sorted(result, key=lambda item: item[2])
+
+    def usage(self):
+        """返回磁碟快取的 (項目數, 總bytes)"""
+        entries = self.entries()
+        return len(entries), sum(nbytes for _, nbytes, _ in entries)
+
+    def evict(self, keep=None):
+        """總容量超出上限時按最近使用時間淘汰舊項目（包括舊引擎版本的項目），keep 項目不淘汰"""
+        keep_path = self._entry_path(keep) if keep else None
+        with self._lock:
+            entries = self.entries()
+            total = sum(nbytes for _, nbytes, _ in entries)
+            for path, nbytes, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep_path:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                if not os.path.exists(path):
+                    total -= nbytes
+
+def _write_atomic(path, write):
+    """先以 write(臨時路徑) 寫入臨時文件再改名，讀取方不會看到寫入一半的文件"""
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def _write_bytes(path, payload):
+    """以臨時文件改名方式寫入bytes"""
+    def write(temp_path):
+        with open(temp_path, "wb") as f:
+            f.write(payload)
+    _write_atomic(path, write)
+
+def _json_bytes(value):
+    """JSON編碼（numpy整數按int處理）"""
+    return json.dumps(value, ensure_ascii=False, default=int).encode("utf-8")
+
+def _write_frame(path, frame):
+    """以未壓縮 Arrow IPC 文件格式保存數據框（保留 pandas 欄位類型及索引）"""
+    table = pa.Table.from_pandas(frame)
+
+    def write(temp_path):
+        with pa.OSFile(temp_path, "wb") as sink, pa_ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    _write_atomic(path, write)
+
+def _read_frame(path):
+    """以記憶體映射讀取 Arrow IPC 文件為數據框"""
+    source = pa.memory_map(path, "r")
+    table = pa_ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True)
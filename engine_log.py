@@ -0,0 +1,150 @@
+"""
+引擎日誌
+調貨引擎各模組使用 "transfer_recommendation" 之下的日誌記錄器，不直接寫入標準輸出：
+
+- configure_logging: 設定等級及輸出格式（文字，或每行一個JSON物件），
+  可由環境變數 TRANSFER_LOG_LEVEL（如 DEBUG、WARNING）及 TRANSFER_LOG_FORMAT=json 指定
+- RateLimitFilter: 同一記錄器的同一訊息模板在時間窗內只輸出前若干條，略過的條數附在下一條輸出的記錄上
+- EngineCounters: 熱循環只累加計數，執行結束時輸出一條彙總記錄
+
+結構化欄位以 extra={'fields': {...}} 傳入，文字格式附加為 key=value，JSON格式合併為物件欄位。
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+LOGGER_NAME = "transfer_recommendation"
+
+# 速率限制：每個訊息模板在 RATE_LIMIT_INTERVAL 秒內最多輸出 RATE_LIMIT_BURST 條
+RATE_LIMIT_BURST = 20
+RATE_LIMIT_INTERVAL = 60.0
+
+LOG_FORMAT_TEXT = "text"
+LOG_FORMAT_JSON = "json"
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+def get_logger(name=None):
+    """返回引擎日誌記錄器或其子記錄器（如 get_logger("improved_tc")）"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME)
+
+def _record_fields(record):
+    fields = dict(getattr(record, 'fields', None) or {})
+    suppressed = getattr(record, 'suppressed', 0)
+    if suppressed:
+        fields['suppressed'] = suppressed
+    return fields
+
+class TextFormatter(logging.Formatter):
+    """文字格式，結構化欄位附加為 key=value"""
+
+    def format(self, record):
+        text = super().format(record)
+        fields = _record_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+class JsonFormatter(logging.Formatter):
+    """每條記錄輸出一行JSON物件：time, level, logger, message 及結構化欄位"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        entry.update(_record_fields(record))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """
+    按 (記錄器, 訊息模板) 限制輸出速率
+    時間窗內超出 burst 條的記錄被略過，下一個時間窗輸出的第一條記錄帶有 suppressed（略過條數）
+    """
+
+    def __init__(self, burst=RATE_LIMIT_BURST, interval=RATE_LIMIT_INTERVAL, clock=time.monotonic):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        self._windows = {}  # 鍵 -> [時間窗開始, 已輸出條數, 略過條數]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = self.clock()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+class EngineCounters:
+    """累計引擎計數及各階段耗時，執行結束時以一條日誌記錄彙總"""
+
+    def __init__(self):
+        self.counts = {}
+        self.timings = {}
+
+    def add(self, name, value=1):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage] = self.timings.get(stage, 0.0) + time.perf_counter() - start
+
+    def fields(self):
+        fields = dict(self.counts)
+        fields.update({f"{stage}_ms": round(seconds * 1000, 1) for stage, seconds in self.timings.items()})
+        return fields
+
+    def log_summary(self, logger, message, *args, level=logging.INFO):
+        if logger.isEnabledFor(level):
+            logger.log(level, message, *args, extra={'fields': self.fields()})
+
+def configure_logging(level=None, log_format=None, stream=None):
+    """
+    設定引擎日誌的等級及輸出格式（重複呼叫時只在設定改變時替換處理器）
+    level/log_format 未指定時讀取環境變數 TRANSFER_LOG_LEVEL（預設 INFO）及 TRANSFER_LOG_FORMAT（預設 text）
+    返回引擎日誌記錄器
+    """
+    level = (level or os.environ.get("TRANSFER_LOG_LEVEL") or "INFO")
+    level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    log_format = (log_format or os.environ.get("TRANSFER_LOG_FORMAT") or LOG_FORMAT_TEXT).lower()
+    stream = stream or sys.stderr
+
+    logger = get_logger()
+    logger.setLevel(level)
+    config = (log_format, id(stream))
+    installed = [handler for handler in logger.handlers if hasattr(handler, 'engine_log_config')]
+    if installed and installed[0].engine_log_config == config:
+        return logger
+    for handler in installed:
+        logger.removeHandler(handler)
+
+    handler = logging.StreamHandler(stream)
+    handler.engine_log_config = config
+    handler.setFormatter(JsonFormatter() if log_format == LOG_FORMAT_JSON else TextFormatter(TEXT_FORMAT))
+    handler.addFilter(RateLimitFilter())
+    logger.addHandler(handler)
+    return logger
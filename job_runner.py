@@ -0,0 +1,123 @@
+"""
+背景任務執行器
+在伺服器進程內以執行緒池執行長時間的調貨分析，任務記錄保存在進程級任務存儲中，
+瀏覽器重新連線或頁面重新執行後仍可查詢進度並取回結果。
+"""
+
+import itertools
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+JOB_STATUS_LABELS = {
+    JOB_QUEUED: "排隊中",
+    JOB_RUNNING: "執行中",
+    JOB_DONE: "已完成",
+    JOB_FAILED: "失敗"
+}
+
+class JobRunner:
+    """執行緒池任務執行器及本地任務存儲"""
+
+    def __init__(self, max_workers=2, max_finished_jobs=50, max_result_bytes=None, result_bytes=None):
+        """
+        max_finished_jobs / max_result_bytes: 已結束任務的保留數量及結果總大小上限，超出時淘汰最早結束的任務
+        （最近結束的任務總是保留）；result_bytes(result) 返回結果佔用的bytes，未提供時不按大小淘汰
+        """
+        self.max_finished_jobs = max_finished_jobs
+        self.max_result_bytes = max_result_bytes
+        self.result_bytes = result_bytes
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transfer-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def submit(self, func, label, tags=None):
+        """
+        提交任務並返回任務編號
+        func(report_progress) 在背景執行，report_progress(stage, done, total) 用於回報進度
+        """
+        job_id = f"job-{next(self._ids)}"
+        job = {
+            'id': job_id,
+            'label': label,
+            'tags': dict(tags or {}),
+            'status': JOB_QUEUED,
+            'stage': "",
+            'done': 0,
+            'total': 0,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'result_bytes': 0,
+            'error': None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._prune_finished()
+
+        self._executor.submit(self._run, job_id, func)
+        return job_id
+
+    def _run(self, job_id, func):
+        """在工作執行緒中執行任務"""
+        self._update(job_id, status=JOB_RUNNING, started_at=time.time())
+
+        def report_progress(stage, done=0, total=0):
+            self._update(job_id, stage=stage, done=done, total=total)
+
+        try:
+            result = func(report_progress)
+            nbytes = self.result_bytes(result) if self.result_bytes is not None else 0
+            self._update(job_id, status=JOB_DONE, result=result, result_bytes=nbytes, finished_at=time.time())
+        except Exception as e:
+            self._update(job_id, status=JOB_FAILED, error=f"{e}\n{traceback.format_exc()}",
+                         finished_at=time.time())
+        with self._lock:
+            self._prune_finished()
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _prune_finished(self):
+        """只保留最近的已結束任務，數量及結果總大小不超出上限（呼叫方持有鎖）"""
+        finished = [job for job in self._jobs.values() if job['status'] in (JOB_DONE, JOB_FAILED)]
+        finished.sort(key=lambda job: job['finished_at'])
+        total_bytes = sum(job['result_bytes'] for job in finished)
+        while len(finished) > 1 and (
+                len(finished) > self.max_finished_jobs or
+                (self.max_result_bytes is not None and total_bytes > self.max_result_bytes)):
+            job = finished.pop(0)
+            total_bytes -= job['result_bytes']
+            del self._jobs[job['id']]
+
+    def get(self, job_id):
+        """返回任務記錄的快照；任務不存在時返回None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list_jobs(self, **tags):
+        """按標籤篩選任務，按提交時間由新到舊排序"""
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values()
+                    if all(job['tags'].get(key) == value for key, value in tags.items())]
+        jobs.sort(key=lambda job: job['created_at'], reverse=True)
+        return jobs
+
+    def has_active_jobs(self, **tags):
+        """是否有排隊中或執行中的任務"""
+        return any(job['status'] in (JOB_QUEUED, JOB_RUNNING) for job in self.list_jobs(**tags))
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,235 @@
+"""
+記憶體分析模式
+在 load_and_preprocess_data → generate_recommendations → export_to_excel 的各階段邊界記錄
+tracemalloc 快照及進程RSS，報告各階段的峰值、淨增加及主要分配位置，用於找出容器記憶體峰值來自哪個階段。
+
+啟用方式（預設停用，tracemalloc 追蹤令引擎慢約5倍）：
+- 環境變數 TRANSFER_MEMORY_PROFILE=1：新建的 TransferRecommendationSystem 附帶分析器，
+  側邊欄「記憶體使用」顯示分析報告
+- 命令行: python memory_profile.py 數據文件.xlsx [模式]
+
+階段可以嵌套（如 load 之下的 load.read_excel），外層階段的峰值包含內層階段的峰值。
+MemoryProfiler(trace=False) 只記錄各階段時間及RSS，不啟用 tracemalloc（性能測試計時用）。
+tracemalloc 的峰值是進程範圍的，追蹤記憶體的頂層階段在進程內逐個執行（其他執行緒的分析階段等待），
+峰值不會歸入錯誤的執行；未經分析的執行緒的分配仍會計入，適合單一使用者診斷。
+背景任務各自使用帶標籤（如模式）的分析器，完成後以 merge 併入會話的報告。
+同一標籤的同名頂層階段（如重複生成建議或匯出）只保留最近一次，報告不會隨重複執行無限增長。
+"""
+
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import pandas as pd
+
+ENV_FLAG = "TRANSFER_MEMORY_PROFILE"
+
+# 每個階段報告的分配位置數及 tracemalloc 保存的堆疊深度
+TOP_SITES = 5
+TRACE_FRAMES = 1
+
+# 不列入主要分配位置的文件（分析器本身及模組載入）；在彙總後排除，逐筆過濾快照在大數據下太慢
+_EXCLUDED_FILES = frozenset([
+    tracemalloc.__file__, linecache.__file__, __file__,
+    "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>"
+])
+
+# 追蹤記憶體的頂層階段逐個執行：tracemalloc.reset_peak 影響整個進程，並行的分析階段會互相改寫峰值
+_TRACE_LOCK = threading.RLock()
+
+def enabled():
+    """是否以環境變數啟用記憶體分析"""
+    return os.environ.get(ENV_FLAG, "").strip().lower() in ("1", "true", "yes", "on")
+
+def current_rss():
+    """返回進程目前的RSS（bytes）；無法讀取 /proc 時以峰值RSS代替，都不可用時返回 None"""
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+def peak_rss():
+    """返回進程的峰值RSS（bytes），不支援時返回 None"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _allocation_sites(before, after, limit):
+    """比較兩個快照，返回淨增加最多的分配位置 [(位置, bytes, 次數)]"""
+    sites = []
+    for stat in after.compare_to(before, 'lineno'):
+        if stat.size_diff <= 0 or len(sites) >= limit:
+            break
+        frame = stat.traceback[0]
+        if frame.filename not in _EXCLUDED_FILES:
+            sites.append((f"{os.path.basename(frame.filename)}:{frame.lineno}", stat.size_diff, stat.count_diff))
+    return sites
+
+class MemoryProfiler:
+    """按階段記錄時間、tracemalloc 峰值、淨增加、RSS 及主要分配位置"""
+
+    def __init__(self, top_sites=TOP_SITES, frames=TRACE_FRAMES, trace=True, label=None):
+        self.top_sites = top_sites
+        self.frames = frames
+        self.trace = trace  # False: 只記錄時間及RSS
+        self.label = label  # 報告 Run 欄位（如背景任務的模式）
+        self.stages = []  # 已完成階段的記錄（按完成順序，內層先於外層；同一標籤的同名頂層階段只保留最近一次）
+        self._stack = []  # 進行中的階段（只由執行分析的執行緒使用）
+        self._sequence = 0  # 階段開始序號
+        self._lock = threading.Lock()  # 保護 stages 及 _sequence（merge 可能來自其他執行緒）
+        self._started_tracing = False
+
+    def start(self):
+        """開始追蹤（已由其他程式追蹤時沿用）"""
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracing = True
+
+    def stop(self):
+        """停止由本分析器開始的追蹤"""
+        if self._started_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._started_tracing = False
+
+    def reset(self):
+        """清除已記錄的階段"""
+        with self._lock:
+            self.stages = []
+            self._sequence = 0
+
+    def merge(self, other):
+        """併入另一分析器（如背景任務）的已完成階段，排在本分析器已有的階段之後"""
+        with self._lock:
+            offset = self._sequence
+            self._sequence += other._sequence
+            self._add([dict(record, Order=record['Order'] + offset, Root=record['Root'] + offset)
+                       for record in other.stages])
+
+    def _add(self, records):
+        """加入已完成的階段；新的頂層階段取代同一標籤同名頂層階段的舊記錄（連同其內層階段），須持有 _lock"""
+        replaced = {(record['Run'], record['Stage']) for record in records if record['Depth'] == 0}
+        stale = {record['Order'] for record in self.stages
+                 if record['Depth'] == 0 and (record['Run'], record['Stage']) in replaced}
+        if stale:
+            self.stages = [record for record in self.stages if record['Root'] not in stale]
+        self.stages.extend(records)
+
+    def _next_order(self):
+        with self._lock:
+            self._sequence += 1
+            return self._sequence
+
+    @contextmanager
+    def stage(self, name):
+        """記錄一個階段；嵌套時內層階段的峰值併入外層（不含分析器快照本身佔用的記憶體）"""
+        order = self._next_order()
+        frame = {'order': order, 'root': self._stack[0]['order'] if self._stack else order}
+        record = {'Order': order, 'Root': frame['root'], 'Run': self.label, 'Stage': name,
+                  'Depth': len(self._stack), 'Peak_Bytes': None, 'Net_Bytes': None, 'Top_Sites': []}
+        exclusive = self.trace and not self._stack
+        if exclusive:
+            _TRACE_LOCK.acquire()
+        record['RSS_Before'] = current_rss()
+        if self.trace:
+            self.start()
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], peak)
+            snapshot = tracemalloc.take_snapshot()
+            before = tracemalloc.get_traced_memory()[0]
+            frame.update(peak=before, overhead=before - current)
+            tracemalloc.reset_peak()
+        self._stack.append(frame)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['Seconds'] = time.perf_counter() - started
+            self._stack.pop()
+            if self.trace:
+                current, peak = tracemalloc.get_traced_memory()
+                frame['peak'] = max(frame['peak'], peak)
+                if self._stack:
+                    self._stack[-1]['peak'] = max(self._stack[-1]['peak'], frame['peak'] - frame['overhead'])
+                record.update(Peak_Bytes=frame['peak'] - before, Net_Bytes=current - before,
+                              Top_Sites=_allocation_sites(snapshot, tracemalloc.take_snapshot(), self.top_sites))
+                del snapshot
+                tracemalloc.reset_peak()  # 外層的峰值已記錄於 frame，結束快照不計入
+            record['RSS_After'] = current_rss()
+            with self._lock:
+                self._add([record])
+            if exclusive:
+                _TRACE_LOCK.release()
+
+    def report(self):
+        """
+        返回各階段報告數據框（按開始順序，外層階段在其內層階段之前）
+        欄位：Run（分析器標籤，如背景任務的模式）, Stage, Depth, Seconds, Peak_Bytes（相對階段開始時的tracemalloc峰值）, Net_Bytes（階段結束時仍保留）,
+        RSS_Before, RSS_After, Top_Sites（淨增加最多的 [(文件:行, bytes, 次數)]）；trace=False 時沒有記憶體欄位的值
+        """
+        columns = ['Run', 'Stage', 'Depth', 'Seconds', 'Peak_Bytes', 'Net_Bytes', 'RSS_Before', 'RSS_After', 'Top_Sites']
+        with self._lock:
+            stages = sorted(self.stages, key=lambda stage: stage['Order'])
+        return pd.DataFrame(stages, columns=columns)
+
+    def format_report(self):
+        """以文字輸出報告（命令行及日誌用）"""
+        mb = 1024 * 1024
+        lines = []
+        for stage in self.report().to_dict('records'):
+            indent = "  " * stage['Depth']
+            name = f"{stage['Stage']} [{stage['Run']}]" if stage['Run'] else stage['Stage']
+            line = f"{indent}{name:<{28 - len(indent)}} {stage['Seconds']:8.2f} 秒"
+            if stage['Peak_Bytes'] is not None:
+                line += f"  峰值 {stage['Peak_Bytes'] / mb:8.1f} MB  淨增加 {stage['Net_Bytes'] / mb:8.1f} MB"
+            if stage['RSS_After'] is not None:
+                line += f"  RSS {stage['RSS_After'] / mb:8.1f} MB"
+            lines.append(line)
+            for site, size, count in stage['Top_Sites']:
+                lines.append(f"{indent}    {size / mb:8.2f} MB  {count:>8} 次  {site}")
+        return "\n".join(lines)
+
+def profile_pipeline(system, content, mode="A", trace=True):
+    """以分析器執行 載入 → 生成建議 → 匯出，返回 (分析器, 匯出bytes)"""
+    profiler = system.memory_profiler = MemoryProfiler(trace=trace)
+    profiler.start()
+    try:
+        success, message = system.load_and_preprocess_data(content)
+        if not success:
+            raise ValueError(message)
+        success, message = system.generate_recommendations(mode)
+        if not success:
+            raise ValueError(message)
+        excel_data, message = system.export_to_excel()
+        if excel_data is None:
+            raise ValueError(message)
+    finally:
+        profiler.stop()
+    return profiler, excel_data
+
+if __name__ == "__main__":
+    import tempfile
+
+    if len(sys.argv) < 2:
+        print("用法: python memory_profile.py 數據文件.xlsx [模式]")
+        sys.exit(1)
+    # 使用空的磁碟快取目錄，確保分析完整的解析及預處理階段
+    os.environ["TRANSFER_CACHE_DIR"] = tempfile.mkdtemp(prefix="memory-profile-")
+    from app import TransferRecommendationSystem
+
+    with open(sys.argv[1], 'rb') as file:
+        data = file.read()
+    profiler, _ = profile_pipeline(TransferRecommendationSystem(), data, sys.argv[2] if len(sys.argv) > 2 else "A")
+    print(profiler.format_report())
+    rss = peak_rss()
+    if rss is not None:
+        print(f"進程峰值RSS: {rss / 1024 / 1024:.1f} MB")
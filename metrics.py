@@ -0,0 +1,236 @@
+"""
+引擎指標
+進程範圍（同一進程的所有會話共用）的計數器及直方圖，以 Prometheus 文字格式（text exposition format 0.0.4）
+匯出，監控系統不需修改程式即可抓取：
+
+- 環境變數 TRANSFER_METRICS_FILE：每次記錄後原子寫入該文件（適用 node_exporter textfile collector）
+- 環境變數 TRANSFER_METRICS_PORT：在本機埠（TRANSFER_METRICS_HOST，預設 127.0.0.1）提供 HTTP /metrics
+
+記錄指標只是加鎖後更新數值；文字格式在寫入文件或收到抓取請求時才生成。
+"""
+
+import math
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import engine_log
+
+logger = engine_log.get_logger("metrics")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 預設直方圖區間（秒）
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 1200)
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 的標籤須為 {self.labelnames}，收到 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+class Counter(_Metric):
+    """只增不減的計數器"""
+    type_name = "counter"
+
+    def inc(self, value=1, **labels):
+        if value < 0:
+            raise ValueError("計數器只能增加")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_label_text(self.labelnames, key)} {_format_value(value)}"]
+
+class Histogram(_Metric):
+    """按區間上限累計觀測值的直方圖（輸出 _bucket、_sum、_count）"""
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, upper in enumerate(self.buckets):
+                if value <= upper:
+                    state['counts'][index] += 1
+                    break
+            state['sum'] += value
+            state['count'] += 1
+
+    def snapshot(self, **labels):
+        """返回 {'sum', 'count'}（沒有觀測時為0）"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return {'sum': state['sum'], 'count': state['count']} if state else {'sum': 0.0, 'count': 0}
+
+    def _render_sample(self, key, state):
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets, state['counts']):
+            cumulative += count
+            labels = _label_text(self.labelnames, key, [('le', _format_value(upper))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _label_text(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+class Registry:
+    """指標登記表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指標 {metric.name} 已登記")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """以文字格式輸出全部指標"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+ROWS_LOADED = REGISTRY.counter(
+    "transfer_rows_loaded_total", "載入的數據行數（source: parse 解析文件, memory 記憶體快取, disk 磁碟快取）",
+    ["source"])
+LOAD_SECONDS = REGISTRY.histogram("transfer_load_seconds", "載入及預處理數據的時間（秒）", ["source"])
+LOAD_FAILURES = REGISTRY.counter("transfer_load_failures_total", "載入失敗次數")
+CANDIDATES = REGISTRY.counter("transfer_candidates_total", "識別的候選數（kind: transfer 轉出, receive 接收）",
+                              ["mode", "kind"])
+CONFLICTS = REGISTRY.counter("transfer_conflicts_resolved_total", "解決的同店舖同SKU衝突數", ["mode"])
+SUGGESTIONS = REGISTRY.counter("transfer_suggestions_total", "生成的調貨建議數", ["mode"])
+MATCH_SECONDS = REGISTRY.histogram("transfer_match_seconds", "匹配調貨建議的時間（秒）", ["mode"])
+EXPORT_SECONDS = REGISTRY.histogram("transfer_export_seconds", "生成Excel報告的時間（秒），每次使用者匯出記錄一次")
+EXPORT_BYTES = REGISTRY.histogram("transfer_export_bytes", "匯出Excel文件的大小（位元組）",
+                                  buckets=(1e4, 1e5, 1e6, 1e7, 5e7, 1e8))
+
+_config = {'path': None, 'server': None}
+_config_lock = threading.Lock()
+
+def write_textfile(path, registry=REGISTRY):
+    """原子寫入指標文件（先寫入同目錄的臨時文件再替換，抓取時不會讀到寫入一半的文件）"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(registry.render())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+def serve(port, host="127.0.0.1", registry=REGISTRY):
+    """在背景執行緒提供 HTTP /metrics，返回伺服器（port 為0時由系統分配，見 server.server_address）"""
+    handler = type("MetricsHandler", (_MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+def configure(path=None, port=None, host=None):
+    """
+    設定指標匯出（每個進程只啟動一次伺服器，重複呼叫不會重複綁定埠）
+    未指定時讀取環境變數 TRANSFER_METRICS_FILE、TRANSFER_METRICS_PORT、TRANSFER_METRICS_HOST
+    """
+    path = path or os.environ.get("TRANSFER_METRICS_FILE") or None
+    port = port if port is not None else os.environ.get("TRANSFER_METRICS_PORT")
+    host = host or os.environ.get("TRANSFER_METRICS_HOST") or "127.0.0.1"
+    with _config_lock:
+        _config['path'] = path
+        if port not in (None, "") and _config['server'] is None:
+            try:
+                _config['server'] = serve(int(port), host)
+                logger.info("指標伺服器: http://%s:%d/metrics", host, _config['server'].server_address[1])
+            except OSError as e:
+                logger.warning("無法在 %s:%s 提供指標: %s", host, port, e)
+    flush()
+
+def flush():
+    """已設定指標文件時寫入最新指標；寫入失敗只記錄警告，不影響引擎"""
+    path = _config['path']
+    if not path:
+        return
+    try:
+        write_textfile(path)
+    except OSError as e:
+        logger.warning("指標文件 %s 寫入失敗: %s", path, e)
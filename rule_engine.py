@@ -0,0 +1,180 @@
+"""
+宣告式調貨規則引擎
+模式規則以門檻、上限及優先層級的設定表示，編譯為特徵數據框上的向量化遮罩與數量運算，
+新增模式只需新增設定，不需另寫逐行循環。
+
+層級設定（按優先順序排列，前面層級的條件成立時不再檢查後面的層級）:
+    'type'             候選類型
+    'priority'         優先順序
+    'when'             條件表達式
+    'qty'              數量表達式
+    'cap'              可選，轉出上限 max(int(of × pct), min)，{'pct', 'min', 'of', 'truncate'}
+    'limit'            可選，數量上限表達式（例如不超過現有庫存）
+    'require_positive' 可選，預設True，數量大於0才成為候選
+    'derive'           可選，{欄位: 表達式}，在條件及數量之前計算的輔助欄位
+    'retype'           可選，[(條件表達式, 類型)]，按數量計算後的條件改變候選類型
+    'params'           可選，表達式中以 @名稱 引用的參數
+
+表達式為 DataFrame.eval 字串（可引用特徵欄位），或數值常數，
+或 ('min', 表達式, ...) / ('max', 表達式, ...) 逐元素取最小/最大值。
+數量計算後可在 'retype' 及輸出欄位中以 Qty 引用。
+"""
+
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+_REDUCERS = {'min': np.minimum, 'max': np.maximum}
+
+def evaluate(frame, expression, params=None):
+    """在數據框上計算表達式，返回 numpy 數組"""
+    if isinstance(expression, (tuple, list)):
+        func, *operands = expression
+        return reduce(_REDUCERS[func], [evaluate(frame, operand, params) for operand in operands])
+    if not isinstance(expression, str):
+        return np.full(len(frame), expression)
+    if expression in frame.columns:
+        return frame[expression].to_numpy()
+    return np.asarray(frame.eval(expression, local_dict=dict(params or {})))
+
+def tier_params(tier, overrides=None):
+    """合併層級參數及覆蓋值"""
+    params = dict(tier.get('params') or {})
+    params.update(overrides or {})
+    return params
+
+def tier_frame(frame, tier, params):
+    """加入層級的輔助欄位"""
+    derive = tier.get('derive')
+    if not derive:
+        return frame
+    return frame.assign(**{name: evaluate(frame, expression, params) for name, expression in derive.items()})
+
+def apply_cap(frame, qty, cap):
+    """按 max(int(of × pct), min) 限制數量"""
+    base = evaluate(frame, cap.get('of', 'Total_Available')) * cap['pct']
+    if cap.get('truncate', True):
+        base = base.astype(np.int64)
+    return np.minimum(qty, np.maximum(base, cap['min']))
+
+def tier_quantity(frame, tier, params):
+    """計算層級的數量（未套用條件）"""
+    qty = evaluate(frame, tier['qty'], params)
+    if tier.get('cap'):
+        qty = apply_cap(frame, qty, tier['cap'])
+    if tier.get('limit') is not None:
+        qty = np.minimum(qty, evaluate(frame, tier['limit'], params))
+    return qty
+
+def evaluate_tiers(frame, tiers, overrides=None):
+    """
+    按優先層級計算每行的規則結果
+    返回 (層級編號, 數量, 是否候選)；層級編號-1表示沒有層級條件成立，非候選行的數量為0
+    """
+    n_rows = len(frame)
+    tier_index = np.full(n_rows, -1, dtype=np.int64)
+    qty = np.zeros(n_rows, dtype=np.int64)
+    selected = np.zeros(n_rows, dtype=bool)
+
+    for index, tier in enumerate(tiers):
+        params = tier_params(tier, overrides)
+        current = tier_frame(frame, tier, params)
+        claimed = (tier_index < 0) & evaluate(current, tier['when'], params).astype(bool)
+        if not claimed.any():
+            continue
+        tier_index[claimed] = index
+
+        tier_qty = tier_quantity(current, tier, params)
+        chosen = claimed & (tier_qty > 0) if tier.get('require_positive', True) else claimed
+        qty = np.where(chosen, tier_qty, qty)
+        selected |= chosen
+
+    return tier_index, qty, selected
+
+def _candidate_frame(frame, labels, tiers, overrides=None):
+    """
+    按層級規則計算候選行，返回按原行順序排列的數據框（含 Qty、Type、Priority、_row、層級輔助欄位及標籤欄位）；
+    沒有候選時返回None
+    """
+    tier_index, qty, selected = evaluate_tiers(frame, tiers, overrides)
+    rows = np.flatnonzero(selected)
+
+    parts = []
+    for index, tier in enumerate(tiers):
+        tier_rows = rows[tier_index[rows] == index]
+        if len(tier_rows) == 0:
+            continue
+        params = tier_params(tier, overrides)
+        part = tier_frame(frame.iloc[tier_rows], tier, params)
+        part = part.assign(Qty=qty[tier_rows], Type=tier['type'], Priority=tier['priority'], _row=tier_rows)
+        for condition, retype in tier.get('retype', ()):
+            part.loc[evaluate(part, condition, params).astype(bool), 'Type'] = retype
+        parts.append(part)
+
+    if not parts:
+        return None
+
+    candidates = pd.concat(parts).sort_values('_row', kind='stable')
+    for column in labels.columns:
+        candidates[column] = labels[column].to_numpy()[candidates['_row'].to_numpy()]
+    return candidates
+
+def _sort_order(columns, sort_by):
+    """按 sort_by 穩定排序，返回行位置"""
+    names, ascending = zip(*sort_by)
+    order = pd.DataFrame({name: columns[name] for name in names})
+    return order.sort_values(list(names), ascending=list(ascending), kind='stable').index.to_numpy()
+
+def build_candidates(frame, labels, tiers, fields, sort_by, overrides=None):
+    """
+    按層級規則生成候選記錄列表
+    labels: 與 frame 行對齊的標籤欄位（如 Article/Site/OM）
+    fields: {輸出欄位: 來源欄位或表達式}，可引用 Type、Priority、Qty 及層級輔助欄位
+    sort_by: [(欄位, 是否升序)]，排序穩定（同值保持原行順序）
+    """
+    candidates = _candidate_frame(frame, labels, tiers, overrides)
+    if candidates is None:
+        return []
+
+    output = pd.DataFrame({name: evaluate(candidates, source) for name, source in fields.items()})
+    if sort_by:
+        columns, ascending = zip(*sort_by)
+        output = output.sort_values(list(columns), ascending=list(ascending), kind='stable')
+    return output.to_dict('records')
+
+def build_candidates_for_sets(frame, labels, tier_sets, fields, sort_by, overrides=None):
+    """
+    多組層級規則（如各模式的轉出規則）共用一次掃描生成候選記錄，返回 {鍵: 候選列表}，
+    各列表與逐組呼叫 build_candidates 的結果相同
+    tier_sets: {鍵: 層級列表}
+    直接取自特徵欄位或標籤欄位的輸出欄位在各組候選行的聯集上只取值一次，
+    其餘欄位（Qty、Type、Priority、層級輔助欄位及表達式）按組計算
+    """
+    candidates_by_key = {key: _candidate_frame(frame, labels, tiers, overrides) for key, tiers in tier_sets.items()}
+    tier_columns = {'Qty', 'Type', 'Priority'}
+    for tiers in tier_sets.values():
+        for tier in tiers:
+            tier_columns.update(tier.get('derive') or {})
+    shared = {name: source for name, source in fields.items()
+              if isinstance(source, str) and source not in tier_columns
+              and (source in labels.columns or source in frame.columns)}
+
+    found = [candidates['_row'].to_numpy() for candidates in candidates_by_key.values() if candidates is not None]
+    union = np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+    shared_values = {name: (labels[source] if source in labels.columns else frame[source]).to_numpy()[union]
+                     for name, source in shared.items()}
+
+    names = list(fields)
+    result = {}
+    for key, candidates in candidates_by_key.items():
+        if candidates is None:
+            result[key] = []
+            continue
+        positions = np.searchsorted(union, candidates['_row'].to_numpy())
+        columns = {name: shared_values[name][positions] if name in shared else evaluate(candidates, source)
+                   for name, source in fields.items()}
+        order = _sort_order(columns, sort_by) if sort_by else np.arange(len(candidates))
+        values = [columns[name][order].tolist() for name in names]
+        result[key] = [dict(zip(names, row)) for row in zip(*values)]
+    return result
@@ -0,0 +1,204 @@
+"""
+調貨建議執行成本估算
+按數據形狀（各模式的候選數、(Article, OM) 組大小及逐筆匹配的掃描量）與各階段的線性成本常數，
+在生成建議前預測各引擎的執行時間及峰值記憶體，並建議最快的執行方式：
+
+- reference: 逐筆貪婪匹配（參考實現），主要成本為RF匹配逐店舖掃描同組接收候選
+- vectorized: 累計區間核心（預設）
+- comparison: 全部模式比較（generate_comparison），轉出候選共用一次掃描、A/B共用接收候選，各模式依次匹配
+
+數據形狀由 TransferRecommendationSystem.run_shape 在特徵數據框上計算，不建立候選記錄。
+成本常數可用 calibrate_stage_costs 在實際數據的不同比例子樣本上重新校準：
+
+    python run_cost.py 數據文件.xlsx
+"""
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# 工作量指標（run_shape 返回的鍵）
+SHAPE_TERMS = ['rows', 'candidates', 'pairs', 'nd_scan', 'rf_scan', 'rf_unmet_scan']
+
+# 各階段 {工作量指標: 每單位秒數}，以 calibrate_stage_costs 在約5萬行的測試數據上校準
+# 指標為先前的階段名稱時以該階段的預計秒數為工作量（累計區間核心不適用的組仍以逐筆匹配處理）
+STAGE_COSTS = {
+    'identify': {'rows': 9.7e-07, 'candidates': 1.25e-05},
+    'conflicts': {'candidates': 1.19e-06},
+    'match_reference': {'candidates': 0.0, 'pairs': 0.0, 'nd_scan': 0.0, 'rf_scan': 1.71e-08, 'rf_unmet_scan': 1.87e-07},
+    'match_vectorized': {'candidates': 0.0, 'pairs': 4.45e-06, 'match_reference': 0.713},
+    'statistics': {'pairs': 2.29e-06}
+}
+
+# 每筆候選及建議記錄佔用的記憶體（位元組）
+RECORD_BYTES = {'candidate': 722, 'suggestion': 595}
+
+# 全部模式比較時候選識別的成本相對逐個模式識別總和的比例（共用掃描及接收候選）
+SHARED_IDENTIFY_FRACTION = 0.6
+
+ENGINES = {
+    'reference': "逐筆貪婪匹配",
+    'vectorized': "累計區間核心",
+    'comparison': "全部模式比較"
+}
+
+# 單一模式及全部模式的成本表行
+SINGLE_MODE = 'single'
+ALL_MODES = 'all'
+
+def stage_seconds(stage, shape, costs=None):
+    """按工作量指標計算單一階段的預計秒數"""
+    costs = STAGE_COSTS if costs is None else costs
+    return float(sum(coefficient * (stage_seconds(term, shape, costs) if term in costs else shape[term])
+                     for term, coefficient in costs[stage].items()))
+
+def _run_seconds(shape, match_stage, costs):
+    """單一模式生成建議的預計秒數 (共用階段, 模式專屬階段)"""
+    shared = stage_seconds('identify', shape, costs)
+    specific = sum(stage_seconds(stage, shape, costs) for stage in ('conflicts', match_stage, 'statistics'))
+    return shared, specific
+
+def _peak_bytes(candidates, pairs, record_bytes):
+    return candidates * record_bytes['candidate'] + pairs * record_bytes['suggestion']
+
+def predict_run_cost(shapes, mode, costs=None, record_bytes=None, identify_fraction=None):
+    """
+    預測各引擎的執行時間及峰值記憶體（不含已載入的數據集及特徵數據框）
+    shapes: {模式: run_shape 結果}，須包含全部模式（全部模式比較用）
+    返回數據框：Engine, Scope（single: 只生成 mode；all: 全部模式）, Modes, Seconds, Peak_Bytes,
+    Recommended（各 Scope 中最快者）
+    """
+    costs = STAGE_COSTS if costs is None else costs
+    record_bytes = RECORD_BYTES if record_bytes is None else record_bytes
+    identify_fraction = SHARED_IDENTIFY_FRACTION if identify_fraction is None else identify_fraction
+    modes = list(shapes)
+    rows = []
+
+    shape = shapes[mode]
+    for engine, match_stage in (('reference', 'match_reference'), ('vectorized', 'match_vectorized')):
+        rows.append((engine, SINGLE_MODE, mode, sum(_run_seconds(shape, match_stage, costs)),
+                     _peak_bytes(shape['candidates'], shape['pairs'], record_bytes)))
+
+    # 全部模式逐個生成：結果集保留各模式建議，候選記錄逐模式釋放
+    per_mode = {m: _run_seconds(shapes[m], 'match_vectorized', costs) for m in modes}
+    rows.append(('vectorized', ALL_MODES, ", ".join(modes), sum(sum(seconds) for seconds in per_mode.values()),
+                 max(shapes[m]['candidates'] for m in modes) * record_bytes['candidate'] +
+                 sum(shapes[m]['pairs'] for m in modes) * record_bytes['suggestion']))
+
+    # 全部模式比較：候選識別共用，只需逐個模式識別的 identify_fraction；模式專屬階段依次執行；
+    # 共用候選記錄及各模式的副本同時存在
+    shared = identify_fraction * sum(seconds[0] for seconds in per_mode.values())
+    total_candidates = sum(shapes[m]['candidates'] for m in modes)
+    rows.append(('comparison', ALL_MODES, ", ".join(modes), shared + sum(seconds[1] for seconds in per_mode.values()),
+                 _peak_bytes(2 * total_candidates, sum(shapes[m]['pairs'] for m in modes), record_bytes)))
+
+    result = pd.DataFrame(rows, columns=['Engine', 'Scope', 'Modes', 'Seconds', 'Peak_Bytes'])
+    result['Peak_Bytes'] = result['Peak_Bytes'].astype(np.int64)
+    result['Recommended'] = result.index.isin(result.groupby('Scope', sort=False)['Seconds'].idxmin())
+    return result
+
+def fit_nonnegative(X, y):
+    """非負最小二乘：反覆剔除係數為負的指標後重新擬合"""
+    X, y = np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    active = np.ones(X.shape[1], dtype=bool)
+    coefficients = np.zeros(X.shape[1])
+    while active.any():
+        solution = np.linalg.lstsq(X[:, active], y, rcond=None)[0]
+        if (solution >= 0).all():
+            coefficients[active] = solution
+            break
+        active[np.flatnonzero(active)[solution < 0]] = False
+    return coefficients
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def _measure_stages(system, mode):
+    """計時單一模式的各階段 {階段: 秒數}（特徵數據框已建立）"""
+    seconds = {}
+    (transfers, receives), seconds['identify'] = _timed(
+        lambda: (system.identify_transfer_candidates(mode), system.identify_receive_candidates(mode)))
+    (transfers, receives, _), seconds['conflicts'] = _timed(
+        system.resolve_same_store_conflicts, transfers, receives)
+    for stage, use_kernel in (('match_vectorized', True), ('match_reference', False)):
+        suggestions, seconds[stage] = _timed(
+            system.match_transfer_suggestions, [dict(item) for item in transfers],
+            [dict(item) for item in receives], use_kernel)
+    _, seconds['statistics'] = _timed(system.calculate_statistics, suggestions)
+    return seconds
+
+def _measure_record_bytes(system, mode):
+    """以 tracemalloc 量度每筆候選及建議記錄的記憶體"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        transfers = system.identify_transfer_candidates(mode)
+        receives = system.identify_receive_candidates(mode)
+        candidate_bytes = tracemalloc.get_traced_memory()[0]
+        suggestions = system.match_transfer_suggestions(transfers, receives)
+        suggestion_bytes = tracemalloc.get_traced_memory()[0] - candidate_bytes
+    finally:
+        tracemalloc.stop()
+    return {
+        'candidate': int(candidate_bytes / max(len(transfers) + len(receives), 1)),
+        'suggestion': int(suggestion_bytes / max(len(suggestions), 1))
+    }
+
+def calibrate_stage_costs(system, modes=("A", "B", "C"), fractions=(0.1, 0.25, 0.5, 0.75, 1.0), seed=0):
+    """
+    在已載入數據的不同比例子樣本上計時各階段，擬合各階段的成本常數
+    返回 {'stage_costs', 'record_bytes', 'shared_identify_fraction'}，格式與本模組常數相同
+    """
+    shapes, seconds = [], {stage: [] for stage in STAGE_COSTS}
+    for fraction in fractions:
+        sub = type(system)()
+        sub.df = system.df if fraction >= 1 else system.df.sample(frac=fraction, random_state=seed)
+        sub.get_feature_frame()
+        for mode in modes:
+            shapes.append(sub.run_shape(mode))
+            for stage, value in _measure_stages(sub, mode).items():
+                seconds[stage].append(value)
+
+    # 按順序擬合，引用先前階段的指標以已擬合常數的預計秒數為工作量
+    stage_costs = {}
+    for stage, terms in STAGE_COSTS.items():
+        X = [[stage_seconds(term, shape, stage_costs) if term in stage_costs else shape[term] for term in terms]
+             for shape in shapes]
+        stage_costs[stage] = {term: float(value) for term, value in zip(terms, fit_nonnegative(X, seconds[stage]))}
+
+    # 全部模式比較的共用識別比例：以最大子樣本的實際比較時間反推
+    full = sub
+    shapes = {mode: full.run_shape(mode) for mode in modes}
+    per_mode = [_run_seconds(shapes[mode], 'match_vectorized', stage_costs) for mode in modes]
+    _, comparison_seconds = _timed(full.generate_comparison, modes)
+    identify = sum(seconds[0] for seconds in per_mode)
+    identify_fraction = 1.0
+    if identify > 0:
+        identify_fraction = (comparison_seconds - sum(seconds[1] for seconds in per_mode)) / identify
+
+    return {
+        'stage_costs': stage_costs,
+        'record_bytes': _measure_record_bytes(full, modes[0]),
+        'shared_identify_fraction': float(np.clip(identify_fraction, 0.0, 1.0))
+    }
+
+if __name__ == "__main__":
+    from app import TransferRecommendationSystem
+
+    if len(sys.argv) < 2:
+        print("用法: python run_cost.py 數據文件.xlsx")
+        sys.exit(1)
+    system = TransferRecommendationSystem()
+    with open(sys.argv[1], 'rb') as file:
+        success, message = system.load_and_preprocess_data(file.read())
+    if not success:
+        print(f"❌ {message}")
+        sys.exit(1)
+    print(json.dumps(calibrate_stage_costs(system), indent=4, ensure_ascii=False))
@@ -0,0 +1,118 @@
+"""
+測試背景任務執行及結果取回
+"""
+import io
+import time
+import pandas as pd
+from app import TransferRecommendationSystem, RECOMMENDATION_STAGES, _JOB_RUNNER
+from job_runner import JobRunner, JOB_DONE, JOB_FAILED
+
+def create_job_test_excel():
+    """創建測試Excel文件內容"""
+    df = pd.DataFrame({
+        'Article': ['J001'] * 4 + ['J002'] * 3,
+        'Article Description': ['產品1'] * 4 + ['產品2'] * 3,
+        'RP Type': ['ND', 'RF', 'RF', 'RF', 'RF', 'RF', 'RF'],
+        'Site': ['S001', 'S002', 'S003', 'S004', 'S001', 'S002', 'S003'],
+        'OM': ['OM1'] * 7,
+        'MOQ': [2] * 7,
+        'SaSa Net Stock': [10, 0, 20, 1, 30, 0, 2],
+        'Pending Received': [0] * 7,
+        'Safety Stock': [5, 6, 4, 6, 5, 8, 8],
+        'Last Month Sold Qty': [1, 9, 2, 3, 1, 10, 6],
+        'MTD Sold Qty': [0] * 7
+    })
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def wait_for_jobs(job_ids, timeout=30):
+    """等待任務結束"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        jobs = [_JOB_RUNNER.get(job_id) for job_id in job_ids]
+        if all(job['status'] in (JOB_DONE, JOB_FAILED) for job in jobs):
+            return jobs
+        time.sleep(0.05)
+    raise TimeoutError("背景任務逾時")
+
+def test_background_recommendation_jobs():
+    """測試背景任務結果與同步執行一致"""
+    print("=" * 50)
+    print("🗂️ 背景任務測試")
+    print("=" * 50)
+
+    content = create_job_test_excel()
+    system = TransferRecommendationSystem()
+    success, message = system.load_and_preprocess_data(io.BytesIO(content))
+    assert success, message
+
+    job_ids = [system.submit_recommendation_job(mode) for mode in ["A", "B", "C"]]
+    jobs = wait_for_jobs(job_ids)
+    assert all(job['status'] == JOB_DONE for job in jobs), [job['error'] for job in jobs]
+    assert {job['id'] for job in system.list_recommendation_jobs()} >= set(job_ids)
+    print(f"✅ {len(jobs)} 個任務完成")
+
+    # 新會話（例如瀏覽器重新連線後）載入相同文件即可取回結果
+    reconnected = TransferRecommendationSystem()
+    reconnected.load_and_preprocess_data(io.BytesIO(content))
+    success, message = reconnected.adopt_job_result(job_ids[1])
+    assert success, message
+    assert reconnected.mode == "B"
+
+    reference = TransferRecommendationSystem()
+    reference.df = system.df
+    reference.generate_recommendations("B")
+    assert reconnected.transfer_suggestions == reference.transfer_suggestions
+    print("✅ 重新連線後取回結果與同步執行一致")
+
+def test_job_runner_progress_and_failure():
+    """測試進度回報和失敗任務"""
+    runner = JobRunner(max_workers=1)
+
+    def work(report_progress):
+        for stage in RECOMMENDATION_STAGES:
+            report_progress(stage, 1, 2)
+        return 42
+
+    def broken(report_progress):
+        raise ValueError("壞數據")
+
+    job_id = runner.submit(work, "進度測試")
+    failed_id = runner.submit(broken, "失敗測試")
+    runner.shutdown(wait=True)
+
+    job = runner.get(job_id)
+    assert job['result'] == 42
+    assert (job['stage'], job['done'], job['total']) == (RECOMMENDATION_STAGES[-1], 1, 2)
+    failed = runner.get(failed_id)
+    assert failed['status'] == JOB_FAILED and "壞數據" in failed['error']
+    print("✅ 進度回報和失敗處理正常")
+
+def test_finished_jobs_bounded_by_bytes():
+    """測試已完成任務按結果總大小淘汰最早結束的任務，最近結束的任務即使超出上限仍保留"""
+    runner = JobRunner(max_workers=1, max_result_bytes=250, result_bytes=lambda result: result['nbytes'])
+    job_ids = [runner.submit(lambda report_progress, n=n: {'nbytes': n}, f"任務{n}") for n in (100, 100, 100)]
+    runner.shutdown(wait=True)
+    assert [runner.get(job_id) is not None for job_id in job_ids] == [False, True, True]
+
+    runner = JobRunner(max_workers=1, max_result_bytes=250, result_bytes=lambda result: result['nbytes'])
+    large_id = runner.submit(lambda report_progress: {'nbytes': 1000}, "大結果")
+    runner.shutdown(wait=True)
+    assert runner.get(large_id)['result_bytes'] == 1000
+
+    # 應用的任務結果帶有估算大小
+    system = TransferRecommendationSystem()
+    system.load_and_preprocess_data(io.BytesIO(create_job_test_excel()))
+    jobs = wait_for_jobs([system.submit_recommendation_job("A"), system.submit_comparison_job()])
+    assert all(job['status'] == JOB_DONE and job['result_bytes'] > 0 for job in jobs)
+    single, comparison = (job['result'] for job in jobs)
+    assert single['nbytes'] == system._estimate_result_bytes(single['suggestions'], single['statistics'])
+    assert comparison['nbytes'] >= single['nbytes']
+    print("✅ 已完成任務按結果大小淘汰")
+
+if __name__ == "__main__":
+    test_background_recommendation_jobs()
+    test_job_runner_progress_and_failure()
+    test_finished_jobs_bounded_by_bytes()
+    print("\n🎉 背景任務測試完成")
@@ -0,0 +1,116 @@
+"""
+測試圖表渲染快取與figure生命週期
+"""
+import matplotlib.pyplot as plt
+import pandas as pd
+from app import TransferRecommendationSystem, _CHART_CACHE
+
+def create_chart_test_data():
+    """創建圖表測試數據"""
+    return pd.DataFrame({
+        'Article': ['A001'] * 4 + ['A002'] * 3,
+        'Article Description': ['產品1'] * 4 + ['產品2'] * 3,
+        'RP Type': ['ND', 'RF', 'RF', 'RF', 'RF', 'RF', 'RF'],
+        'Site': ['S001', 'S002', 'S003', 'S004', 'S001', 'S002', 'S003'],
+        'OM': ['OM1', 'OM1', 'OM1', 'OM2', 'OM1', 'OM1', 'OM1'],
+        'MOQ': [2, 2, 2, 2, 3, 3, 3],
+        'SaSa Net Stock': [10, 0, 20, 5, 30, 0, 2],
+        'Pending Received': [0, 0, 0, 0, 0, 0, 0],
+        'Safety Stock': [5, 6, 4, 6, 5, 8, 8],
+        'Last Month Sold Qty': [1, 9, 2, 3, 1, 10, 6],
+        'MTD Sold Qty': [0, 0, 0, 0, 0, 0, 0],
+        'Notes': [''] * 7
+    })
+
+def test_chart_png_cache():
+    """測試PNG渲染結果按指紋快取，且不殘留figure"""
+    print("=" * 50)
+    print("📊 圖表快取測試")
+    print("=" * 50)
+
+    system = TransferRecommendationSystem()
+    system.df = create_chart_test_data()
+    success, message = system.generate_recommendations("A")
+    assert success, message
+    assert system.transfer_suggestions, "應產生調貨建議"
+
+    plt.close('all')
+    _CHART_CACHE.clear()
+
+    png_first = system.render_visualization_png()
+    assert png_first.startswith(b'\x89PNG')
+    assert len(plt.get_fignums()) == 0, "渲染後應關閉figure"
+    print(f"✅ 首次渲染: {len(png_first)} bytes")
+
+    # 建議未變更時直接使用快取
+    png_second = system.render_visualization_png()
+    assert png_second is png_first
+    assert len(_CHART_CACHE) == 1
+    print("✅ 重複渲染命中快取")
+
+    # 模式變更時指紋不同
+    fingerprint_a = system.suggestions_fingerprint()
+    system.generate_recommendations("B")
+    assert system.suggestions_fingerprint() != fingerprint_a
+    system.render_visualization_png()
+    assert len(_CHART_CACHE) == 2
+    print("✅ 模式變更後重新渲染")
+
+def test_fingerprint_not_reused_for_new_list():
+    """測試舊建議列表回收後，重用其 id 的同筆數同模式新列表重新計算指紋"""
+    system = TransferRecommendationSystem()
+    system.df = create_chart_test_data()
+    system.generate_recommendations("A")
+    template = [dict(item) for item in system.transfer_suggestions]
+    system.result_sets.clear()
+
+    system.transfer_suggestions = [dict(item) for item in template]
+    old_id = id(system.transfer_suggestions)
+    fingerprint = system.suggestions_fingerprint()
+    system.transfer_suggestions = None
+    # 舊列表被回收時，新建的列表可能取得相同的 id
+    candidates = [[] for _ in range(1000)]
+    new_list = next((candidate for candidate in candidates if id(candidate) == old_id), candidates[0])
+    new_list.extend(dict(item, Transfer_Qty=item['Transfer_Qty'] + 1) for item in template)
+    system.transfer_suggestions = new_list
+    assert system.suggestions_fingerprint() != fingerprint
+    print("✅ 新建議列表重新計算指紋")
+
+def test_export_prepared_on_request():
+    """測試Excel報告只在要求時生成，其後按建議指紋沿用，建議改變後需重新生成"""
+    system = TransferRecommendationSystem()
+    system.df = create_chart_test_data()
+    system.generate_recommendations("A")
+    assert system.prepared_export() == (None, None)
+
+    excel_data, filename = system.prepare_export()
+    assert excel_data and filename.endswith(".xlsx")
+    assert system.prepare_export()[0] is excel_data and system.prepared_export()[0] is excel_data
+    assert system.memory_usage()['export_bytes'] == len(excel_data)
+
+    system.generate_recommendations("B")
+    assert system.prepared_export() == (None, None)
+    print("✅ Excel報告按需生成並沿用")
+
+def test_interactive_chart():
+    """測試互動圖表路徑"""
+    system = TransferRecommendationSystem()
+    system.df = create_chart_test_data()
+    system.generate_recommendations("A")
+
+    fig = system.create_interactive_visualization()
+    try:
+        import plotly  # noqa: F401
+    except ImportError:
+        assert fig is None
+        return
+
+    assert len(fig.data) > 0
+    print(f"✅ 互動圖表: {len(fig.data)} 個數據系列")
+
+if __name__ == "__main__":
+    test_chart_png_cache()
+    test_fingerprint_not_reused_for_new_list()
+    test_export_prepared_on_request()
+    test_interactive_chart()
+    print("\n🎉 圖表快取測試完成")
@@ -0,0 +1,73 @@
+"""
+測試緊湊欄位類型：int32數量欄位及類別文字欄位不改變引擎結果，並報告節省的記憶體
+"""
+import io
+import numpy as np
+import pandas as pd
+from app import TransferRecommendationSystem, compact_dtypes, QUANTITY_COLUMNS, CATEGORICAL_COLUMNS, QUANTITY_LIMIT
+from test_cumulative_allocation import create_matching_test_data
+
+def widen_dtypes(df):
+    """還原為 int64 及字串欄位（緊湊前的類型）"""
+    wide = df.copy()
+    for column in QUANTITY_COLUMNS:
+        wide[column] = wide[column].astype(np.int64)
+    for column in CATEGORICAL_COLUMNS:
+        wide[column] = wide[column].astype(str)
+    return wide
+
+def test_load_applies_compact_dtypes():
+    """測試載入後使用緊湊類型並報告節省的記憶體"""
+    print("=" * 50)
+    print("🗜️ 緊湊欄位類型測試")
+    print("=" * 50)
+
+    buffer = io.BytesIO()
+    create_matching_test_data(3, duplicate_rows=10).to_excel(buffer, index=False)
+    system = TransferRecommendationSystem()
+    success, message = system.load_and_preprocess_data(buffer.getvalue())
+    assert success, message
+
+    for column in QUANTITY_COLUMNS:
+        assert system.df[column].dtype == np.int32, column
+    for column in CATEGORICAL_COLUMNS:
+        assert isinstance(system.df[column].dtype, pd.CategoricalDtype), column
+
+    report = system.dtype_report
+    assert report['after_bytes'] < report['before_bytes']
+    assert report['columns']['MOQ'] == ('int64', 'int32')
+    print(f"✅ 記憶體 {report['before_bytes']:,} → {report['after_bytes']:,} bytes")
+
+def test_engine_results_unchanged():
+    """測試緊湊類型與原類型的預先統計、建議、參數掃描一致"""
+    for seed in range(4):
+        wide_df = create_matching_test_data(seed, duplicate_rows=15)
+        compact_df, _ = compact_dtypes(wide_df)
+
+        wide = TransferRecommendationSystem()
+        wide.df = widen_dtypes(wide_df)
+        compact = TransferRecommendationSystem()
+        compact.df = compact_df
+
+        assert compact.calculate_preliminary_statistics() == wide.calculate_preliminary_statistics()
+        for mode in ("A", "B", "C"):
+            assert compact.generate_recommendations(mode)[0] and wide.generate_recommendations(mode)[0]
+            assert compact.transfer_suggestions == wide.transfer_suggestions, f"seed={seed} mode={mode}"
+        assert compact.sweep_transfer_parameters("B").equals(wide.sweep_transfer_parameters("B"))
+    print("✅ 4組數據 × 3模式結果一致")
+
+def test_out_of_range_quantities_kept():
+    """測試超出安全範圍的數量欄位保留原類型"""
+    df = create_matching_test_data(1)
+    df.loc[0, 'Safety Stock'] = QUANTITY_LIMIT + 1
+    compact, report = compact_dtypes(df)
+    assert compact['Safety Stock'].dtype == np.int64
+    assert 'Safety Stock' not in report['columns']
+    assert compact['MOQ'].dtype == np.int32
+    assert compact['Safety Stock'].equals(df['Safety Stock'])
+
+if __name__ == "__main__":
+    test_load_applies_compact_dtypes()
+    test_engine_results_unchanged()
+    test_out_of_range_quantities_kept()
+    print("\n🎉 緊湊欄位類型測試完成")
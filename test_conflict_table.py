@@ -0,0 +1,80 @@
+"""
+測試同店舖同SKU衝突的鍵值反連接與原逐筆查找結果一致，並輸出結構化衝突表
+"""
+import io
+import pandas as pd
+from app import TransferRecommendationSystem, CONFLICT_COLUMNS
+from test_cumulative_allocation import create_matching_test_data
+
+def legacy_resolve_conflicts(transfer_candidates, receive_candidates):
+    """v1.72 逐筆查找實現（參考結果）"""
+    receive_lookup = {}
+    for receive in receive_candidates:
+        receive_lookup[(receive['Site'], receive['Article'], receive['OM'])] = receive
+
+    filtered, conflicts = [], []
+    for transfer in transfer_candidates:
+        key = (transfer['Site'], transfer['Article'], transfer['OM'])
+        if key in receive_lookup:
+            receive = receive_lookup[key]
+            conflicts.append([transfer['Site'], transfer['Article'], transfer['OM'],
+                              transfer['Transfer_Qty'], transfer['Type'],
+                              receive['Need_Qty'], receive['Type']])
+        else:
+            filtered.append(transfer)
+    return filtered, pd.DataFrame(conflicts, columns=CONFLICT_COLUMNS)
+
+def test_conflicts_match_legacy_lookup():
+    """測試多組隨機數據下過濾結果與衝突表一致"""
+    print("=" * 50)
+    print("🔧 同店衝突反連接測試")
+    print("=" * 50)
+
+    total_conflicts = 0
+    for seed in range(10):
+        system = TransferRecommendationSystem()
+        system.df = create_matching_test_data(seed, duplicate_rows=20)
+        for mode in ["A", "B", "C"]:
+            transfer_candidates = system.identify_transfer_candidates(mode)
+            if mode == "C":
+                receive_candidates = system.identify_receive_candidates_mode_c()
+            else:
+                receive_candidates = system.identify_receive_candidates()
+
+            filtered, receives, conflicts = system.resolve_same_store_conflicts(transfer_candidates,
+                                                                                receive_candidates)
+            expected_filtered, expected_conflicts = legacy_resolve_conflicts(transfer_candidates,
+                                                                             receive_candidates)
+            assert filtered == expected_filtered, f"seed={seed} mode={mode}"
+            assert receives is receive_candidates
+            assert conflicts.values.tolist() == expected_conflicts.values.tolist()
+            total_conflicts += len(conflicts)
+
+    assert total_conflicts > 0, "測試數據應包含衝突"
+    print(f"✅ 10組數據 × 3模式一致，共 {total_conflicts} 個衝突")
+
+def test_conflicts_in_results_and_export():
+    """測試衝突表保存於結果統計並匯出為工作表"""
+    for seed in range(10):
+        system = TransferRecommendationSystem()
+        system.df = create_matching_test_data(seed, duplicate_rows=20)
+        success, message = system.generate_recommendations("B")
+        assert success, message
+        if system.transfer_suggestions and not system.get_conflicts().empty:
+            break
+    else:
+        raise AssertionError("測試數據應產生含衝突的結果")
+
+    conflicts = system.get_conflicts()
+    assert '店舖' in conflicts.columns
+
+    excel_data, filename = system.export_to_excel()
+    assert excel_data, filename
+    exported = pd.read_excel(io.BytesIO(excel_data), sheet_name='同店衝突')
+    assert len(exported) == len(conflicts)
+    print(f"✅ 匯出同店衝突工作表: {len(exported)} 行")
+
+if __name__ == "__main__":
+    test_conflicts_match_legacy_lookup()
+    test_conflicts_in_results_and_export()
+    print("\n🎉 同店衝突反連接測試完成")
@@ -0,0 +1,243 @@
+"""
+測試累計區間分配核心與v1.73逐筆貪婪匹配結果完全一致
+"""
+import copy
+import numpy as np
+import pandas as pd
+from app import TransferRecommendationSystem, allocate_cumulative
+
+class LegacyMatchingSystem(TransferRecommendationSystem):
+    """保留v1.73逐筆貪婪匹配原始實現作為對照"""
+    
+    def legacy_match_transfer_suggestions(self, transfer_candidates, receive_candidates):
+        """匹配調貨建議 - 優化同店舖RF轉出"""
+        suggestions = []
+        
+        # 創建可變的候選列表副本
+        available_transfers = transfer_candidates.copy()
+        available_receives = receive_candidates.copy()
+        
+        # 先處理ND轉出（優先級最高）
+        self._legacy_match_nd_transfers(available_transfers, available_receives, suggestions)
+        
+        # 再處理RF轉出，優化同店舖轉出
+        self._legacy_match_rf_transfers_optimized(available_transfers, available_receives, suggestions)
+        
+        return suggestions
+    
+    def _legacy_match_nd_transfers(self, available_transfers, available_receives, suggestions):
+        """處理ND轉出（最高優先級）"""
+        for receive in available_receives[:]:
+            if receive['Need_Qty'] <= 0:
+                continue
+                
+            for i, transfer in enumerate(available_transfers):
+                if (transfer['Type'] == 'ND轉出' and
+                    transfer['Article'] == receive['Article'] and 
+                    transfer['OM'] == receive['OM'] and 
+                    transfer['Site'] != receive['Site'] and
+                    transfer['Transfer_Qty'] > 0):
+                    
+                    actual_qty = min(transfer['Transfer_Qty'], receive['Need_Qty'])
+                    
+                    if actual_qty > 0:
+                        suggestions.append(self._create_suggestion(transfer, receive, actual_qty))
+                        available_transfers[i]['Transfer_Qty'] -= actual_qty
+                        receive['Need_Qty'] -= actual_qty
+                        
+                        if receive['Need_Qty'] <= 0:
+                            break
+    
+    def _legacy_match_rf_transfers_optimized(self, available_transfers, available_receives, suggestions):
+        """處理RF轉出 - 優化存貨優先、同店舖轉出、避免單件"""
+        # 將RF轉出按店舖分組
+        rf_transfers_by_site = {}
+        for i, transfer in enumerate(available_transfers):
+            if transfer['Type'] in ['RF過剩轉出', 'RF加強轉出'] and transfer['Transfer_Qty'] > 0:
+                site = transfer['Site']
+                if site not in rf_transfers_by_site:
+                    rf_transfers_by_site[site] = []
+                rf_transfers_by_site[site].append((i, transfer))
+        
+        # 計算每個店舖的綜合優先級
+        site_priority = []
+        for site, transfers in rf_transfers_by_site.items():
+            # 統計活躍轉出項目
+            active_transfers = [t for i, t in transfers if t['Transfer_Qty'] > 0]
+            
+            if not active_transfers:
+                continue
+                
+            # 計算優先級指標
+            active_items = len(active_transfers)  # 可轉出品項數
+            total_stock = sum(t['Original_Stock'] for t in active_transfers)  # 總存貨
+            total_qty = sum(t['Transfer_Qty'] for t in active_transfers)  # 總可轉出數量
+            multi_piece_items = len([t for t in active_transfers if t['Transfer_Qty'] >= 2])  # 可2件以上轉出的品項數
+            
+            # 綜合優先級：(可2件品項數, 總存貨, 品項數, 總轉出數量)
+            priority = (multi_piece_items, total_stock, active_items, total_qty)
+            site_priority.append((site, priority, transfers))
+        
+        # 按綜合優先級排序
+        # 1. 可2件以上轉出品項數多的優先
+        # 2. 總存貨多的優先  
+        # 3. 品項數多的優先
+        # 4. 總轉出數量多的優先
+        site_priority.sort(key=lambda x: x[1], reverse=True)
+        
+        # 按優先順序處理每個店舖的轉出
+        for site, priority_metrics, transfers in site_priority:
+            # 在店舖內按存貨量排序轉出項目
+            transfers_sorted = []
+            for i, transfer in transfers:
+                if transfer['Transfer_Qty'] > 0:
+                    # 優先級：(可轉出數量>=2, 原始存貨, 轉出數量)
+                    can_multi = 1 if transfer['Transfer_Qty'] >= 2 else 0
+                    item_priority = (can_multi, transfer['Original_Stock'], transfer['Transfer_Qty'])
+                    transfers_sorted.append((item_priority, i, transfer))
+            
+            # 按項目優先級排序
+            transfers_sorted.sort(key=lambda x: x[0], reverse=True)
+            
+            # 處理該店舖的所有轉出需求
+            for receive in available_receives[:]:
+                if receive['Need_Qty'] <= 0:
+                    continue
+                    
+                # 按優先級順序查找匹配的轉出項目
+                for item_priority, i, transfer in transfers_sorted:
+                    if (transfer['Article'] == receive['Article'] and 
+                        transfer['OM'] == receive['OM'] and 
+                        transfer['Site'] != receive['Site'] and
+                        transfer['Transfer_Qty'] > 0):
+                        
+                        actual_qty = min(transfer['Transfer_Qty'], receive['Need_Qty'])
+                        
+                        # 智能數量優化
+                        if actual_qty == 1:
+                            # 如果只有1件且該轉出項目有足夠庫存，嘗試調高到2件
+                            if transfer['Transfer_Qty'] >= 2:
+                                after_transfer_stock = transfer['Original_Stock'] - 2
+                                if after_transfer_stock >= transfer['Safety_Stock']:
+                                    actual_qty = 2
+                            else:
+                                # 如果真的只能轉1件，檢查是否有其他店舖可以轉2件以上
+                                if self._legacy_has_better_multi_piece_option(receive, rf_transfers_by_site, site):
+                                    continue  # 跳過此次1件轉出，等待更好的選項
+                        
+                        if actual_qty > 0:
+                            suggestions.append(self._create_suggestion(transfer, receive, actual_qty))
+                            available_transfers[i]['Transfer_Qty'] -= actual_qty
+                            transfer['Transfer_Qty'] -= actual_qty  # 同步更新本地副本
+                            receive['Need_Qty'] -= actual_qty
+                            
+                            if receive['Need_Qty'] <= 0:
+                                break
+                                
+    def _legacy_has_better_multi_piece_option(self, receive, rf_transfers_by_site, current_site):
+        """檢查是否有其他店舖能提供2件以上的轉出選項"""
+        for site, transfers in rf_transfers_by_site.items():
+            if site == current_site:
+                continue
+                
+            for i, transfer in transfers:
+                if (transfer['Article'] == receive['Article'] and 
+                    transfer['OM'] == receive['OM'] and 
+                    transfer['Site'] != receive['Site'] and
+                    transfer['Transfer_Qty'] >= 2):
+                    return True
+        return False
+
+
+def create_matching_test_data(seed, n_articles=12, n_sites=10, duplicate_rows=6):
+    """創建隨機測試數據（含重複 Article/Site 行以觸發同店舖情況）"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for a in range(n_articles):
+        for s in range(n_sites):
+            if rng.random() < 0.25:
+                continue
+            rows.append({
+                'Article': f'M{a:03d}',
+                'Article Description': f'產品{a}',
+                'RP Type': 'ND' if rng.random() < 0.15 else 'RF',
+                'Site': f'S{s:03d}',
+                'OM': f'OM{(s + a) % 2}',
+                'MOQ': int(rng.integers(0, 4)),
+                'SaSa Net Stock': int(rng.choice([0, 0, 1, 2, 3, 5, 8, 13, 25])),
+                'Pending Received': int(rng.integers(0, 3)),
+                'Safety Stock': int(rng.integers(0, 12)),
+                'Last Month Sold Qty': int(rng.integers(0, 10)),
+                'MTD Sold Qty': int(rng.integers(0, 6)),
+                'Notes': ''
+            })
+    df = pd.DataFrame(rows)
+    duplicates = df.sample(n=min(duplicate_rows, len(df)), random_state=seed).copy()
+    duplicates['RP Type'] = np.where(duplicates['RP Type'] == 'ND', 'RF', 'ND')
+    duplicates['SaSa Net Stock'] = rng.integers(0, 10, size=len(duplicates))
+    return pd.concat([df, duplicates], ignore_index=True)
+
+def run_both(system, transfer_candidates, receive_candidates):
+    """分別以核心和原始實現匹配，返回兩組結果及剩餘數量"""
+    kernel_t, kernel_r = copy.deepcopy(transfer_candidates), copy.deepcopy(receive_candidates)
+    legacy_t, legacy_r = copy.deepcopy(transfer_candidates), copy.deepcopy(receive_candidates)
+    kernel = system.match_transfer_suggestions(kernel_t, kernel_r)
+    legacy = system.legacy_match_transfer_suggestions(legacy_t, legacy_r)
+    return (kernel, kernel_t, kernel_r), (legacy, legacy_t, legacy_r)
+
+def test_kernel_matches_legacy_greedy():
+    """測試多組隨機數據下核心匹配結果與原始逐筆匹配完全一致（含順序）"""
+    print("=" * 50)
+    print("🧮 累計區間分配核心測試")
+    print("=" * 50)
+
+    total_suggestions = 0
+    for seed in range(20):
+        system = LegacyMatchingSystem()
+        system.df = create_matching_test_data(seed)
+        for mode in ["A", "B", "C"]:
+            transfer_candidates = system.identify_transfer_candidates(mode)
+            if mode == "C":
+                receive_candidates = system.identify_receive_candidates_mode_c()
+            else:
+                receive_candidates = system.identify_receive_candidates()
+
+            # 不經衝突解決（含同店舖轉出/接收）和經衝突解決兩種情況
+            resolved = system.resolve_same_store_conflicts(copy.deepcopy(transfer_candidates),
+                                                           copy.deepcopy(receive_candidates))[:2]
+            for candidates in [(transfer_candidates, receive_candidates), resolved]:
+                kernel, legacy = run_both(system, *candidates)
+                assert kernel[0] == legacy[0], f"seed={seed} mode={mode}"
+                assert kernel[1] == legacy[1] and kernel[2] == legacy[2]
+                total_suggestions += len(kernel[0])
+
+    assert total_suggestions > 0
+    print(f"✅ 20組數據 × 3模式一致，共 {total_suggestions} 條建議")
+
+def test_reference_path_matches_kernel():
+    """測試參考實現與核心路徑一致"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(99, n_articles=30)
+    transfer_candidates = system.identify_transfer_candidates("B")
+    receive_candidates = system.identify_receive_candidates()
+    kernel = system.match_transfer_suggestions(copy.deepcopy(transfer_candidates), copy.deepcopy(receive_candidates))
+    reference = system.match_transfer_suggestions_reference(copy.deepcopy(transfer_candidates),
+                                                            copy.deepcopy(receive_candidates))
+    assert kernel == reference
+
+def test_allocate_cumulative_kernel():
+    """測試核心函數的批量分組分配"""
+    # 組0: 轉出 [3, 0, 4]，接收 [2, 4, 5]；組1: 轉出 [5]，接收 [0, 2]；組2: 只有接收
+    donor_pos, receiver_pos, qty = allocate_cumulative(
+        [0, 0, 0, 1], [3, 0, 4, 5],
+        [0, 0, 0, 1, 1, 2], [2, 4, 5, 0, 2, 7]
+    )
+    pairs = list(zip(donor_pos.tolist(), receiver_pos.tolist(), qty.tolist()))
+    assert pairs == [(0, 0, 2), (0, 1, 1), (2, 1, 3), (2, 2, 1), (3, 4, 2)]
+    print("✅ 核心函數分配正確")
+
+if __name__ == "__main__":
+    test_allocate_cumulative_kernel()
+    test_kernel_matches_legacy_greedy()
+    test_reference_path_matches_kernel()
+    print("\n🎉 累計區間分配核心測試完成")
@@ -0,0 +1,113 @@
+"""
+測試預處理數據集磁碟快取：重新啟動後直接載入預處理結果，並按容量淘汰舊項目
+"""
+import os
+import tempfile
+from contextlib import contextmanager
+import pandas as pd
+import app
+from app import TransferRecommendationSystem, DATASET_ENGINE_VERSION, _DATASET_CACHE
+from dataset_store import DatasetStore, DATASET_FILE, FEATURES_FILE, STATS_FILE
+from test_lazy_preliminary_stats import create_lazy_test_excel, wait_for_preliminary
+from test_preliminary_totals import create_totals_test_data
+
+@contextmanager
+def temporary_store(max_bytes=app.DATASET_STORE_MAX_BYTES, engine_version=DATASET_ENGINE_VERSION):
+    """以臨時目錄的磁碟快取替換應用的磁碟快取"""
+    original = app._DATASET_STORE
+    with tempfile.TemporaryDirectory() as directory:
+        app._DATASET_STORE = DatasetStore(directory, engine_version, max_bytes)
+        try:
+            yield app._DATASET_STORE
+        finally:
+            app._DATASET_STORE = original
+
+def test_restart_loads_from_disk():
+    """測試清空記憶體快取（模擬重新啟動）後從磁碟快取取得相同的預處理結果"""
+    print("=" * 50)
+    print("💾 數據集磁碟快取測試")
+    print("=" * 50)
+
+    content = create_lazy_test_excel(21)
+    with temporary_store() as store:
+        _DATASET_CACHE.clear()
+        system = TransferRecommendationSystem()
+        success, message = system.load_and_preprocess_data(content)
+        assert success, message
+        entry_path = store._entry_path(system.dataset_key)
+        assert os.path.exists(os.path.join(entry_path, DATASET_FILE))
+
+        wait_for_preliminary(system)
+        assert os.path.exists(os.path.join(entry_path, FEATURES_FILE))
+        assert os.path.exists(os.path.join(entry_path, STATS_FILE))
+        print("✅ 預處理結果、特徵數據框及預先統計已寫入磁碟")
+
+        _DATASET_CACHE.clear()
+        restarted = TransferRecommendationSystem()
+        success, message = restarted.load_and_preprocess_data(content)
+        assert success, message
+        pd.testing.assert_frame_equal(restarted.df, system.df)
+        assert restarted.preliminary_stats_ready()
+        assert restarted.preliminary_stats == system.preliminary_stats
+        pd.testing.assert_frame_equal(restarted.get_feature_frame(), system.get_feature_frame())
+        assert not restarted.df['SaSa Net Stock'].to_numpy().flags.writeable, "數值欄位應為記憶體映射"
+        print("✅ 重新啟動後從磁碟快取載入")
+
+        for mode in ("A", "B", "C"):
+            assert system.generate_recommendations(mode)[0]
+            assert restarted.generate_recommendations(mode)[0]
+            assert restarted.transfer_suggestions == system.transfer_suggestions, f"mode={mode}"
+        print("✅ 三個模式建議一致")
+
+        other = TransferRecommendationSystem()
+        assert other.load_and_preprocess_data(content)[0]
+        assert other.df is restarted.df, "磁碟快取結果應放回記憶體快取"
+    _DATASET_CACHE.clear()
+
+def test_engine_version_changes_key():
+    """測試引擎版本不同時不使用舊項目"""
+    df = create_totals_test_data(1)
+    with tempfile.TemporaryDirectory() as directory:
+        DatasetStore(directory, "old").save("abc", df)
+        assert DatasetStore(directory, "old").load("abc") is not None
+        assert DatasetStore(directory, "new").load("abc") is None
+
+def test_size_bounded_eviction():
+    """測試超出容量時淘汰最久未使用的項目"""
+    df = create_totals_test_data(2, n_rows=2000)
+    with tempfile.TemporaryDirectory() as directory:
+        store = DatasetStore(directory, DATASET_ENGINE_VERSION)
+        for index, key in enumerate(["first", "second", "third"]):
+            store.save(key, df)
+            os.utime(store._entry_path(key), (1000 + index, 1000 + index))
+        entry_bytes = store.usage()[1] // 3
+
+        store.load("first")  # 最近使用
+        store.max_bytes = entry_bytes * 2
+        store.save("fourth", df)
+        assert store.usage()[0] == 2
+        assert store.load("first") is not None
+        assert store.load("fourth") is not None
+        assert store.load("second") is None and store.load("third") is None
+
+        store.max_bytes = 1
+        store.evict(keep="fourth")
+        assert store.usage()[0] == 1 and store.load("fourth") is not None
+    print("✅ 按容量淘汰最久未使用的項目")
+
+def test_corrupt_entry_discarded():
+    """測試損壞的項目被刪除並視為未命中"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = DatasetStore(directory, DATASET_ENGINE_VERSION)
+        store.save("broken", create_totals_test_data(3))
+        with open(os.path.join(store._entry_path("broken"), DATASET_FILE), "wb") as f:
+            f.write(b"not arrow")
+        assert store.load("broken") is None
+        assert store.usage() == (0, 0)
+
+if __name__ == "__main__":
+    test_restart_loads_from_disk()
+    test_engine_version_changes_key()
+    test_size_bounded_eviction()
+    test_corrupt_entry_discarded()
+    print("\n🎉 數據集磁碟快取測試完成")
@@ -0,0 +1,85 @@
+"""
+測試重複 (Article, Site) 行合併：一次 groupby 彙總與逐組合併結果一致，並在候選識別前完成
+"""
+import io
+import numpy as np
+import pandas as pd
+from app import (TransferRecommendationSystem, consolidate_duplicates_rows, CONSOLIDATION_RULES,
+                 QUALITY_FLAGS_COLUMN)
+from test_cumulative_allocation import create_matching_test_data
+
+def reference_consolidation(df):
+    """逐組合併（參考結果）：加總/最大值按規則，其他欄位取首行，標記取位元或"""
+    groups = {}
+    for row in df.to_dict('records'):
+        key = (row['Article'], row['Site'])
+        if key not in groups:
+            groups[key] = dict(row)
+            continue
+        merged = groups[key]
+        for column, how in CONSOLIDATION_RULES.items():
+            merged[column] = merged[column] + row[column] if how == 'sum' else max(merged[column], row[column])
+        merged[QUALITY_FLAGS_COLUMN] |= row[QUALITY_FLAGS_COLUMN]
+    return pd.DataFrame(list(groups.values()), columns=df.columns)
+
+def create_duplicate_test_data(seed):
+    """創建含重複 (Article, Site) 行及數據質量標記的測試數據"""
+    rng = np.random.default_rng(seed)
+    df = create_matching_test_data(seed, duplicate_rows=40).drop(columns='Notes')
+    df[QUALITY_FLAGS_COLUMN] = rng.choice([0, 0, 0, 1, 4, 256], size=len(df)).astype(np.uint16)
+    return df
+
+def test_consolidation_matches_reference():
+    """測試合併結果與逐組合併一致"""
+    print("=" * 50)
+    print("🔗 重複行合併測試")
+    print("=" * 50)
+
+    for seed in range(5):
+        df = create_duplicate_test_data(seed)
+        merged, report = consolidate_duplicates_rows(df)
+        expected = reference_consolidation(df)
+
+        assert list(merged.columns) == list(df.columns)
+        assert merged.values.tolist() == expected.values.tolist(), f"seed={seed}"
+        assert merged[QUALITY_FLAGS_COLUMN].dtype == np.uint16
+        assert not merged.duplicated(['Article', 'Site']).any()
+        assert report['rows_before'] == len(df) and report['rows_after'] == len(merged)
+        assert report['collapsed_rows'] == len(df) - len(merged) > 0
+        assert report['duplicate_groups'] == df[df.duplicated(['Article', 'Site'], keep=False)][
+            ['Article', 'Site']].drop_duplicates().shape[0]
+        assert merged['SaSa Net Stock'].sum() == df['SaSa Net Stock'].sum()
+    print("✅ 5組數據合併結果一致")
+
+def test_no_duplicates_returns_same_frame():
+    """測試沒有重複行時不複製數據框"""
+    df = create_duplicate_test_data(1).drop_duplicates(['Article', 'Site'])
+    merged, report = consolidate_duplicates_rows(df)
+    assert merged is df
+    assert report['collapsed_rows'] == 0
+
+def test_load_consolidates_before_candidates():
+    """測試載入時合併，候選中每個 (Article, Site) 只出現一次，且合併與否分開快取"""
+    buffer = io.BytesIO()
+    create_duplicate_test_data(2).drop(columns=QUALITY_FLAGS_COLUMN).to_excel(buffer, index=False)
+    content = buffer.getvalue()
+
+    system = TransferRecommendationSystem()
+    assert system.load_and_preprocess_data(content)[0]
+    raw = TransferRecommendationSystem()
+    assert raw.load_and_preprocess_data(content, consolidate_duplicates=False)[0]
+
+    assert system.dataset_key != raw.dataset_key
+    assert len(system.df) == system.consolidation_report['rows_after'] < len(raw.df)
+    assert raw.consolidation_report is None
+
+    for mode in ("A", "B", "C"):
+        keys = [(item['Article'], item['Site']) for item in system.identify_transfer_candidates(mode)]
+        assert len(keys) == len(set(keys)), mode
+    print(f"✅ 載入時合併 {system.consolidation_report['collapsed_rows']} 行")
+
+if __name__ == "__main__":
+    test_consolidation_matches_reference()
+    test_no_duplicates_returns_same_frame()
+    test_load_consolidates_before_candidates()
+    print("\n🎉 重複行合併測試完成")
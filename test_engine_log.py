@@ -0,0 +1,103 @@
+"""
+測試引擎日誌：JSON格式、速率限制，以及生成建議時以單一彙總記錄輸出計數
+"""
+import io
+import json
+import logging
+import engine_log
+from app import TransferRecommendationSystem
+from test_cumulative_allocation import create_matching_test_data
+
+def make_record(message, *args, fields=None, name="transfer_recommendation.test"):
+    record = logging.LogRecord(name, logging.INFO, __file__, 1, message, args, None)
+    if fields:
+        record.fields = fields
+    return record
+
+def engine_records(caplog):
+    return [record for record in caplog.records if record.name.startswith(engine_log.LOGGER_NAME)]
+
+def test_json_format_and_rate_limit():
+    """測試JSON格式包含結構化欄位，超出速率的記錄被略過並在下一時間窗報告略過條數"""
+    print("=" * 50)
+    print("📝 引擎日誌測試")
+    print("=" * 50)
+
+    entry = json.loads(engine_log.JsonFormatter().format(make_record("模式%s完成", "A", fields={'suggestions': 5})))
+    assert entry['message'] == "模式A完成" and entry['suggestions'] == 5 and entry['level'] == "INFO"
+    text = engine_log.TextFormatter("%(message)s").format(make_record("完成", fields={'conflicts': 2}))
+    assert text == "完成 conflicts=2"
+
+    now = [0.0]
+    limiter = engine_log.RateLimitFilter(burst=3, interval=10, clock=lambda: now[0])
+    passed = [limiter.filter(make_record("衝突 %s", i)) for i in range(10)]
+    assert passed == [True] * 3 + [False] * 7
+    assert limiter.filter(make_record("其他訊息"))  # 不同模板分開計算
+    now[0] = 11.0
+    record = make_record("衝突 %s", 10)
+    assert limiter.filter(record) and record.suppressed == 7
+    assert "suppressed" in engine_log.JsonFormatter().format(record)
+    print("✅ JSON格式及速率限制")
+
+def test_configure_logging_is_idempotent():
+    """測試重複設定只保留一個處理器，改變格式時替換"""
+    logger = engine_log.get_logger()
+    original_handlers, original_level = list(logger.handlers), logger.level
+    stream = io.StringIO()
+    try:
+        engine_log.configure_logging("INFO", "json", stream)
+        engine_log.configure_logging("INFO", "json", stream)
+        installed = [handler for handler in logger.handlers if hasattr(handler, 'engine_log_config')]
+        assert len(installed) == 1
+        engine_log.get_logger("test").info("測試 %d", 1, extra={'fields': {'rows': 3}})
+        entry = json.loads(stream.getvalue().splitlines()[-1])
+        assert entry['logger'] == "transfer_recommendation.test" and entry['rows'] == 3
+
+        engine_log.configure_logging("WARNING", "text", stream)
+        assert [handler.engine_log_config[0] for handler in logger.handlers
+                if hasattr(handler, 'engine_log_config')] == ["text"]
+        engine_log.get_logger("test").info("不輸出")
+        assert "不輸出" not in stream.getvalue()
+    finally:
+        logger.handlers[:] = original_handlers
+        logger.setLevel(original_level)
+
+def test_generation_logs_single_summary(caplog):
+    """測試生成建議及模式比較各只輸出一條彙總記錄，計數與結果一致"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(4, n_articles=30, n_sites=12)
+    with caplog.at_level(logging.INFO, logger=engine_log.LOGGER_NAME):
+        assert system.generate_recommendations("B")[0]
+    records = engine_records(caplog)
+    assert len(records) == 1
+    fields = records[0].fields
+    assert fields['suggestions'] == len(system.transfer_suggestions)
+    assert fields['conflicts'] == len(system.statistics['conflicts'])
+    pair_counts = [fields.get(name, 0) for name in ('nd_kernel_pairs', 'nd_greedy_pairs',
+                                                    'rf_kernel_pairs', 'rf_greedy_pairs')]
+    assert sum(pair_counts) == fields['suggestions']
+    assert fields['match_ms'] >= 0 and system.run_counters is None
+
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger=engine_log.LOGGER_NAME):
+        assert system.generate_comparison()[0]
+    records = engine_records(caplog)
+    assert len(records) == 1
+    for mode in ("A", "B", "C"):
+        assert records[0].fields[f"suggestions_{mode}"] == len(system.result_sets[mode]['suggestions'])
+    print(f"✅ 彙總記錄: {records[0].getMessage()}")
+
+def test_failure_logged_with_traceback(caplog):
+    """測試生成失敗時記錄例外"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(1).drop(columns=['MOQ'])
+    with caplog.at_level(logging.INFO, logger=engine_log.LOGGER_NAME):
+        success, _ = system.generate_recommendations("A")
+    assert not success
+    errors = [record for record in engine_records(caplog) if record.levelno == logging.ERROR]
+    assert len(errors) == 1 and errors[0].exc_info is not None
+
+if __name__ == "__main__":
+    test_json_format_and_rate_limit()
+    test_configure_logging_is_idempotent()
+    print("\n🎉 引擎日誌測試完成")
@@ -0,0 +1,164 @@
+"""
+測試改進版（階梯式轉出限制）調貨建議的分組向量化實現與原逐產品循環結果一致
+"""
+import logging
+import numpy as np
+import pandas as pd
+from transfer_recommendation_improved_tc import improved_process_data_tc
+
+def create_improved_test_data(seed, n_rows=400, n_articles=30, n_shops=25):
+    """創建隨機測試數據（使用 Shop 欄位）"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Article': rng.choice([f'P{i:03d}' for i in range(n_articles)], size=n_rows),
+        'Shop': rng.choice([f'S{i:03d}' for i in range(n_shops)], size=n_rows),
+        'RP Type': rng.choice(['ND', 'RF', 'RF', 'RF'], size=n_rows),
+        'SaSa Net Stock': rng.choice([-1, 0, 0, 1, 2, 3, 4, 5, 7, 9, 11, 15, 40], size=n_rows),
+        'Pending Received': rng.choice([0, 0, 0, 1, 2, 5, 12], size=n_rows)
+    })
+
+def legacy_improved_process_data_tc(df):
+    """原逐產品、逐行循環實現（參考結果）"""
+    
+    transfer_recommendations = []
+    
+    for article in df['Article'].unique():
+        article_data = df[df['Article'] == article].copy()
+        
+        nd_data = article_data[article_data['RP Type'] == 'ND']
+        rf_data = article_data[article_data['RP Type'] == 'RF']
+        
+        # Priority 1: ND缺貨補充 (保持原邏輯)
+        nd_shortage = nd_data[nd_data['SaSa Net Stock'] <= 0]
+        rf_surplus = rf_data[rf_data['SaSa Net Stock'] > 2]
+        
+        for _, nd_row in nd_shortage.iterrows():
+            shortage = 2 - nd_row['SaSa Net Stock']
+            
+            for _, rf_row in rf_surplus.iterrows():
+                if rf_row['Shop'] != nd_row['Shop']:
+                    available = rf_row['SaSa Net Stock'] - 2
+                    transfer_qty = min(shortage, available)
+                    
+                    if transfer_qty >= 1:  # 降低最小轉出量到1件
+                        transfer_recommendations.append({
+                            '優先級': 1,
+                            '類型': 'ND缺貨補充',
+                            '產品編號': article,
+                            '調出店鋪': rf_row['Shop'],
+                            '調入店鋪': nd_row['Shop'],
+                            '調貨數量': int(transfer_qty),
+                            '調出店庫存': rf_row['SaSa Net Stock'],
+                            '調入店庫存': nd_row['SaSa Net Stock'],
+                            '轉出方法': '原規則',
+                            '原因': f'ND缺貨{shortage}件，調入{transfer_qty}件'
+                        })
+                        shortage -= transfer_qty
+                        if shortage <= 0:
+                            break
+        
+        # Priority 2: RF內部調配 (應用改進規則)
+        rf_shortage = rf_data[rf_data['SaSa Net Stock'] <= 2]
+        
+        for _, surplus_row in rf_surplus.iterrows():
+            excess = surplus_row['SaSa Net Stock'] - 2
+            current_stock = surplus_row['SaSa Net Stock']
+            pending = surplus_row['Pending Received']
+            total_available = current_stock + pending
+            
+            # 改進的轉出限制計算
+            if current_stock <= 10:
+                # 小庫存店鋪：30%轉出，最少1件
+                transfer_cap = max(total_available * 0.3, 1)
+                method = '小庫存30%規則'
+            else:
+                # 大庫存店鋪：20%轉出，最少2件
+                transfer_cap = max(total_available * 0.2, 2)
+                method = '大庫存20%規則'
+            
+            # 實際可轉出量
+            max_transfer = min(excess, transfer_cap)
+            
+            if max_transfer >= 1:  # 最少1件才轉
+                for _, shortage_row in rf_shortage.iterrows():
+                    if surplus_row['Shop'] != shortage_row['Shop']:
+                        need = 3 - shortage_row['SaSa Net Stock']
+                        actual_transfer = min(max_transfer, need)
+                        
+                        if actual_transfer >= 1:
+                            transfer_recommendations.append({
+                                '優先級': 2,
+                                '類型': 'RF內部調配',
+                                '產品編號': article,
+                                '調出店鋪': surplus_row['Shop'],
+                                '調入店鋪': shortage_row['Shop'],
+                                '調貨數量': int(actual_transfer),
+                                '調出店庫存': surplus_row['SaSa Net Stock'],
+                                '調入店庫存': shortage_row['SaSa Net Stock'],
+                                '轉出上限': round(transfer_cap, 1),
+                                '轉出方法': method,
+                                '原因': f'{method}，可轉{max_transfer:.1f}件，實際{actual_transfer}件'
+                            })
+                            max_transfer -= actual_transfer
+                            if max_transfer < 1:
+                                break
+    
+    return pd.DataFrame(transfer_recommendations)
+
+def assert_same_recommendations(result, expected, context):
+    """比較兩份建議：原因文字中的件數格式及轉出上限浮點誤差除外，其餘欄位須完全一致"""
+    assert list(result.columns) == list(expected.columns), context
+    assert len(result) == len(expected), context
+    exact = [column for column in expected.columns if column not in ('原因', '轉出上限')]
+    assert result[exact].values.tolist() == expected[exact].values.tolist(), context
+    if '轉出上限' in expected.columns:
+        np.testing.assert_allclose(result['轉出上限'].astype(float), expected['轉出上限'].astype(float),
+                                   err_msg=context)
+    prefixes = expected['原因'].str.extract(r'^(\D+)', expand=False)
+    assert (result['原因'].str.extract(r'^(\D+)', expand=False) == prefixes).all(), context
+
+def test_grouped_engine_matches_legacy_loops():
+    """測試多組隨機數據下結果與原循環實現一致"""
+    print("=" * 50)
+    print("📦 改進版分組向量化調貨測試")
+    print("=" * 50)
+
+    total_rows = 0
+    for seed in range(8):
+        df = create_improved_test_data(seed)
+        result = improved_process_data_tc(df)
+        expected = legacy_improved_process_data_tc(df)
+        assert_same_recommendations(result, expected, f"seed={seed}")
+        assert set(result['類型']) == {'ND缺貨補充', 'RF內部調配'}
+        total_rows += len(result)
+    print(f"✅ 8組數據一致，共 {total_rows} 條建議")
+
+def test_edge_cases():
+    """測試只有RF調配、沒有建議及缺失產品編號的情況"""
+    rf_only = create_improved_test_data(1)
+    rf_only = rf_only[rf_only['RP Type'] == 'RF'].reset_index(drop=True)
+    assert_same_recommendations(improved_process_data_tc(rf_only),
+                                legacy_improved_process_data_tc(rf_only), "RF only")
+
+    no_surplus = pd.DataFrame({'Article': ['P1', 'P1'], 'Shop': ['S1', 'S2'], 'RP Type': ['ND', 'RF'],
+                               'SaSa Net Stock': [0, 2], 'Pending Received': [0, 0]})
+    assert improved_process_data_tc(no_surplus).empty
+
+    with_missing = create_improved_test_data(2, n_rows=200)
+    with_missing.loc[::7, 'Article'] = None
+    expected = legacy_improved_process_data_tc(with_missing)
+    assert_same_recommendations(improved_process_data_tc(with_missing), expected, "missing articles")
+    print("✅ 邊界情況一致")
+
+def test_summary_logged_once(caplog):
+    """測試處理摘要以單一日誌記錄輸出"""
+    with caplog.at_level(logging.INFO, logger="transfer_recommendation.improved_tc"):
+        improved_process_data_tc(create_improved_test_data(3))
+    records = [record for record in caplog.records if record.name == "transfer_recommendation.improved_tc"]
+    assert len(records) == 1
+    assert "RF內部調配" in records[0].getMessage()
+
+if __name__ == "__main__":
+    test_grouped_engine_matches_legacy_loops()
+    test_edge_cases()
+    print("\n🎉 改進版分組向量化調貨測試完成")
@@ -0,0 +1,107 @@
+"""
+測試原始數據驗證報告：各類問題的行數及範例行號，嚴重問題在預處理前即載入失敗
+"""
+import io
+import numpy as np
+import pandas as pd
+from app import (TransferRecommendationSystem, validate_input, VALIDATION_ERROR, VALIDATION_WARNING,
+                 VALIDATION_SAMPLE_ROWS, _DATASET_CACHE)
+from test_quality_flags import create_dirty_test_data
+
+def to_excel_bytes(df):
+    """轉為Excel文件內容"""
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def report_row(report, issue, column):
+    """取得指定問題類型及欄位的報告行"""
+    rows = report[(report['問題類型'] == issue) & (report['欄位'] == column)]
+    assert len(rows) <= 1
+    return rows.iloc[0] if len(rows) else None
+
+def expected_rows(mask):
+    """遮罩對應的Excel行號（標題為第1行）"""
+    return (np.flatnonzero(np.asarray(mask)) + 2).tolist()
+
+def test_report_counts_and_samples():
+    """測試各類問題的行數及範例行號"""
+    print("=" * 50)
+    print("🔎 數據驗證報告測試")
+    print("=" * 50)
+
+    df = create_dirty_test_data(7).astype({'MOQ': object, 'Safety Stock': object})
+    df.loc[[3, 40, 41], 'MOQ'] = 'abc'
+    df.loc[[5, 6], 'Safety Stock'] = None
+    df.loc[10, ['Article', 'Site']] = df.loc[11, ['Article', 'Site']].to_numpy()
+    df['OM'] = 'OM' + df['Site'].str[-1]  # 每個Site屬於一個OM
+    df.loc[20, 'OM'] = 'OM_OTHER'
+
+    report = validate_input(df)
+    assert (report['嚴重程度'] == VALIDATION_WARNING).all()
+
+    non_numeric = report_row(report, '非數值', 'MOQ')
+    assert non_numeric['行數'] == 3 and non_numeric['範例行號'] == [5, 42, 43]
+    assert report_row(report, '空白', 'Safety Stock')['範例行號'] == [7, 8]
+
+    negative = pd.to_numeric(df['SaSa Net Stock'], errors='coerce') < 0
+    row = report_row(report, '負值', 'SaSa Net Stock')
+    assert row['行數'] == negative.sum()
+    assert row['範例行號'] == expected_rows(negative)[:VALIDATION_SAMPLE_ROWS]
+
+    capped = pd.to_numeric(df['MTD Sold Qty']) > 100000
+    assert report_row(report, '超出上限', 'MTD Sold Qty')['行數'] == capped.sum()
+    assert report_row(report, 'RP Type無效值', 'RP Type')['行數'] == (~df['RP Type'].isin(['ND', 'RF'])).sum()
+
+    duplicated = df.duplicated(['Article', 'Site'], keep=False)
+    assert report_row(report, '重複 (Article, Site)', 'Article, Site')['行數'] == duplicated.sum()
+    site_rows = df['Site'] == df.loc[20, 'Site']
+    assert report_row(report, 'Site對應多個OM', 'Site, OM')['行數'] == site_rows.sum()
+    print(f"✅ {len(report)} 類問題行數及範例行號正確")
+
+def test_report_matches_preprocessing_flags():
+    """測試報告的負值、超出上限及RP Type問題行數與預處理修正統計一致"""
+    _DATASET_CACHE.clear()
+    content = to_excel_bytes(create_dirty_test_data(8))
+    system = TransferRecommendationSystem()
+    success, message = system.load_and_preprocess_data(content, consolidate_duplicates=False)
+    assert success, message
+
+    report = system.validation_report
+    summary = system.get_quality_summary().set_index('修正類型')['行數']
+    for row in report.itertuples(index=False):
+        if row[0] == '負值':
+            assert summary[f"{row[1]}負值修正為0"] == row[3]
+        elif row[0] == '超出上限':
+            assert summary[f"{row[1]}異常值>100000修正"] == row[3]
+        elif row[0] == 'RP Type無效值':
+            assert summary["RP Type無效值"] == row[3]
+
+    # 從共用快取載入時保留報告
+    other = TransferRecommendationSystem()
+    assert other.load_and_preprocess_data(content, consolidate_duplicates=False)[0]
+    assert other.validation_report.equals(report)
+    print("✅ 與預處理修正統計一致")
+
+def test_bad_extract_fails_fast():
+    """測試大部分儲存格無法使用或缺少欄位時載入失敗並列出問題"""
+    df = create_dirty_test_data(9).astype({'Pending Received': object})
+    df.loc[df.index[: len(df) * 3 // 4], 'Pending Received'] = 'n.a'
+    system = TransferRecommendationSystem()
+    success, message = system.load_and_preprocess_data(to_excel_bytes(df))
+    assert not success
+    assert "非數值 Pending Received" in message
+    assert system.df is None
+    error = report_row(system.validation_report, '非數值', 'Pending Received')
+    assert error['嚴重程度'] == VALIDATION_ERROR
+
+    success, message = system.load_and_preprocess_data(to_excel_bytes(df.drop(columns=['OM', 'MOQ'])))
+    assert not success
+    assert "缺少必需欄位: OM, MOQ" in message or "缺少必需欄位: MOQ, OM" in message
+    print(f"✅ 載入失敗: {message[:60]}...")
+
+if __name__ == "__main__":
+    test_report_counts_and_samples()
+    test_report_matches_preprocessing_flags()
+    test_bad_extract_fails_fast()
+    print("\n🎉 數據驗證報告測試完成")
@@ -0,0 +1,82 @@
+"""
+測試預先統計延後至背景計算，並經共用數據集快取於會話間重用
+"""
+import io
+from app import TransferRecommendationSystem, _DATASET_CACHE
+from test_preliminary_totals import create_totals_test_data
+
+def create_lazy_test_excel(seed):
+    """創建測試Excel文件內容"""
+    buffer = io.BytesIO()
+    create_totals_test_data(seed, n_rows=120).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def wait_for_preliminary(system, timeout=30):
+    """等待背景預先統計完成"""
+    system.start_preliminary_statistics()
+    system._preliminary_thread.join(timeout)
+    assert system.preliminary_stats_ready(), "背景預先統計未完成"
+
+def test_load_defers_preliminary_statistics():
+    """測試載入時不計算預先統計，背景計算後寫入共用快取"""
+    print("=" * 50)
+    print("⏳ 延後預先統計測試")
+    print("=" * 50)
+
+    _DATASET_CACHE.clear()
+    content = create_lazy_test_excel(11)
+
+    system = TransferRecommendationSystem()
+    success, message = system.load_and_preprocess_data(content)
+    assert success, message
+    assert not system.preliminary_stats_ready(), "載入時不應計算預先統計"
+    print("✅ 載入後可立即顯示預覽")
+
+    wait_for_preliminary(system)
+    expected = system.calculate_preliminary_statistics()
+    assert system.preliminary_stats == expected
+    print("✅ 背景計算完成")
+
+    # 另一會話載入相同文件時直接取得統計及特徵數據框
+    other = TransferRecommendationSystem()
+    success, message = other.load_and_preprocess_data(content)
+    assert success, message
+    assert other.df is system.df
+    assert other.preliminary_stats_ready()
+    assert other.preliminary_stats == expected
+    assert other.get_feature_frame() is system.get_feature_frame()
+    print("✅ 其他會話重用快取結果")
+
+def test_stale_preliminary_result_discarded():
+    """測試切換數據集後舊統計被清除"""
+    system = TransferRecommendationSystem()
+    system.df = create_totals_test_data(3)
+    wait_for_preliminary(system)
+    system._set_dataset(None, create_totals_test_data(4))
+    assert not system.preliminary_stats_ready()
+
+def test_candidates_use_article_max_sales():
+    """測試候選識別使用的最高銷量與逐產品篩選計算一致"""
+    system = TransferRecommendationSystem()
+    system.df = create_totals_test_data(7)
+    fast_results = {mode: system.identify_transfer_candidates(mode) for mode in ("A", "B")}
+    fast_receives = system.identify_receive_candidates()
+
+    # 以原有逐產品篩選方式計算最高銷量，替換特徵數據框後重新識別
+    reference = system.get_feature_frame().copy()
+    reference['Max_Sales'] = [
+        system.df[system.df['Article'] == article].apply(system.calculate_effective_sales, axis=1).max()
+        for article in system.df['Article']
+    ]
+    system._feature_frame = reference
+
+    for mode in ("A", "B"):
+        assert system.identify_transfer_candidates(mode) == fast_results[mode]
+    assert system.identify_receive_candidates() == fast_receives
+    print("✅ 候選識別結果一致")
+
+if __name__ == "__main__":
+    test_load_defers_preliminary_statistics()
+    test_stale_preliminary_result_discarded()
+    test_candidates_use_article_max_sales()
+    print("\n🎉 延後預先統計測試完成")
@@ -0,0 +1,130 @@
+"""
+測試記憶體分析模式：嵌套階段的峰值及淨增加，以及 載入 → 生成建議 → 匯出 各階段的分析報告
+"""
+import io
+import tracemalloc
+import memory_profile
+from app import TransferRecommendationSystem, _DATASET_CACHE
+from test_cumulative_allocation import create_matching_test_data
+from test_dataset_store import temporary_store
+from test_background_jobs import wait_for_jobs
+
+MB = 1024 * 1024
+
+def test_nested_stage_peaks():
+    """測試階段峰值包含已釋放的暫時分配，外層峰值包含內層峰值，並報告分配位置"""
+    print("=" * 50)
+    print("🔬 記憶體分析測試")
+    print("=" * 50)
+
+    profiler = memory_profile.MemoryProfiler()
+    try:
+        with profiler.stage("outer"):
+            kept = bytearray(2 * MB)
+            with profiler.stage("inner"):
+                temporary = bytearray(8 * MB)
+                del temporary
+    finally:
+        profiler.stop()
+    assert not tracemalloc.is_tracing()
+
+    report = profiler.report().set_index('Stage')
+    assert list(report.index) == ["outer", "inner"] and list(report['Depth']) == [0, 1]
+    assert 8 * MB <= report.loc['inner', 'Peak_Bytes'] < 9 * MB
+    assert abs(report.loc['inner', 'Net_Bytes']) < MB
+    assert 10 * MB <= report.loc['outer', 'Peak_Bytes'] < 11 * MB
+    assert 2 * MB <= report.loc['outer', 'Net_Bytes'] < 3 * MB
+    site, size, _ = report.loc['outer', 'Top_Sites'][0]
+    assert site.startswith("test_memory_profile.py:") and size >= 2 * MB
+    assert "outer" in profiler.format_report()
+    del kept
+    print("✅ 嵌套階段峰值正確")
+
+def test_pipeline_report():
+    """測試分析報告包含載入、生成建議及匯出的各子階段，且分析不改變結果"""
+    buffer = io.BytesIO()
+    create_matching_test_data(9, n_articles=40, n_sites=15).to_excel(buffer, index=False)
+    content = buffer.getvalue()
+
+    with temporary_store():
+        _DATASET_CACHE.clear()
+        system = TransferRecommendationSystem()
+        assert system.memory_profiler is None  # 預設停用
+        profiler, excel_data = memory_profile.profile_pipeline(system, content, "B")
+    assert not tracemalloc.is_tracing()
+
+    report = profiler.report()
+    stages = list(report['Stage'])
+    assert [stage for stage, depth in zip(stages, report['Depth']) if depth == 0] == ["load", "generate", "export"]
+    for stage in ("load.read_excel", "load.strings", "load.compact_dtypes", "generate.identify",
+                  "generate.match", "generate.statistics"):
+        assert stages.index(stage) > 0, stage
+    assert stages.index("load.read_excel") < stages.index("generate") < stages.index("generate.match")
+    top = report.set_index('Stage')
+    for stage in ("load", "generate"):
+        children = report[report['Stage'].str.startswith(f"{stage}.")]
+        assert top.loc[stage, 'Peak_Bytes'] >= children['Peak_Bytes'].max()
+    assert top.loc['load.read_excel', 'Top_Sites']
+
+    reference = TransferRecommendationSystem()
+    reference.df = system.df
+    assert reference.generate_recommendations("B")[0]
+    assert reference.transfer_suggestions == system.transfer_suggestions and excel_data
+
+    # 重新載入時清除先前的階段
+    system.load_and_preprocess_data(content)
+    profiler.stop()
+    assert list(profiler.report()['Stage']) == ["load"]
+    print(f"✅ 分析報告 {len(stages)} 個階段，匯出 {len(excel_data):,} bytes")
+
+def test_concurrent_jobs_keep_separate_records():
+    """測試並行的背景任務各自記錄階段並按模式標籤併入會話報告，不會互相嵌套"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(10, n_articles=60, n_sites=15)
+    system.memory_profiler = memory_profile.MemoryProfiler()
+    try:
+        jobs = wait_for_jobs([system.submit_recommendation_job(mode) for mode in ("A", "B")])
+    finally:
+        tracemalloc.stop()  # 追蹤由任務的分析器開始
+    assert all(job['status'] == "done" for job in jobs), jobs
+
+    report = system.memory_profiler.report()
+    for run in ("模式A", "模式B"):
+        rows = report[report['Run'] == run]
+        assert list(rows['Stage']) == ["generate", "generate.identify", "generate.conflicts",
+                                       "generate.match", "generate.statistics"], run
+        assert list(rows['Depth']) == [0, 1, 1, 1, 1]
+        assert rows['Peak_Bytes'].iloc[0] >= rows['Peak_Bytes'].iloc[1:].max()
+    print("✅ 並行任務的分析記錄按模式分開")
+
+def test_repeated_runs_replace_records():
+    """測試重複生成建議、匯出及背景任務時只保留各自最近一次的記錄，報告不會增長"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(11, n_articles=40, n_sites=15)
+    profiler = system.memory_profiler = memory_profile.MemoryProfiler(trace=False)
+
+    for _ in range(3):
+        assert system.generate_recommendations("A")[0]
+        assert system.export_to_excel()[0] is not None
+    report = profiler.report()
+    assert list(report.loc[report['Depth'] == 0, 'Stage']) == ["generate", "export"]
+    assert list(report['Stage']).count("generate.match") == 1
+    single_run = len(report)
+
+    try:
+        for _ in range(2):
+            assert all(job['status'] == "done" for job in wait_for_jobs([system.submit_recommendation_job("B")]))
+    finally:
+        tracemalloc.stop()  # 追蹤由任務的分析器開始
+    report = profiler.report()
+    job_stages = list(report.loc[report['Run'] == "模式B", 'Stage'])
+    assert job_stages == ["generate", "generate.identify", "generate.conflicts", "generate.match", "generate.statistics"]
+    assert len(report) == single_run + len(job_stages)
+    print(f"✅ 重複執行後報告保持 {len(report)} 個階段")
+
+if __name__ == "__main__":
+    test_nested_stage_peaks()
+    test_pipeline_report()
+    test_concurrent_jobs_keep_separate_records()
+    test_repeated_runs_replace_records()
+    print("\n🎉 記憶體分析測試完成")
@@ -0,0 +1,112 @@
+"""
+測試引擎指標：Prometheus文字格式、指標文件及HTTP匯出，以及載入、生成建議及匯出時記錄的指標
+"""
+import io
+import os
+import tempfile
+import urllib.request
+import metrics
+from app import TransferRecommendationSystem
+from test_cumulative_allocation import create_matching_test_data
+
+def test_text_exposition_format():
+    """測試計數器及直方圖的文字格式（累計區間、標籤轉義）"""
+    print("=" * 50)
+    print("📈 引擎指標測試")
+    print("=" * 50)
+
+    registry = metrics.Registry()
+    counter = registry.counter("test_rows_total", "測試行數", ["source"])
+    histogram = registry.histogram("test_seconds", "測試時間", buckets=(0.1, 1))
+    counter.inc(3, source='a"b')
+    counter.inc(2, source='a"b')
+    for value in (0.05, 0.5, 0.7, 5):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE test_rows_total counter" in lines
+    assert 'test_rows_total{source="a\\"b"} 5' in lines
+    assert "# TYPE test_seconds histogram" in lines
+    assert 'test_seconds_bucket{le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{le="1"} 3' in lines
+    assert 'test_seconds_bucket{le="+Inf"} 4' in lines
+    assert "test_seconds_sum 6.25" in lines and "test_seconds_count 4" in lines
+
+    for invalid in (lambda: counter.inc(-1, source="a"), lambda: counter.inc(1),
+                    lambda: registry.counter("test_rows_total", "重複")):
+        try:
+            invalid()
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("應拒絕無效的指標操作")
+    print("✅ 文字格式正確")
+
+def test_textfile_and_http_export():
+    """測試原子寫入指標文件及HTTP /metrics"""
+    registry = metrics.Registry()
+    registry.counter("test_exports_total", "測試").inc()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "nested", "engine.prom")
+        metrics.write_textfile(path, registry)
+        with open(path, encoding='utf-8') as file:
+            assert file.read() == registry.render()
+        assert os.listdir(os.path.dirname(path)) == ["engine.prom"]  # 沒有殘留臨時文件
+
+    server = metrics.serve(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+            assert response.read().decode('utf-8') == registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()
+    print("✅ 指標文件及HTTP匯出")
+
+def test_engine_records_metrics():
+    """測試載入、生成建議、模式比較及匯出時記錄的指標與結果一致"""
+    buffer = io.BytesIO()
+    create_matching_test_data(2, n_articles=30, n_sites=12).to_excel(buffer, index=False)
+    content = buffer.getvalue()
+    system = TransferRecommendationSystem()
+    before = {source: metrics.ROWS_LOADED.value(source=source) for source in ("parse", "disk", "memory")}
+    assert system.load_and_preprocess_data(content, consolidate_duplicates=False)[0]
+    assert TransferRecommendationSystem().load_and_preprocess_data(content, consolidate_duplicates=False)[0]
+    loaded = {source: metrics.ROWS_LOADED.value(source=source) - before[source] for source in before}
+    # 首次載入解析文件（或由其他測試寫入的磁碟快取讀取），第二次命中記憶體快取
+    assert loaded['parse'] + loaded['disk'] == len(system.df) and loaded['memory'] == len(system.df)
+
+    before = {'suggestions': metrics.SUGGESTIONS.value(mode="B"), 'conflicts': metrics.CONFLICTS.value(mode="B"),
+              'matches': metrics.MATCH_SECONDS.snapshot(mode="B")['count']}
+    assert system.generate_recommendations("B")[0]
+    assert metrics.SUGGESTIONS.value(mode="B") - before['suggestions'] == len(system.transfer_suggestions)
+    assert metrics.CONFLICTS.value(mode="B") - before['conflicts'] == len(system.statistics['conflicts'])
+    assert metrics.MATCH_SECONDS.snapshot(mode="B")['count'] == before['matches'] + 1
+
+    before = {mode: metrics.SUGGESTIONS.value(mode=mode) for mode in ("A", "B", "C")}
+    assert system.generate_comparison()[0]
+    for mode in ("A", "B", "C"):
+        assert metrics.SUGGESTIONS.value(mode=mode) - before[mode] == len(system.result_sets[mode]['suggestions'])
+
+    # 匯出指標只在實際生成報告時記錄，頁面重新執行沿用已生成的報告不重複計算
+    exports = metrics.EXPORT_BYTES.snapshot()
+    export_runs = metrics.EXPORT_SECONDS.snapshot()['count']
+    assert system.prepared_export() == (None, None)
+    excel_data, _ = system.prepare_export()
+    for _ in range(3):
+        assert system.prepared_export()[0] is excel_data and system.prepare_export()[0] is excel_data
+    assert metrics.EXPORT_BYTES.snapshot()['sum'] - exports['sum'] == len(excel_data)
+    assert metrics.EXPORT_BYTES.snapshot()['count'] == exports['count'] + 1
+    assert metrics.EXPORT_SECONDS.snapshot()['count'] == export_runs + 1
+
+    failures = metrics.LOAD_FAILURES.value()
+    assert not TransferRecommendationSystem().load_and_preprocess_data(b"not an excel file")[0]
+    assert metrics.LOAD_FAILURES.value() == failures + 1
+    print(f"✅ 引擎指標: 載入 {len(system.df)} 行，匯出 {len(excel_data):,} bytes")
+
+if __name__ == "__main__":
+    test_text_exposition_format()
+    test_textfile_and_http_export()
+    test_engine_records_metrics()
+    print("\n🎉 引擎指標測試完成")
@@ -0,0 +1,138 @@
+"""
+測試全部模式比較：共用候選識別後依次生成的結果與逐個模式生成一致，且比逐個生成便宜
+"""
+import time
+from app import TransferRecommendationSystem, MODE_LABELS, COMPARISON_MODE, _JOB_RUNNER, JOB_DONE, _ACTIVE_SYSTEMS
+from test_cumulative_allocation import create_matching_test_data
+from test_background_jobs import wait_for_jobs
+
+def test_comparison_matches_sequential_runs():
+    """測試比較結果與三次獨立生成完全一致"""
+    print("=" * 50)
+    print("⚖️ 全部模式比較測試")
+    print("=" * 50)
+
+    for seed in range(5):
+        df = create_matching_test_data(seed, n_articles=20, duplicate_rows=15)
+
+        sequential = TransferRecommendationSystem()
+        sequential.df = df
+        started = time.perf_counter()
+        expected = {}
+        for mode in MODE_LABELS:
+            success, message = sequential.generate_recommendations(mode)
+            assert success, message
+            expected[mode] = (sequential.transfer_suggestions, sequential.statistics)
+        sequential_seconds = time.perf_counter() - started
+
+        system = TransferRecommendationSystem()
+        system.df = df
+        started = time.perf_counter()
+        success, message = system.generate_comparison()
+        comparison_seconds = time.perf_counter() - started
+        assert success, message
+
+        for mode, (suggestions, statistics) in expected.items():
+            assert system.activate_result_set(mode)
+            assert system.transfer_suggestions == suggestions, f"seed={seed} mode={mode}"
+            assert system.statistics.get('total_qty') == statistics.get('total_qty')
+            assert system.statistics['conflicts'].equals(statistics['conflicts'])
+
+        summary = system.comparison['summary']
+        assert list(summary.index) == list(MODE_LABELS.values())
+        assert summary.loc[MODE_LABELS['A'], '建議數'] == len(expected['A'][0])
+        print(f"✅ seed={seed}: 逐個生成 {sequential_seconds:.3f} 秒，比較模式 {comparison_seconds:.3f} 秒")
+
+def best_seconds(func, repeat=3):
+    """重複執行取最短時間，減少偶發負載的影響"""
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - started)
+    return min(seconds)
+
+def test_comparison_cheaper_than_sequential_runs():
+    """測試共用候選識別後比較全部模式比逐個生成快"""
+    df = create_matching_test_data(5, n_articles=300, n_sites=40)
+    system = TransferRecommendationSystem()
+    system.df = df
+    system.get_feature_frame()
+
+    def sequential():
+        for mode in MODE_LABELS:
+            assert system.generate_recommendations(mode)[0]
+
+    sequential_seconds = best_seconds(sequential)
+    comparison_seconds = best_seconds(lambda: system.generate_comparison())
+    assert comparison_seconds < 0.9 * sequential_seconds, (comparison_seconds, sequential_seconds)
+    print(f"✅ {len(df)} 行: 逐個生成 {sequential_seconds:.3f} 秒，比較模式 {comparison_seconds:.3f} 秒")
+
+def test_comparison_progress_stages():
+    """測試比較任務的進度階段"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(1)
+    stages = []
+    success, _ = system.generate_comparison(progress_callback=lambda stage, done, total: stages.append(stage))
+    assert success
+    assert stages[0] == "識別轉出候選"
+    assert stages[-1] == "模式比較"
+
+def test_comparison_job():
+    """測試比較任務在背景執行並可取回"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(2)
+    system.dataset_key = "comparison-test"
+
+    job_id = system.submit_comparison_job()
+    wait_for_jobs([job_id])
+    job = _JOB_RUNNER.get(job_id)
+    assert job['status'] == JOB_DONE, job['error']
+    assert job['tags']['mode'] == COMPARISON_MODE
+
+    success, message = system.adopt_job_result(job_id)
+    assert success, message
+    assert set(system.result_sets) == set(MODE_LABELS)
+    assert system.mode == "A"
+    print(f"✅ 背景比較任務: {message}")
+
+def test_comparison_result_sets_pinned():
+    """測試會話記憶體預算不足時比較的各模式結果集仍全部保留，背景任務的工作實例不登記為活躍會話"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(3)
+    system.dataset_key = "comparison-budget-test"
+    system.session_memory_budget = 1
+    assert system.generate_comparison()[0]
+    assert list(system.comparison_bundle()['modes']) == list(MODE_LABELS)
+
+    # 工作實例的預算同為類別預設值；任務結果須包含全部模式
+    original_budget = TransferRecommendationSystem.session_memory_budget
+    TransferRecommendationSystem.session_memory_budget = 1
+    try:
+        job = wait_for_jobs([system.submit_comparison_job()])[0]
+    finally:
+        TransferRecommendationSystem.session_memory_budget = original_budget
+    assert job['status'] == JOB_DONE, job['error']
+    assert job['result']['modes'] == list(MODE_LABELS)
+
+    # 其後生成單一模式會淘汰其他模式，比較結果包不再完整時拋出錯誤
+    assert system.generate_recommendations("B")[0]
+    assert list(system.result_sets) == ["B"]
+    try:
+        system.comparison_bundle()
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError("不完整的比較結果包應拋出錯誤")
+
+    worker = system._worker_factory()()
+    assert worker not in _ACTIVE_SYSTEMS and system in _ACTIVE_SYSTEMS
+    print("✅ 比較結果集固定保留，工作實例不登記為會話")
+
+if __name__ == "__main__":
+    test_comparison_matches_sequential_runs()
+    test_comparison_cheaper_than_sequential_runs()
+    test_comparison_progress_stages()
+    test_comparison_job()
+    test_comparison_result_sets_pinned()
+    print("\n🎉 全部模式比較測試完成")
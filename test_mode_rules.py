@@ -0,0 +1,306 @@
+"""
+測試宣告式模式規則編譯後的候選識別與原逐行循環結果完全一致
+"""
+import app
+from app import TransferRecommendationSystem, MODE_RULES, MODE_LABELS
+from test_preliminary_totals import create_totals_test_data
+from test_cumulative_allocation import create_matching_test_data
+
+class LegacyCandidateSystem(TransferRecommendationSystem):
+    """保留原逐行循環候選識別實現（v1.73）作為參考"""
+
+    def legacy_identify_transfer_candidates(self, mode="A"):
+        """識別轉出候選"""
+        candidates = []
+        
+        for _, row in self.df.iterrows():
+            article = row['Article']
+            current_stock = row['SaSa Net Stock']
+            pending = row['Pending Received']
+            safety_stock = row['Safety Stock']
+            rp_type = row['RP Type']
+            effective_sales = self.calculate_effective_sales(row)
+            moq = row['MOQ']
+            
+            # 計算該產品的最高銷量
+            product_data = self.df[self.df['Article'] == article]
+            max_sales = product_data.apply(self.calculate_effective_sales, axis=1).max()
+            
+            # ND類型完全轉出 (優先順序1)
+            if rp_type == 'ND' and current_stock > 0:
+                # ND類型完全轉出，剩餘庫存為0
+                remaining_stock = 0
+                
+                candidates.append({
+                    'Article': article,
+                    'Site': row['Site'],
+                    'OM': row['OM'],
+                    'Transfer_Qty': current_stock,
+                    'Type': 'ND轉出',
+                    'Priority': 1,
+                    'Original_Stock': current_stock,
+                    'Safety_Stock': safety_stock,
+                    'MOQ': moq,
+                    'Effective_Sales': effective_sales,
+                    'Total_Available': current_stock + pending,
+                    'Remaining_Stock': remaining_stock  # 添加剩餘庫存信息
+                })
+            
+            # RF類型轉出 (優先順序2)
+            elif rp_type == 'RF' and effective_sales < max_sales:
+                total_available = current_stock + pending
+                
+                if mode == "A":  # 保守轉貨
+                    if total_available > safety_stock:
+                        base_transfer = total_available - safety_stock
+                        limit_transfer = max(int(total_available * 0.2), 2)
+                        actual_transfer = min(base_transfer, limit_transfer)
+                        actual_transfer = min(actual_transfer, current_stock)
+                        
+                        if actual_transfer > 0:
+                            # 計算轉出後剩餘庫存
+                            remaining_stock = current_stock - actual_transfer
+                            
+                            candidates.append({
+                                'Article': article,
+                                'Site': row['Site'],
+                                'OM': row['OM'],
+                                'Transfer_Qty': actual_transfer,
+                                'Type': 'RF過剩轉出',
+                                'Priority': 2,
+                                'Original_Stock': current_stock,
+                                'Safety_Stock': safety_stock,
+                                'MOQ': moq,
+                                'Effective_Sales': effective_sales,
+                                'Total_Available': total_available,
+                                'Remaining_Stock': remaining_stock  # 添加剩餘庫存信息
+                            })
+                            
+                elif mode == "B":  # 加強轉貨
+                    moq_threshold = moq + 1
+                    if total_available > moq_threshold:
+                        base_transfer = total_available - moq_threshold
+                        limit_transfer = max(int(total_available * 0.5), 2)
+                        actual_transfer = min(base_transfer, limit_transfer)
+                        actual_transfer = min(actual_transfer, current_stock)
+                        
+                        if actual_transfer > 0:
+                            # 計算轉出後剩餘庫存
+                            remaining_stock = current_stock - actual_transfer
+                            
+                            # 根據剩餘庫存與Safety stock關係確定轉出類型
+                            if remaining_stock >= safety_stock:
+                                transfer_type = 'RF過剩轉出'  # 剩餘庫存不會低於Safety stock
+                            else:
+                                transfer_type = 'RF加強轉出'  # 剩餘庫存會低於Safety stock
+                            
+                            candidates.append({
+                                'Article': article,
+                                'Site': row['Site'],
+                                'OM': row['OM'],
+                                'Transfer_Qty': actual_transfer,
+                                'Type': transfer_type,
+                                'Priority': 2,
+                                'Original_Stock': current_stock,
+                                'Safety_Stock': safety_stock,
+                                'MOQ': moq,
+                                'Effective_Sales': effective_sales,
+                                'Total_Available': total_available,
+                                'Remaining_Stock': remaining_stock  # 添加剩餘庫存信息
+                            })
+        
+        # 按有效銷量排序（低銷量優先轉出）
+        candidates.sort(key=lambda x: (x['Priority'], x['Effective_Sales']))
+        return candidates
+    
+    def legacy_identify_receive_candidates(self):
+        """識別接收候選 - v1.71 優化：添加SasaNet調撥接收條件"""
+        candidates = []
+        
+        for _, row in self.df.iterrows():
+            article = row['Article']
+            current_stock = row['SaSa Net Stock']
+            pending = row['Pending Received']
+            safety_stock = row['Safety Stock']
+            rp_type = row['RP Type']
+            effective_sales = self.calculate_effective_sales(row)
+            site = row['Site']
+            
+            if rp_type == 'RF':
+                # 計算該產品的最高銷量
+                product_data = self.df[self.df['Article'] == article]
+                max_sales = product_data.apply(self.calculate_effective_sales, axis=1).max()
+                
+                # 緊急缺貨補貨 (優先順序1)
+                if current_stock == 0 and effective_sales > 0:
+                    candidates.append({
+                        'Article': article,
+                        'Site': site,
+                        'OM': row['OM'],
+                        'Need_Qty': safety_stock,
+                        'Type': '緊急缺貨補貨',
+                        'Priority': 1,
+                        'Current_Stock': current_stock,
+                        'Safety_Stock': safety_stock,
+                        'Effective_Sales': effective_sales,
+                        'Pending_Received': pending,
+                        'Total_Available': current_stock + pending
+                    })
+                
+                # v1.71 新增：SasaNet 調撥接收條件 (優先順序2)
+                elif (current_stock + pending) < safety_stock and current_stock > 0:
+                    need_qty = safety_stock - (current_stock + pending)
+                    if need_qty > 0:
+                        candidates.append({
+                            'Article': article,
+                            'Site': site,
+                            'OM': row['OM'],
+                            'Need_Qty': need_qty,
+                            'Type': 'SasaNet調撥接收',
+                            'Priority': 2,
+                            'Current_Stock': current_stock,
+                            'Safety_Stock': safety_stock,
+                            'Effective_Sales': effective_sales,
+                            'Pending_Received': pending,
+                            'Total_Available': current_stock + pending
+                        })
+                
+                # 潛在缺貨補貨 (優先順序3)
+                elif (current_stock + pending) < safety_stock and effective_sales == max_sales:
+                    need_qty = safety_stock - (current_stock + pending)
+                    if need_qty > 0:
+                        candidates.append({
+                            'Article': article,
+                            'Site': site,
+                            'OM': row['OM'],
+                            'Need_Qty': need_qty,
+                            'Type': '潛在缺貨補貨',
+                            'Priority': 3,
+                            'Current_Stock': current_stock,
+                            'Safety_Stock': safety_stock,
+                            'Effective_Sales': effective_sales,
+                            'Pending_Received': pending,
+                            'Total_Available': current_stock + pending
+                        })
+        
+        # 按優先順序和銷量排序
+        candidates.sort(key=lambda x: (x['Priority'], -x['Effective_Sales']))
+        return candidates
+    
+    def legacy_identify_receive_candidates_mode_c(self):
+        """
+        識別接收候選 - C模式（重點補0）- v1.73
+        條件：(SaSa Net Stock + Pending Received) ≤ 1
+        補充至：min(Safety Stock, MOQ + 1)
+        """
+        candidates = []
+        
+        for _, row in self.df.iterrows():
+            article = row['Article']
+            current_stock = row['SaSa Net Stock']
+            pending = row['Pending Received']
+            safety_stock = row['Safety Stock']
+            rp_type = row['RP Type']
+            effective_sales = self.calculate_effective_sales(row)
+            site = row['Site']
+            moq = row['MOQ']
+            
+            # C模式只處理RF類型
+            if rp_type == 'RF':
+                total_available = current_stock + pending
+                
+                # C模式條件：總可用量 ≤ 1
+                if total_available <= 1:
+                    # 計算補充目標：取Safety Stock和MOQ+1的較小值
+                    target_stock = min(safety_stock, moq + 1)
+                    need_qty = target_stock - total_available
+                    
+                    if need_qty > 0:
+                        candidates.append({
+                            'Article': article,
+                            'Site': site,
+                            'OM': row['OM'],
+                            'Need_Qty': need_qty,
+                            'Type': '重點補0',
+                            'Priority': 1,  # C模式補0為最高優先級
+                            'Current_Stock': current_stock,
+                            'Safety_Stock': safety_stock,
+                            'Effective_Sales': effective_sales,
+                            'Pending_Received': pending,
+                            'Total_Available': total_available,
+                            'MOQ': moq,
+                            'Target_Stock': target_stock
+                        })
+        
+        # 按銷量排序（高銷量優先）
+        candidates.sort(key=lambda x: -x['Effective_Sales'])
+        return candidates
+
+def test_rules_match_legacy_loops():
+    """測試多組隨機數據下三種模式的候選記錄與原實現一致（含順序）"""
+    print("=" * 50)
+    print("📐 宣告式規則測試")
+    print("=" * 50)
+
+    total_candidates = 0
+    datasets = [create_totals_test_data(seed, n_rows=150) for seed in range(3)]
+    datasets += [create_matching_test_data(seed, duplicate_rows=10) for seed in range(3)]
+    for index, df in enumerate(datasets):
+        system = LegacyCandidateSystem()
+        system.df = df
+        shared = system.identify_transfer_candidates_for_modes(["A", "B", "C"])
+        for mode in ["A", "B", "C"]:
+            expected = system.legacy_identify_transfer_candidates(mode)
+            assert system.identify_transfer_candidates(mode) == expected, f"data={index} mode={mode}"
+            # 多模式共用掃描的候選與逐個模式識別一致（含數值類型）
+            assert shared[mode] == expected, f"data={index} mode={mode}"
+            assert [{key: type(value) for key, value in candidate.items()} for candidate in shared[mode]] == \
+                [{key: type(value) for key, value in candidate.items()} for candidate in expected]
+            total_candidates += len(expected)
+
+        expected = system.legacy_identify_receive_candidates()
+        assert system.identify_receive_candidates("A") == expected, f"data={index}"
+        assert system.identify_receive_candidates("B") == expected
+        expected_c = system.legacy_identify_receive_candidates_mode_c()
+        assert system.identify_receive_candidates_mode_c() == expected_c, f"data={index}"
+        total_candidates += len(expected) + len(expected_c)
+
+    print(f"✅ 6組數據 × 3模式一致，共 {total_candidates} 條候選")
+
+def test_new_mode_from_configuration():
+    """測試只以設定新增模式即可生成建議"""
+    MODE_RULES["D"] = {
+        'transfer': [
+            app.ND_TRANSFER_TIER,
+            {'type': 'RF過剩轉出', 'priority': 2,
+             'when': "Is_RF and Effective_Sales < Max_Sales and Total_Available > Safety + @buffer",
+             'qty': "Total_Available - Safety - @buffer",
+             'cap': {'pct': 0.3, 'min': 1},
+             'limit': "Stock",
+             'params': {'buffer': 1}}
+        ],
+        'receive': app.RECEIVE_TIERS,
+        'receive_sort': MODE_RULES["A"]['receive_sort']
+    }
+    try:
+        system = TransferRecommendationSystem()
+        system.df = create_totals_test_data(3)
+        success, message = system.generate_recommendations("D")
+        assert success, message
+        assert system.transfer_suggestions
+
+        candidates = system.identify_transfer_candidates("D")
+        rf = [candidate for candidate in candidates if candidate['Type'] == 'RF過剩轉出']
+        assert rf and all(candidate['Total_Available'] - candidate['Transfer_Qty'] >= candidate['Safety_Stock'] + 1
+                          for candidate in rf)
+        assert system._calculate_mode_statistics("D")['estimated_transfer'] == sum(
+            candidate['Transfer_Qty'] for candidate in candidates)
+        print(f"✅ 設定新增模式D: {message}")
+    finally:
+        del MODE_RULES["D"]
+    assert "D" not in MODE_LABELS
+
+if __name__ == "__main__":
+    test_rules_match_legacy_loops()
+    test_new_mode_from_configuration()
+    print("\n🎉 宣告式規則測試完成")
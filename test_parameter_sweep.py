@@ -0,0 +1,83 @@
+"""
+測試轉出限制參數掃描與按參數逐次識別候選的結果一致
+"""
+from app import TransferRecommendationSystem, MODE_RULES, sweep_tier
+from test_preliminary_totals import create_totals_test_data
+from test_cumulative_allocation import create_matching_test_data
+
+def candidate_transfer_total(system, mode, limit_pct, min_qty, moq_margin=None):
+    """以指定參數識別轉出候選並求和（參考結果）"""
+    transfer_tiers = MODE_RULES[mode]['transfer']
+    original = list(transfer_tiers)
+    tier = sweep_tier(mode)
+    patched = dict(tier, cap=dict(tier['cap'], pct=limit_pct, min=min_qty))
+    if moq_margin is not None:
+        patched['params'] = dict(tier['params'], moq_margin=moq_margin)
+    transfer_tiers[original.index(tier)] = patched
+    try:
+        return sum(candidate['Transfer_Qty'] for candidate in system.identify_transfer_candidates(mode))
+    finally:
+        transfer_tiers[:] = original
+
+def test_sweep_matches_candidate_identification():
+    """測試每個參數組合的預計轉出與候選識別求和一致"""
+    print("=" * 50)
+    print("🎛️ 轉出參數掃描測試")
+    print("=" * 50)
+
+    for seed in range(3):
+        system = TransferRecommendationSystem()
+        system.df = create_totals_test_data(seed)
+        for mode, margins in [("A", (0,)), ("B", (0, 1, 3))]:
+            sweep = system.sweep_transfer_parameters(mode, (0.1, 0.2, 0.5), (1, 2, 4), margins)
+            assert len(sweep) == 9 * len(margins)
+            for row in sweep.itertuples():
+                moq_margin = int(row.MOQ_Margin) if mode == "B" else None
+                expected = candidate_transfer_total(system, mode, row.Limit_Pct, row.Min_Qty, moq_margin)
+                assert row.Estimated_Transfer == expected, f"seed={seed} mode={mode} {row}"
+    print("✅ 3組數據 × 2模式參數網格一致")
+
+def test_sweep_current_rule_matches_statistics():
+    """測試現行參數的掃描結果與預先統計一致，且實際匹配件數不超過預計可匹配件數加上1→2件進位"""
+    system = TransferRecommendationSystem()
+    system.df = create_totals_test_data(5)
+    for mode in ("A", "B"):
+        tier = sweep_tier(mode)
+        margins = ((tier.get('params') or {}).get('moq_margin', 0),)
+        sweep = system.sweep_transfer_parameters(mode, (tier['cap']['pct'],), (tier['cap']['min'],), margins)
+        stats = system._calculate_mode_statistics(mode)
+        assert sweep.loc[0, 'Estimated_Transfer'] == stats['estimated_transfer']
+        assert sweep.loc[0, 'Estimated_Receive'] == stats['estimated_receive']
+
+        assert sweep.loc[0, 'Matched_Estimate'] <= min(stats['estimated_transfer'], stats['estimated_receive'])
+        system.generate_recommendations(mode)
+        assert system.statistics.get('total_qty', 0) <= \
+            sweep.loc[0, 'Matched_Estimate'] + len(system.transfer_suggestions)
+    print("✅ 現行參數與預先統計一致")
+
+def test_matched_estimate_is_not_a_bound():
+    """測試RF匹配把1件進位為2件時，實際匹配件數可高於預計可匹配件數（估算值而非上限）"""
+    system = TransferRecommendationSystem()
+    system.df = create_matching_test_data(52)
+    tier = sweep_tier("A")
+    sweep = system.sweep_transfer_parameters("A", (tier['cap']['pct'],), (tier['cap']['min'],))
+    assert system.generate_recommendations("A")[0]
+    total = system.statistics['total_qty']
+    assert total > sweep.loc[0, 'Matched_Estimate']
+    assert total <= sweep.loc[0, 'Matched_Estimate'] + len(system.transfer_suggestions)
+    print(f"✅ 預計可匹配 {sweep.loc[0, 'Matched_Estimate']} 件，實際匹配 {total} 件")
+
+def test_sweep_blocks_give_same_result():
+    """測試按參數組合分塊計算的結果不變"""
+    system = TransferRecommendationSystem()
+    system.df = create_totals_test_data(8)
+    full = system.sweep_transfer_parameters("B")
+    blocked = system.sweep_transfer_parameters("B", max_block_elements=1)
+    assert full.equals(blocked)
+
+if __name__ == "__main__":
+    test_sweep_matches_candidate_identification()
+    test_sweep_current_rule_matches_statistics()
+    test_matched_estimate_is_not_a_bound()
+    test_sweep_blocks_give_same_result()
+    print("\n🎉 轉出參數掃描測試完成")
@@ -0,0 +1,191 @@
+"""
+性能回歸測試：以固定種子的合成數據執行 載入 → 生成建議 → 匯出，按階段檢查時間及記憶體上限
+基準保存於 test_performance_baselines.json，上限為基準乘以容差（時間再按本機相對基準機器的速度調整）；
+逐行篩選數據框的固定開銷令階段時間超出上限；另以4倍數據量檢查生成建議的時間增長接近線性，
+逐筆掃描候選列表等 O(n²) 實現會即時失敗。
+
+更新基準（引擎有意改變性能時）：
+    python test_performance.py --update
+比較報告輸出到標準輸出；設定環境變數 TRANSFER_PERF_REPORT=路徑 時同時寫入該文件。
+"""
+import io
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import memory_profile
+from app import TransferRecommendationSystem, compact_dtypes, _DATASET_CACHE
+from test_dataset_store import temporary_store
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_performance_baselines.json")
+
+# 流程測試數據集（完整流程，含Excel解析及匯出）及生成建議增長測試數據集
+PIPELINE_DATASET = {'seed': 11, 'n_articles': 150, 'n_sites': 20, 'mode': "B"}
+SCALING_DATASET = {'seed': 12, 'n_articles': 300, 'n_sites': 30, 'mode': "B", 'factor': 4}
+
+# 上限 = 基準 × 容差 + 下限值（避免極短階段因計時誤差失敗）
+TIME_TOLERANCE = 2.5
+TIME_FLOOR = 0.05
+MEMORY_TOLERANCE = 1.25
+MEMORY_FLOOR = 512 * 1024
+# 數據量增加 factor 倍時生成建議時間最多增加 SCALING_SLACK × factor 倍（O(n²) 約為 factor² 倍）
+SCALING_SLACK = 2.0
+TIMING_REPEATS = 3
+
+def create_performance_data(seed, n_articles, n_sites):
+    """向量化生成合成數據（欄位及分佈與 create_matching_test_data 相同，不含重複行）"""
+    rng = np.random.default_rng(seed)
+    articles, sites = np.meshgrid(np.arange(n_articles), np.arange(n_sites), indexing='ij')
+    keep = rng.random(articles.size) >= 0.25
+    articles, sites = articles.ravel()[keep], sites.ravel()[keep]
+    n = len(articles)
+    return pd.DataFrame({
+        'Article': [f'M{a:04d}' for a in articles],
+        'Article Description': [f'產品{a}' for a in articles],
+        'RP Type': np.where(rng.random(n) < 0.15, 'ND', 'RF'),
+        'Site': [f'S{s:03d}' for s in sites],
+        'OM': [f'OM{v}' for v in (articles + sites) % 2],
+        'MOQ': rng.integers(0, 4, n),
+        'SaSa Net Stock': rng.choice([0, 0, 1, 2, 3, 5, 8, 13, 25], n),
+        'Pending Received': rng.integers(0, 3, n),
+        'Safety Stock': rng.integers(0, 12, n),
+        'Last Month Sold Qty': rng.integers(0, 10, n),
+        'MTD Sold Qty': rng.integers(0, 6, n),
+        'Notes': ''
+    })
+
+def reference_seconds():
+    """固定的參考工作量（pandas分組、排序及Python循環）的秒數，用於換算不同機器的速度"""
+    values = np.random.default_rng(0).integers(0, 1000, 200_000)
+    frame = pd.DataFrame({'key': values % 500, 'value': values})
+    best = float('inf')
+    for _ in range(TIMING_REPEATS):
+        start = time.perf_counter()
+        frame.groupby('key')['value'].sum()
+        sorted(values.tolist())
+        sum(int(value) for value in values[:50_000])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def _pipeline_content():
+    buffer = io.BytesIO()
+    dataset = PIPELINE_DATASET
+    create_performance_data(dataset['seed'], dataset['n_articles'], dataset['n_sites']).to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def _run_pipeline(content, trace):
+    """在臨時磁碟快取下執行完整流程（每次都解析文件），返回各階段報告"""
+    with temporary_store():
+        _DATASET_CACHE.clear()
+        profiler, _ = memory_profile.profile_pipeline(TransferRecommendationSystem(), content,
+                                                      PIPELINE_DATASET['mode'], trace=trace)
+    return profiler.report().set_index('Stage')
+
+def measure_pipeline():
+    """返回 {階段: {'seconds', 'peak_bytes'}}：時間為不追蹤記憶體時多次執行的最小值，記憶體為 tracemalloc 峰值"""
+    content = _pipeline_content()
+    seconds = None
+    for _ in range(TIMING_REPEATS):
+        report = _run_pipeline(content, trace=False)['Seconds']
+        seconds = report if seconds is None else np.minimum(seconds, report)
+    peaks = _run_pipeline(content, trace=True)['Peak_Bytes']
+    return {stage: {'seconds': float(seconds[stage]), 'peak_bytes': int(peaks[stage])} for stage in seconds.index}
+
+def measure_scaling():
+    """返回生成建議的時間增長倍數（數據量增加 factor 倍）"""
+    dataset = SCALING_DATASET
+    timings = []
+    for n_articles in (dataset['n_articles'], dataset['n_articles'] * dataset['factor']):
+        system = TransferRecommendationSystem()
+        system.df = compact_dtypes(create_performance_data(dataset['seed'], n_articles, dataset['n_sites']))[0]
+        best = float('inf')
+        for _ in range(TIMING_REPEATS):
+            system._feature_frame = system._feature_frame_source = None  # 每次重新建立特徵數據框
+            start = time.perf_counter()
+            assert system.generate_recommendations(dataset['mode'])[0]
+            best = min(best, time.perf_counter() - start)
+        timings.append(best)
+    return timings[1] / timings[0]
+
+def load_baselines():
+    with open(BASELINE_FILE, encoding='utf-8') as file:
+        return json.load(file)
+
+def update_baselines():
+    """重新量度並寫入基準文件"""
+    baselines = {
+        'reference_seconds': reference_seconds(),
+        'pipeline_dataset': PIPELINE_DATASET,
+        'scaling_dataset': SCALING_DATASET,
+        'stages': measure_pipeline(),
+        'scaling_ratio': measure_scaling()
+    }
+    with open(BASELINE_FILE, 'w', encoding='utf-8') as file:
+        json.dump(baselines, file, indent=4, ensure_ascii=False)
+        file.write("\n")
+    return baselines
+
+def comparison_report(measured, baselines, speed_factor):
+    """
+    比較量度結果與基準
+    返回數據框：Stage, Metric（seconds, peak_bytes）, Baseline, Measured, Ratio, Ceiling, Passed
+    """
+    rows = []
+    for stage, values in baselines['stages'].items():
+        current = measured.get(stage)
+        for metric, tolerance, floor, scale in (('seconds', TIME_TOLERANCE, TIME_FLOOR, speed_factor),
+                                                ('peak_bytes', MEMORY_TOLERANCE, MEMORY_FLOOR, 1.0)):
+            baseline = values[metric]
+            value = None if current is None else current[metric]
+            ceiling = baseline * tolerance * scale + floor
+            rows.append((stage, metric, baseline, value, None if value is None else value / max(baseline, 1e-9),
+                         ceiling, value is not None and value <= ceiling))
+    return pd.DataFrame(rows, columns=['Stage', 'Metric', 'Baseline', 'Measured', 'Ratio', 'Ceiling', 'Passed'])
+
+def _publish(report_text):
+    print(report_text)
+    path = os.environ.get("TRANSFER_PERF_REPORT")
+    if path:
+        with open(path, 'a', encoding='utf-8') as file:
+            file.write(report_text + "\n")
+
+def speed_factor(baselines):
+    """本機相對基準機器的速度（只放寬不收緊上限）"""
+    return max(1.0, reference_seconds() / baselines['reference_seconds'])
+
+def test_stage_ceilings():
+    """測試各階段的時間及記憶體不超出基準上限"""
+    print("=" * 50)
+    print("🏁 性能回歸測試")
+    print("=" * 50)
+
+    baselines = load_baselines()
+    assert baselines['pipeline_dataset'] == PIPELINE_DATASET, "數據集參數已改變，請執行 python test_performance.py --update"
+    factor = speed_factor(baselines)
+    report = comparison_report(measure_pipeline(), baselines, factor)
+    _publish(f"速度換算 ×{factor:.2f}\n" + report.to_string(index=False))
+    failed = report[~report['Passed']]
+    assert failed.empty, "超出性能上限:\n" + failed.to_string(index=False)
+    print(f"✅ {report['Stage'].nunique()} 個階段的時間及記憶體在上限內")
+
+def test_generation_scales_linearly():
+    """測試數據量增加4倍時生成建議的時間增長接近線性"""
+    baselines = load_baselines()
+    assert baselines['scaling_dataset'] == SCALING_DATASET, "數據集參數已改變，請執行 python test_performance.py --update"
+    ratio = measure_scaling()
+    limit = SCALING_SLACK * SCALING_DATASET['factor']
+    _publish(f"生成建議時間增長: 數據量 ×{SCALING_DATASET['factor']} → 時間 ×{ratio:.2f}"
+             f"（基準 ×{baselines['scaling_ratio']:.2f}，上限 ×{limit:.1f}）")
+    assert ratio <= limit, f"生成建議時間增長 ×{ratio:.2f} 超出上限 ×{limit:.1f}（可能引入了 O(n²) 的逐筆掃描）"
+    print("✅ 生成建議時間增長接近線性")
+
+if __name__ == "__main__":
+    if "--update" in sys.argv:
+        baselines = update_baselines()
+        print(f"✅ 已更新基準: {len(baselines['stages'])} 個階段，增長倍數 ×{baselines['scaling_ratio']:.2f}")
+    else:
+        test_stage_ceilings()
+        test_generation_scales_linearly()
+        print("\n🎉 性能回歸測試完成")
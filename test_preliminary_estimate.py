@@ -0,0 +1,79 @@
+"""
+測試預先統計抽樣估算：全部抽取時等於精確值，部分抽取時信賴區間覆蓋精確值
+"""
+import numpy as np
+from app import TransferRecommendationSystem, compact_dtypes, PRELIMINARY_STATS_KEYS
+from test_preliminary_totals import create_totals_test_data
+
+STAT_NAMES = ['estimated_transfer', 'estimated_receive', 'estimated_demand']
+
+def create_large_test_data(seed, n_rows=40000):
+    """創建多產品、多OM的測試數據（約數千個 (Article, OM) 組）"""
+    rng = np.random.default_rng(seed)
+    df = create_totals_test_data(seed, n_rows=n_rows)
+    df['Article'] = rng.choice([f'A{i:04d}' for i in range(800)], size=n_rows)
+    df['OM'] = rng.choice(['OM1', 'OM2', 'OM3', 'OM4', 'OM5'], size=n_rows, p=[0.4, 0.3, 0.15, 0.1, 0.05])
+    return compact_dtypes(df)[0]
+
+def load_system(df):
+    system = TransferRecommendationSystem()
+    system.df = df
+    return system
+
+def test_full_sample_is_exact():
+    """測試數據不多於樣本行數時估算等於精確值且沒有誤差範圍"""
+    print("=" * 50)
+    print("⚡ 預先統計抽樣估算測試")
+    print("=" * 50)
+
+    for seed in range(3):
+        system = load_system(create_totals_test_data(seed, n_rows=800))
+        estimate = system.estimate_preliminary_statistics()
+        exact = system.calculate_preliminary_statistics()
+        assert estimate['sample']['rows'] == 800
+        for key in PRELIMINARY_STATS_KEYS.values():
+            for name in STAT_NAMES:
+                assert estimate[key][name] == exact[key][name], f"seed={seed} {key} {name}"
+            assert estimate[key]['transfer_margin'] == estimate[key]['receive_margin'] == 0
+    print("✅ 全部抽取時等於精確值")
+
+def test_intervals_cover_exact_totals():
+    """測試部分抽取時樣本由完整 (Article, OM) 組組成，且95%信賴區間大致覆蓋精確值"""
+    df = create_large_test_data(0)
+    exact = load_system(df).calculate_preliminary_statistics()
+    covered = total = 0
+    for seed in range(20):
+        system = load_system(df)
+        estimate = system.estimate_preliminary_statistics(sample_rows=4000, seed=seed)
+        sample = estimate['sample']
+        assert sample['rows'] < len(df) // 5
+        assert sample['clusters'] < sample['total_clusters']
+        for key in PRELIMINARY_STATS_KEYS.values():
+            for name, margin in (('estimated_transfer', 'transfer_margin'), ('estimated_receive', 'receive_margin')):
+                assert estimate[key][margin] > 0
+                covered += abs(estimate[key][name] - exact[key][name]) <= estimate[key][margin]
+                total += 1
+    assert covered >= 0.85 * total, f"{covered}/{total}"
+    print(f"✅ 信賴區間覆蓋 {covered}/{total}")
+
+def test_estimate_independent_of_cached_features():
+    """測試已有完整特徵數據框時取樣本行的估算與只按樣本計算特徵的估算一致，並按數據框快取"""
+    df = create_large_test_data(1, n_rows=20000)
+    cold = load_system(df)
+    estimate = cold.estimate_preliminary_statistics(sample_rows=3000)
+    assert cold._feature_frame is None
+    assert cold.estimate_preliminary_statistics(sample_rows=3000) is estimate
+
+    warm = load_system(df)
+    warm.get_feature_frame()
+    assert warm.estimate_preliminary_statistics(sample_rows=3000) == estimate
+
+    warm.df = df.copy()
+    assert warm.estimate_preliminary_statistics(sample_rows=3000) is not estimate
+    print("✅ 樣本特徵與完整特徵數據框一致")
+
+if __name__ == "__main__":
+    test_full_sample_is_exact()
+    test_intervals_cover_exact_totals()
+    test_estimate_independent_of_cached_features()
+    print("\n🎉 預先統計抽樣估算測試完成")
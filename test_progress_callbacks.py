@@ -0,0 +1,88 @@
+"""
+測試候選識別和匹配過程的進度回報
+"""
+import logging
+import numpy as np
+import pandas as pd
+from app import (TransferRecommendationSystem, ProgressThrottle, RECOMMENDATION_STAGES,
+                 logging_progress_callback)
+
+def create_progress_test_data(n_articles=20, n_sites=15, seed=7):
+    """創建固定種子的測試數據"""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for a in range(n_articles):
+        for s in range(n_sites):
+            rows.append({
+                'Article': f'P{a:04d}',
+                'Article Description': f'產品{a}',
+                'RP Type': 'ND' if rng.random() < 0.1 else 'RF',
+                'Site': f'S{s:03d}',
+                'OM': f'OM{s % 3}',
+                'MOQ': int(rng.integers(1, 4)),
+                'SaSa Net Stock': int(rng.integers(0, 20)),
+                'Pending Received': int(rng.integers(0, 3)),
+                'Safety Stock': int(rng.integers(2, 10)),
+                'Last Month Sold Qty': int(rng.integers(0, 15)),
+                'MTD Sold Qty': int(rng.integers(0, 8)),
+                'Notes': ''
+            })
+    return pd.DataFrame(rows)
+
+def test_progress_reported_per_stage():
+    """測試各階段都有進度回報，且最後回報完成"""
+    print("=" * 50)
+    print("⏱️ 進度回報測試")
+    print("=" * 50)
+
+    system = TransferRecommendationSystem()
+    system.df = create_progress_test_data()
+    events = []
+    success, message = system.generate_recommendations("B", progress_callback=lambda *event: events.append(event))
+    assert success, message
+
+    stages = []
+    for stage, _, _ in events:
+        if not stages or stages[-1] != stage:
+            stages.append(stage)
+    assert stages == RECOMMENDATION_STAGES, stages
+
+    last_by_stage = {}
+    for stage, done, total in events:
+        last_by_stage[stage] = (done, total)
+    assert last_by_stage["識別轉出候選"] == (len(system.df), len(system.df))
+    assert last_by_stage["識別接收候選"] == (len(system.df), len(system.df))
+    print(f"✅ 共 {len(events)} 次回報: {' -> '.join(stages)}")
+
+    # 回報函數只在生成期間生效
+    assert system.progress_callback is None
+
+def test_progress_throttle():
+    """測試節流後的回報次數與總量無關"""
+    calls = []
+    throttle = ProgressThrottle(lambda *event: calls.append(event), "測試", 100000, min_interval=0)
+    for done in range(1, 100001):
+        throttle.update(done)
+    throttle.finish()
+    assert len(calls) <= 103
+    assert calls[0] == ("測試", 0, 100000) and calls[-1] == ("測試", 100000, 100000)
+
+    calls.clear()
+    throttle = ProgressThrottle(lambda *event: calls.append(event), "測試", 100000, min_interval=60)
+    for done in range(1, 100001):
+        throttle.update(done)
+    assert len(calls) == 1
+    print("✅ 節流回報正常")
+
+def test_logging_progress_callback(caplog):
+    """測試命令行日誌回報"""
+    logger = logging.getLogger("test_progress")
+    report = logging_progress_callback(logger)
+    with caplog.at_level(logging.INFO, logger="test_progress"):
+        report("識別轉出候選", 50, 200)
+    assert "識別轉出候選: 50/200 (25%)" in caplog.text
+
+if __name__ == "__main__":
+    test_progress_reported_per_stage()
+    test_progress_throttle()
+    print("\n🎉 進度回報測試完成")
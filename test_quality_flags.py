@@ -0,0 +1,97 @@
+"""
+測試數據質量位元標記：按需生成的備註與原逐欄字串拼接一致，並可向量化統計各類修正
+"""
+import io
+import numpy as np
+import pandas as pd
+from app import (TransferRecommendationSystem, QUALITY_FLAGS_COLUMN, QUALITY_ISSUES,
+                 render_quality_notes, quality_summary)
+from test_cumulative_allocation import create_matching_test_data
+
+def create_dirty_test_data(seed, n_rows=400):
+    """創建含負值、異常銷量及無效RP Type的測試數據"""
+    rng = np.random.default_rng(seed)
+    df = create_matching_test_data(seed, duplicate_rows=0).drop(columns='Notes')
+    df = df.sample(n=n_rows, replace=True, random_state=seed).reset_index(drop=True)
+    for column in ['MOQ', 'SaSa Net Stock', 'Pending Received', 'Safety Stock']:
+        df.loc[rng.random(n_rows) < 0.05, column] = -rng.integers(1, 5)
+    for column in ['Last Month Sold Qty', 'MTD Sold Qty']:
+        df.loc[rng.random(n_rows) < 0.05, column] = -1
+        df.loc[rng.random(n_rows) < 0.05, column] = 250000
+    df.loc[rng.random(n_rows) < 0.05, 'RP Type'] = 'XX'
+    return df
+
+def legacy_notes(raw):
+    """原預處理逐欄拼接備註字串（參考結果）"""
+    df = raw.copy()
+    df['Notes'] = ""
+    for col in ['MOQ', 'SaSa Net Stock', 'Pending Received', 'Safety Stock', 'Last Month Sold Qty', 'MTD Sold Qty']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+        mask_negative = df[col] < 0
+        if mask_negative.any():
+            df.loc[mask_negative, 'Notes'] += f"{col}負值修正為0; "
+            df.loc[mask_negative, col] = 0
+        if 'Sold Qty' in col:
+            mask_extreme = df[col] > 100000
+            if mask_extreme.any():
+                df.loc[mask_extreme, 'Notes'] += f"{col}異常值>100000修正; "
+                df.loc[mask_extreme, col] = 100000
+    invalid_rp_mask = ~df['RP Type'].isin(['ND', 'RF'])
+    if invalid_rp_mask.any():
+        df.loc[invalid_rp_mask, 'Notes'] += "RP Type無效值; "
+    return df['Notes'].tolist()
+
+def load_system(raw):
+    """以Excel內容載入數據（不合併重複行，逐行比較備註）"""
+    buffer = io.BytesIO()
+    raw.to_excel(buffer, index=False)
+    system = TransferRecommendationSystem()
+    success, message = system.load_and_preprocess_data(buffer.getvalue(), consolidate_duplicates=False)
+    assert success, message
+    return system
+
+def test_flags_render_legacy_notes():
+    """測試按標記生成的備註與原備註字串完全一致"""
+    print("=" * 50)
+    print("🧹 數據質量位元標記測試")
+    print("=" * 50)
+
+    for seed in range(3):
+        raw = create_dirty_test_data(seed)
+        system = load_system(raw)
+        assert 'Notes' not in system.df.columns
+        assert system.df[QUALITY_FLAGS_COLUMN].dtype == np.uint16
+
+        expected = legacy_notes(raw)
+        assert list(render_quality_notes(system.df[QUALITY_FLAGS_COLUMN])) == expected, f"seed={seed}"
+        assert system.with_quality_notes(system.df.head(10))['Notes'].tolist() == expected[:10]
+
+        summary = system.get_quality_summary().set_index('修正類型')['行數']
+        for issue in QUALITY_ISSUES:
+            count = sum(f"{issue}; " in note for note in expected)
+            assert summary.get(issue, 0) == count, f"seed={seed} {issue}"
+        assert len(system.get_quality_rows()) == sum(bool(note) for note in expected)
+    print("✅ 3組數據備註及分類統計一致")
+
+def test_flagged_rows_exported():
+    """測試匯出時附加數據修正工作表"""
+    system = load_system(create_dirty_test_data(5))
+    for mode in ("A", "B", "C"):
+        if system.generate_recommendations(mode)[0]:
+            break
+    excel_data, filename = system.export_to_excel()
+    assert excel_data, filename
+    exported = pd.read_excel(io.BytesIO(excel_data), sheet_name='數據修正')
+    assert exported['Notes'].tolist() == system.get_quality_rows()['Notes'].tolist()
+    print(f"✅ 匯出數據修正工作表: {len(exported)} 行")
+
+def test_clean_data_has_no_flags():
+    """測試沒有修正時統計為空"""
+    assert quality_summary(np.zeros(5, dtype=np.uint16)).empty
+    assert list(render_quality_notes(np.zeros(3, dtype=np.uint16))) == ["", "", ""]
+
+if __name__ == "__main__":
+    test_flags_render_legacy_notes()
+    test_flagged_rows_exported()
+    test_clean_data_has_no_flags()
+    print("\n🎉 數據質量位元標記測試完成")
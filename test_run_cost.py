@@ -0,0 +1,97 @@
+"""
+測試執行成本估算：工作量指標與候選記錄逐筆統計一致，成本表及常數校準的格式
+"""
+import numpy as np
+from app import TransferRecommendationSystem, MODE_RULES, compact_dtypes
+import run_cost
+from test_cumulative_allocation import create_matching_test_data
+
+def load_system(seed, n_articles=30, n_sites=12):
+    system = TransferRecommendationSystem()
+    system.df = compact_dtypes(create_matching_test_data(seed, n_articles=n_articles, n_sites=n_sites))[0]
+    return system
+
+def candidate_shape(system, mode):
+    """按候選記錄逐筆統計工作量指標（參考結果）"""
+    transfers = system.identify_transfer_candidates(mode)
+    receives = system.identify_receive_candidates(mode)
+    receive_by_group, transfer_by_group, nd_by_group = {}, {}, {}
+    for receive in receives:
+        key = (receive['Article'], receive['OM'])
+        receive_by_group[key] = receive_by_group.get(key, 0) + 1
+    rf_items_by_site, rf_groups_by_site = {}, {}
+    for transfer in transfers:
+        key = (transfer['Article'], transfer['OM'])
+        transfer_by_group[key] = transfer_by_group.get(key, 0) + 1
+        if transfer['Type'] == 'ND轉出':
+            nd_by_group[key] = nd_by_group.get(key, 0) + 1
+        else:
+            rf_items_by_site[transfer['Site']] = rf_items_by_site.get(transfer['Site'], 0) + 1
+            rf_groups_by_site.setdefault(transfer['Site'], set()).add(key)
+    return {
+        'candidates': len(transfers) + len(receives),
+        'pairs': sum(count + receive_by_group[key] - 1 for key, count in transfer_by_group.items()
+                     if key in receive_by_group),
+        'nd_scan': sum(count * receive_by_group.get(key, 0) for key, count in nd_by_group.items()),
+        'rf_scan': sum(items * sum(receive_by_group.get(key, 0) for key in rf_groups_by_site[site])
+                       for site, items in rf_items_by_site.items())
+    }
+
+def test_shape_matches_candidates():
+    """測試工作量指標與候選記錄逐筆統計一致"""
+    print("=" * 50)
+    print("⏱️ 執行成本估算測試")
+    print("=" * 50)
+
+    for seed in range(4):
+        system = load_system(seed)
+        for mode in MODE_RULES:
+            shape = system.run_shape(mode)
+            assert set(shape) == set(run_cost.SHAPE_TERMS)
+            expected = candidate_shape(system, mode)
+            for term, value in expected.items():
+                assert shape[term] == value, f"seed={seed} mode={mode} {term}"
+            assert 0 <= shape['rf_unmet_scan'] <= shape['rf_scan']
+            assert system.generate_recommendations(mode)[0]
+            assert len(system.transfer_suggestions) <= shape['pairs']
+    print("✅ 4組數據 × 3模式工作量指標一致")
+
+def test_predicted_cost_table():
+    """測試成本表每個範圍建議一種執行方式，且工作量增加時預計時間及記憶體增加"""
+    system = load_system(5)
+    cost = system.estimate_run_cost("B")
+    assert list(cost['Engine']) == ['reference', 'vectorized', 'vectorized', 'comparison']
+    assert list(cost['Scope']) == [run_cost.SINGLE_MODE] * 2 + [run_cost.ALL_MODES] * 2
+    assert cost.groupby('Scope')['Recommended'].sum().tolist() == [1, 1]
+    assert (cost['Seconds'] > 0).all() and (cost['Peak_Bytes'] > 0).all()
+
+    shapes = {mode: system.run_shape(mode) for mode in MODE_RULES}
+    doubled = {mode: {term: 2 * value for term, value in shape.items()} for mode, shape in shapes.items()}
+    larger = run_cost.predict_run_cost(doubled, "B")
+    np.testing.assert_allclose(larger['Seconds'], 2 * cost['Seconds'])
+    assert (larger['Peak_Bytes'] >= 2 * cost['Peak_Bytes'] - 1).all()
+
+    # 指標為階段名稱時以該階段的預計秒數為工作量
+    costs = {'a': {'rows': 2.0}, 'b': {'a': 0.5, 'pairs': 1.0}}
+    assert run_cost.stage_seconds('b', {'rows': 3, 'pairs': 4}, costs) == 7.0
+    print(f"✅ 成本表: 單一模式建議 {cost.loc[cost['Recommended'], 'Engine'].iloc[0]}")
+
+def test_calibration_fits_nonnegative_constants():
+    """測試非負擬合及校準結果的格式"""
+    X = np.array([[1, 2], [2, 1], [3, 5], [4, 3]], dtype=float)
+    np.testing.assert_allclose(run_cost.fit_nonnegative(X, X @ [0.5, 2.0]), [0.5, 2.0])
+    assert (run_cost.fit_nonnegative(X, X @ [-1.0, 3.0]) >= 0).all()
+
+    calibrated = run_cost.calibrate_stage_costs(load_system(6, n_articles=60, n_sites=20), fractions=(0.5, 1.0))
+    assert {stage: set(terms) for stage, terms in calibrated['stage_costs'].items()} == \
+        {stage: set(terms) for stage, terms in run_cost.STAGE_COSTS.items()}
+    assert all(value >= 0 for terms in calibrated['stage_costs'].values() for value in terms.values())
+    assert calibrated['record_bytes']['candidate'] > 0
+    assert 0 <= calibrated['shared_identify_fraction'] <= 1
+    print("✅ 常數校準完成")
+
+if __name__ == "__main__":
+    test_shape_matches_candidates()
+    test_predicted_cost_table()
+    test_calibration_fits_nonnegative_constants()
+    print("\n🎉 執行成本估算測試完成")
@@ -0,0 +1,100 @@
+"""
+測試跨會話數據集快取與會話結果集記憶體預算
+"""
+import io
+import pandas as pd
+import app
+from app import TransferRecommendationSystem
+
+def create_excel_bytes():
+    """創建測試Excel文件內容"""
+    df = pd.DataFrame({
+        'Article': ['A001'] * 4,
+        'Article Description': ['產品1'] * 4,
+        'RP Type': ['ND', 'RF', 'RF', 'RF'],
+        'Site': ['S001', 'S002', 'S003', 'S004'],
+        'OM': ['OM1'] * 4,
+        'MOQ': [2, 2, 2, 2],
+        'SaSa Net Stock': [10, 0, 20, 1],
+        'Pending Received': [0, 0, 0, 0],
+        'Safety Stock': [5, 6, 4, 6],
+        'Last Month Sold Qty': [1, 9, 2, 3],
+        'MTD Sold Qty': [0, 0, 0, 0]
+    })
+    buffer = io.BytesIO()
+    df.to_excel(buffer, index=False)
+    return buffer.getvalue()
+
+def test_shared_dataset_cache():
+    """測試相同文件內容在會話間共用預處理結果"""
+    print("=" * 50)
+    print("🧠 會話記憶體測試")
+    print("=" * 50)
+
+    app._DATASET_CACHE.clear()
+    content = create_excel_bytes()
+
+    session_1 = TransferRecommendationSystem()
+    session_2 = TransferRecommendationSystem()
+    success, message = session_1.load_and_preprocess_data(io.BytesIO(content))
+    assert success, message
+    success, message = session_2.load_and_preprocess_data(io.BytesIO(content))
+    assert success, message
+
+    assert session_1.df is session_2.df, "相同內容應共用同一個數據框"
+    assert session_1.preliminary_stats == session_2.preliminary_stats
+    assert app.dataset_cache_usage()[0] == 1
+    assert session_2.memory_usage()['dataset_shared']
+    print("✅ 相同文件只預處理一次")
+
+    # 顯示記憶體使用不改變共用快取的淘汰順序
+    app._DATASET_CACHE['other'] = app._dataset_cache_entry(session_1.df.head(1))
+    order = list(app._DATASET_CACHE)
+    session_1.memory_usage()
+    assert list(app._DATASET_CACHE) == order
+    del app._DATASET_CACHE['other']
+
+    # 上傳鍵值按內容雜湊：同大小的不同內容不會被視為已載入
+    other = bytearray(content)
+    other[-1] ^= 1
+    assert len(other) == len(content)
+    assert app.dataset_cache_key(content) == session_1.dataset_key
+    assert app.dataset_cache_key(bytes(other)) != app.dataset_cache_key(content)
+    assert app.dataset_cache_key(content, False) != app.dataset_cache_key(content, True)
+
+def test_result_set_lru_budget():
+    """測試結果集超出預算時淘汰最久未使用的模式"""
+    system = TransferRecommendationSystem()
+    system.load_and_preprocess_data(io.BytesIO(create_excel_bytes()))
+
+    for mode in ["A", "B", "C"]:
+        success, message = system.generate_recommendations(mode)
+        assert success, message
+    assert list(system.result_sets.keys()) == ["A", "B", "C"]
+
+    # 切換回A模式時不需重新計算
+    assert system.activate_result_set("A")
+    assert system.mode == "A"
+    assert system.transfer_suggestions is system.result_sets["A"]['suggestions']
+
+    # 將預算設為只容納一個結果集
+    system.session_memory_budget = max(item['nbytes'] for item in system.result_sets.values())
+    system.generate_recommendations("B")
+    assert list(system.result_sets.keys()) == ["B"]
+    assert not system.activate_result_set("C")
+    print(f"✅ LRU淘汰後保留: {list(system.result_sets.keys())}")
+
+    usage = system.memory_usage()
+    assert usage['results_bytes'] > 0
+    assert usage in app.active_sessions_memory()
+
+    # 數據集及表格的大小在建立時計算並沿用
+    assert usage['dataset_bytes'] == app._DATASET_CACHE[system.dataset_key]['nbytes'] > 0
+    view = system._get_suggestion_view()
+    assert system.memory_usage()['view_bytes'] == int(view['frame'].memory_usage(deep=True).sum()) > 0
+    print("✅ 記憶體使用報告沿用已計算的大小")
+
+if __name__ == "__main__":
+    test_shared_dataset_cache()
+    test_result_set_lru_budget()
+    print("\n🎉 會話記憶體測試完成")
@@ -0,0 +1,75 @@
+"""
+測試調貨建議表格的伺服器端篩選、排序和分頁
+"""
+import pandas as pd
+from app import TransferRecommendationSystem
+
+def create_table_test_suggestions():
+    """創建測試用調貨建議"""
+    suggestions = []
+    for i in range(250):
+        transfer_type = 'ND轉出' if i % 3 == 0 else 'RF過剩轉出'
+        receive_type = '緊急缺貨補貨' if i % 2 == 0 else '潛在缺貨補貨'
+        suggestions.append({
+            'Article': f'A{i % 7:03d}',
+            'OM': f'OM{i % 3}',
+            'Transfer_Site': f'S{i % 11:03d}',
+            'Receive_Site': f'S{(i + 5) % 13:03d}',
+            'Transfer_Qty': (i * 37) % 17 + 1,
+            'Transfer_Type': transfer_type,
+            'Receive_Type': receive_type,
+            'Original_Stock': 20,
+            'After_Transfer_Stock': 20 - ((i * 37) % 17 + 1),
+            'Safety_Stock': 5,
+            'MOQ': 2,
+            'Notes': f"{transfer_type} -> {receive_type}"
+        })
+    return suggestions
+
+def test_suggestion_query():
+    """測試篩選結果與pandas布林篩選一致"""
+    print("=" * 50)
+    print("📋 調貨建議分頁表格測試")
+    print("=" * 50)
+
+    system = TransferRecommendationSystem()
+    system.transfer_suggestions = create_table_test_suggestions()
+    frame = pd.DataFrame(system.transfer_suggestions)
+
+    # 無篩選：返回第一頁
+    page_df, total = system.query_suggestions(page=1, page_size=100)
+    assert total == 250 and len(page_df) == 100
+    page_df, _ = system.query_suggestions(page=3, page_size=100)
+    assert len(page_df) == 50
+    print("✅ 分頁正確")
+
+    # 多條件篩選
+    filters = {'OM': ['OM1'], 'Site': ['S003', 'S004'], 'Type': ['ND轉出']}
+    expected = frame[
+        (frame['OM'] == 'OM1') &
+        (frame['Transfer_Site'].isin(filters['Site']) | frame['Receive_Site'].isin(filters['Site'])) &
+        ((frame['Transfer_Type'] == 'ND轉出') | (frame['Receive_Type'] == 'ND轉出'))
+    ]
+    page_df, total = system.query_suggestions(filters, page_size=1000)
+    assert total == len(expected) == system.count_suggestions(filters)
+    assert sorted(page_df.index) == sorted(expected.index)
+    print(f"✅ 多條件篩選: {total} 筆")
+
+    # 伺服器端排序
+    page_df, _ = system.query_suggestions({'Article': ['A002']}, sort_by='Transfer_Qty',
+                                          ascending=False, page_size=1000)
+    assert list(page_df['Transfer_Qty']) == sorted(page_df['Transfer_Qty'], reverse=True)
+    assert set(page_df['Article']) == {'A002'}
+    print("✅ 排序正確")
+
+    # 不存在的值
+    _, total = system.query_suggestions({'Article': ['NOPE']})
+    assert total == 0
+    print("✅ 無匹配時返回空結果")
+
+    options = system.get_suggestion_filter_options()
+    assert options['OM'] == ['OM0', 'OM1', 'OM2']
+
+if __name__ == "__main__":
+    test_suggestion_query()
+    print("\n🎉 分頁表格測試完成")
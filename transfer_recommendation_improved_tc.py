@@ -9,12 +9,65 @@
     python transfer_recommendation_improved_tc.py ELE_15Sep2025.xlsx
 """
 
+import logging
+import numpy as np
 import pandas as pd
 import sys
 import os
 import warnings
+import engine_log
+import rule_engine
 warnings.filterwarnings('ignore')
 
+logger = engine_log.get_logger("improved_tc")
+
+# 輸出欄位（ND缺貨補充沒有轉出上限）
+ND_OUTPUT_COLUMNS = ['優先級', '類型', '產品編號', '調出店鋪', '調入店鋪', '調貨數量',
+                     '調出店庫存', '調入店庫存', '轉出方法', '原因']
+RF_OUTPUT_COLUMNS = ['優先級', '類型', '產品編號', '調出店鋪', '調入店鋪', '調貨數量',
+                     '調出店庫存', '調入店庫存', '轉出上限', '轉出方法', '原因']
+
+# 保留庫存：ND缺貨補至2件；RF庫存高於2件為過剩，2件或以下為缺貨，補至3件
+ND_TARGET_STOCK = 2
+RF_SURPLUS_KEEP = 2
+RF_TARGET_STOCK = 3
+
+# 階梯式轉出限制（rule_engine 層級設定）：可轉出量 = min(過剩, max(總可用量 × 比例, 最少件數))
+SURPLUS_TIERS = [
+    {'type': '小庫存30%規則', 'priority': 1,
+     'when': "Stock <= 10",
+     'qty': "Stock - @keep",
+     'cap': {'pct': 0.3, 'min': 1, 'truncate': False},
+     'params': {'keep': RF_SURPLUS_KEEP}},
+    {'type': '大庫存20%規則', 'priority': 2,
+     'when': "Stock > 10",
+     'qty': "Stock - @keep",
+     'cap': {'pct': 0.2, 'min': 2, 'truncate': False},
+     'params': {'keep': RF_SURPLUS_KEEP}}
+]
+
+def _format_qty(value):
+    """格式化件數：整數不顯示小數"""
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+def _cumulative_fill(group, size, capacity):
+    """
+    單邊累計區間分配
+    每組按順序以 capacity[組] 依次填滿各項目的 size，項目分配量為
+    clip(組容量 - 組內之前項目的累計量, 0, size)；返回 (分配量, 分配前的剩餘容量)
+    group 須按組排列（同組項目相鄰）
+    """
+    size = np.asarray(size, dtype=np.float64)
+    cumulative = pd.Series(size).groupby(group, sort=False).cumsum().to_numpy()
+    remaining_before = capacity - (cumulative - size)
+    return np.clip(remaining_before, 0, size), remaining_before
+
+def _cross_pairs(left, right):
+    """同產品、不同店鋪的行配對，按左方行順序再按右方行順序排列"""
+    pairs = left.merge(right, on='Article_Code', suffixes=('_l', '_r'))
+    pairs = pairs[pairs['Shop_l'].to_numpy() != pairs['Shop_r'].to_numpy()]
+    return pairs.sort_values(['Row_l', 'Row_r'], kind='stable').reset_index(drop=True)
+
 def improved_process_data_tc(df):
     """
     改進的調貨建議處理函數（繁體中文版）
@@ -23,101 +76,111 @@ def improved_process_data_tc(df):
     1. 階梯式轉出限制 - 小庫存店鋪允許更高比例轉出
     2. 降低最小轉出量從2件到1件
     3. 動態計算轉出上限
+    
+    以產品編碼一次分組配對，並以累計區間分配取代逐行循環：
+    每個ND缺貨店依次由同產品其他店鋪的RF過剩量補充（過剩量不因其他ND店扣減），
+    每個RF過剩店按轉出上限依次補充同產品其他店鋪的RF缺貨（缺貨量不因其他過剩店扣減）
     """
+    article_code, articles = pd.factorize(df['Article'], sort=False)
+    frame = pd.DataFrame({
+        'Article_Code': article_code,
+        'Row': np.arange(len(df)),
+        'Shop': df['Shop'].to_numpy(),
+        'Stock': df['SaSa Net Stock'].to_numpy(),
+        'Total_Available': (df['SaSa Net Stock'] + df['Pending Received']).to_numpy(),
+        'RP_Type': df['RP Type'].to_numpy()
+    })
+    frame = frame[frame['Article_Code'] >= 0]  # 產品編號缺失的行不參與
+    is_nd = frame['RP_Type'].to_numpy() == 'ND'
+    is_rf = frame['RP_Type'].to_numpy() == 'RF'
+    
+    nd_shortage = frame[is_nd & (frame['Stock'].to_numpy() <= 0)]
+    rf_surplus = frame[is_rf & (frame['Stock'].to_numpy() > RF_SURPLUS_KEEP)]
+    rf_shortage = frame[is_rf & (frame['Stock'].to_numpy() <= RF_SURPLUS_KEEP)]
+    
+    # 轉出上限按階梯規則計算
+    tier_index, max_transfer, _ = rule_engine.evaluate_tiers(rf_surplus, SURPLUS_TIERS)
+    surplus_total = rf_surplus['Total_Available'].to_numpy()
+    cap_pct = np.array([tier['cap']['pct'] for tier in SURPLUS_TIERS])[tier_index]
+    cap_min = np.array([tier['cap']['min'] for tier in SURPLUS_TIERS])[tier_index]
+    rf_surplus = rf_surplus.assign(
+        Excess=rf_surplus['Stock'].to_numpy() - RF_SURPLUS_KEEP,
+        Cap=np.maximum(surplus_total * cap_pct, cap_min),
+        Max_Transfer=max_transfer,
+        Method=np.array([tier['type'] for tier in SURPLUS_TIERS], dtype=object)[tier_index]
+    )
+    
+    # Priority 1: ND缺貨補充 - 每個ND缺貨店為一組，依次由RF過剩店補充
+    donor_columns = ['Article_Code', 'Row', 'Shop', 'Stock', 'Excess']
+    nd_pairs = _cross_pairs(nd_shortage[['Article_Code', 'Row', 'Shop', 'Stock']], rf_surplus[donor_columns])
+    shortage = ND_TARGET_STOCK - nd_pairs['Stock_l'].to_numpy()
+    nd_qty, shortage_before = _cumulative_fill(nd_pairs['Row_l'].to_numpy(), nd_pairs['Excess'].to_numpy(), shortage)
+    nd_keep = nd_qty >= 1  # 降低最小轉出量到1件
+    nd_pairs, nd_qty, shortage_before = nd_pairs[nd_keep], nd_qty[nd_keep], shortage_before[nd_keep]
+    nd_result = pd.DataFrame({
+        '優先級': 1,
+        '類型': 'ND缺貨補充',
+        '產品編號': articles[nd_pairs['Article_Code'].to_numpy()],
+        '調出店鋪': nd_pairs['Shop_r'].to_numpy(),
+        '調入店鋪': nd_pairs['Shop_l'].to_numpy(),
+        '調貨數量': nd_qty.astype(np.int64),
+        '調出店庫存': nd_pairs['Stock_r'].to_numpy(),
+        '調入店庫存': nd_pairs['Stock_l'].to_numpy(),
+        '轉出方法': '原規則',
+        '原因': [f'ND缺貨{_format_qty(before)}件，調入{_format_qty(qty)}件'
+                 for before, qty in zip(shortage_before, nd_qty)],
+        '_Article': nd_pairs['Article_Code'].to_numpy(),
+        '_Priority': 1,
+        '_Row_l': nd_pairs['Row_l'].to_numpy(),
+        '_Row_r': nd_pairs['Row_r'].to_numpy()
+    }, columns=ND_OUTPUT_COLUMNS + ['_Article', '_Priority', '_Row_l', '_Row_r'])
+    
+    # Priority 2: RF內部調配 - 每個RF過剩店為一組，按轉出上限依次補充RF缺貨店
+    surplus_columns = ['Article_Code', 'Row', 'Shop', 'Stock', 'Cap', 'Max_Transfer', 'Method']
+    eligible = rf_surplus[rf_surplus['Max_Transfer'].to_numpy() >= 1][surplus_columns]
+    rf_pairs = _cross_pairs(eligible, rf_shortage[['Article_Code', 'Row', 'Shop', 'Stock']])
+    need = RF_TARGET_STOCK - rf_pairs['Stock_r'].to_numpy()
+    rf_qty, max_before = _cumulative_fill(rf_pairs['Row_l'].to_numpy(), need, rf_pairs['Max_Transfer'].to_numpy())
+    rf_keep = rf_qty >= 1
+    rf_pairs, rf_qty, max_before = rf_pairs[rf_keep], rf_qty[rf_keep], max_before[rf_keep]
+    methods = rf_pairs['Method'].to_numpy()
+    rf_result = pd.DataFrame({
+        '優先級': 2,
+        '類型': 'RF內部調配',
+        '產品編號': articles[rf_pairs['Article_Code'].to_numpy()],
+        '調出店鋪': rf_pairs['Shop_l'].to_numpy(),
+        '調入店鋪': rf_pairs['Shop_r'].to_numpy(),
+        '調貨數量': rf_qty.astype(np.int64),
+        '調出店庫存': rf_pairs['Stock_l'].to_numpy(),
+        '調入店庫存': rf_pairs['Stock_r'].to_numpy(),
+        '轉出上限': np.round(rf_pairs['Cap'].to_numpy(), 1),
+        '轉出方法': methods,
+        '原因': [f'{method}，可轉{before:.1f}件，實際{_format_qty(qty)}件'
+                 for method, before, qty in zip(methods, max_before, rf_qty)],
+        '_Article': rf_pairs['Article_Code'].to_numpy(),
+        '_Priority': 2,
+        '_Row_l': rf_pairs['Row_l'].to_numpy(),
+        '_Row_r': rf_pairs['Row_r'].to_numpy()
+    }, columns=RF_OUTPUT_COLUMNS + ['_Article', '_Priority', '_Row_l', '_Row_r'])
+    
+    logger.info("改進版調貨建議: %d 個產品，ND缺貨 %d 店，RF過剩 %d 店，RF缺貨 %d 店，"
+                "ND缺貨補充 %d 條，RF內部調配 %d 條",
+                len(articles), len(nd_shortage), len(rf_surplus), len(rf_shortage), len(nd_result), len(rf_result))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("RF過剩店轉出上限:\n%s", rf_surplus[['Shop', 'Stock', 'Excess', 'Cap', 'Max_Transfer', 'Method']])
+    
+    # 按產品首次出現順序排列，產品內先ND缺貨補充後RF內部調配
+    order_columns = ['_Article', '_Priority', '_Row_l', '_Row_r']
+    parts = [part for part in (nd_result, rf_result) if len(part)]
+    if not parts:
+        return pd.DataFrame()
+    result = pd.concat(parts, ignore_index=True)
+    result = result.sort_values(order_columns, kind='stable').reset_index(drop=True)
+    output_columns = ND_OUTPUT_COLUMNS + ['轉出上限'] if result.loc[0, '_Priority'] == 1 else RF_OUTPUT_COLUMNS
+    result = result[[column for column in output_columns if column in result.columns]]
+    
     
-    transfer_recommendations = []
-    
-    print("=== 改進版調貨建議處理 ===")
-    
-    for article in df['Article'].unique():
-        print(f"處理產品: {article}")
-        article_data = df[df['Article'] == article].copy()
-        
-        nd_data = article_data[article_data['RP Type'] == 'ND']
-        rf_data = article_data[article_data['RP Type'] == 'RF']
-        
-        print(f"  ND記錄: {len(nd_data)}, RF記錄: {len(rf_data)}")
-        
-        # Priority 1: ND缺貨補充 (保持原邏輯)
-        nd_shortage = nd_data[nd_data['SaSa Net Stock'] <= 0]
-        rf_surplus = rf_data[rf_data['SaSa Net Stock'] > 2]
-        
-        print(f"  ND缺貨: {len(nd_shortage)}, RF過剩: {len(rf_surplus)}")
-        
-        for _, nd_row in nd_shortage.iterrows():
-            shortage = 2 - nd_row['SaSa Net Stock']
-            
-            for _, rf_row in rf_surplus.iterrows():
-                if rf_row['Shop'] != nd_row['Shop']:
-                    available = rf_row['SaSa Net Stock'] - 2
-                    transfer_qty = min(shortage, available)
-                    
-                    if transfer_qty >= 1:  # 降低最小轉出量到1件
-                        transfer_recommendations.append({
-                            '優先級': 1,
-                            '類型': 'ND缺貨補充',
-                            '產品編號': article,
-                            '調出店鋪': rf_row['Shop'],
-                            '調入店鋪': nd_row['Shop'],
-                            '調貨數量': int(transfer_qty),
-                            '調出店庫存': rf_row['SaSa Net Stock'],
-                            '調入店庫存': nd_row['SaSa Net Stock'],
-                            '轉出方法': '原規則',
-                            '原因': f'ND缺貨{shortage}件，調入{transfer_qty}件'
-                        })
-                        shortage -= transfer_qty
-                        if shortage <= 0:
-                            break
-        
-        # Priority 2: RF內部調配 (應用改進規則)
-        rf_shortage = rf_data[rf_data['SaSa Net Stock'] <= 2]
-        
-        for _, surplus_row in rf_surplus.iterrows():
-            excess = surplus_row['SaSa Net Stock'] - 2
-            current_stock = surplus_row['SaSa Net Stock']
-            pending = surplus_row['Pending Received']
-            total_available = current_stock + pending
-            
-            # 改進的轉出限制計算
-            if current_stock <= 10:
-                # 小庫存店鋪：30%轉出，最少1件
-                transfer_cap = max(total_available * 0.3, 1)
-                method = '小庫存30%規則'
-            else:
-                # 大庫存店鋪：20%轉出，最少2件
-                transfer_cap = max(total_available * 0.2, 2)
-                method = '大庫存20%規則'
-            
-            # 實際可轉出量
-            max_transfer = min(excess, transfer_cap)
-            
-            print(f"    {surplus_row['Shop']}: 庫存{current_stock}, 過剩{excess}, 限制{transfer_cap:.1f}, 可轉{max_transfer:.1f}")
-            
-            if max_transfer >= 1:  # 最少1件才轉
-                for _, shortage_row in rf_shortage.iterrows():
-                    if surplus_row['Shop'] != shortage_row['Shop']:
-                        need = 3 - shortage_row['SaSa Net Stock']
-                        actual_transfer = min(max_transfer, need)
-                        
-                        if actual_transfer >= 1:
-                            transfer_recommendations.append({
-                                '優先級': 2,
-                                '類型': 'RF內部調配',
-                                '產品編號': article,
-                                '調出店鋪': surplus_row['Shop'],
-                                '調入店鋪': shortage_row['Shop'],
-                                '調貨數量': int(actual_transfer),
-                                '調出店庫存': surplus_row['SaSa Net Stock'],
-                                '調入店庫存': shortage_row['SaSa Net Stock'],
-                                '轉出上限': round(transfer_cap, 1),
-                                '轉出方法': method,
-                                '原因': f'{method}，可轉{max_transfer:.1f}件，實際{actual_transfer}件'
-                            })
-                            max_transfer -= actual_transfer
-                            if max_transfer < 1:
-                                break
-    
-    return pd.DataFrame(transfer_recommendations)
+    return result
 
 
 def compare_results_tc(original_df, improved_df):
@@ -252,6 +315,7 @@ if __name__ == "__main__":
         original_results = pd.DataFrame()
     
     # 生成改進版結果
+    engine_log.configure_logging()
     improved_results = improved_process_data_tc(df)
     
     # 保存改進版結果（繁體中文版）